@@ -0,0 +1,79 @@
+import os
+import sys
+import http_client
+
+# Directory holding one json file per cached ABI (override with ABI_CACHE_DIR):
+DEFAULT_CACHE_DIR = ".abi_cache"
+
+# Maximum number of ABIs kept on disk, least recently used are evicted first:
+MAX_ENTRIES = 1024
+
+# Set to True to ignore cached ABIs and fetch them again from Etherscan:
+refresh = False
+
+# ABIs already loaded in this process:
+memo = {}
+
+def cache_key(abi_address, code_hash=None):
+  key = str(abi_address).lower()
+  if code_hash:
+    key += "_" + str(code_hash).lower().replace("0x", "")
+  return key
+
+def get_cache_dir():
+  return os.environ.get("ABI_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+def cache_path(key):
+  return os.path.join(get_cache_dir(), key + ".json")
+
+def read_cached(key):
+  path = cache_path(key)
+  try:
+    with open(path, 'r') as f:
+      abi = f.read()
+  except FileNotFoundError:
+    return None
+  # Touch the file so eviction keeps recently used ABIs:
+  os.utime(path)
+  return abi
+
+def write_cached(key, abi):
+  os.makedirs(get_cache_dir(), exist_ok=True)
+  path = cache_path(key)
+  tmp_path = path + ".%d.tmp" % (os.getpid())
+  with open(tmp_path, 'w') as f:
+    f.write(abi)
+  os.replace(tmp_path, path)
+  evict()
+
+def evict():
+  entries = [entry for entry in os.scandir(get_cache_dir()) if entry.name.endswith(".json")]
+  if len(entries) <= MAX_ENTRIES:
+    return
+  entries.sort(key=lambda entry: entry.stat().st_mtime)
+  for entry in entries[:len(entries) - MAX_ENTRIES]:
+    try:
+      os.remove(entry.path)
+    except FileNotFoundError:
+      pass
+
+def fetch_abi(abi_address):
+  return http_client.etherscan({'module': 'contract', 'action': 'getabi', 'address': str(abi_address)})
+
+# Optional code_hash (e.g. keccak of deployed bytecode) keeps separate entries for upgraded contracts:
+def load_abi(abi_address, code_hash=None):
+  key = cache_key(abi_address, code_hash)
+  if key in memo:
+    return memo[key]
+  abi = None
+  if not refresh:
+    abi = read_cached(key)
+  if abi is None:
+    # Unverified contracts have no ABI:
+    try:
+      abi = fetch_abi(abi_address)
+    except http_client.EtherscanError as error:
+      sys.exit("Failed loading ABI of %s: %s" % (abi_address, error))
+    write_cached(key, abi)
+  memo[key] = abi
+  return abi
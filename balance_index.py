@@ -0,0 +1,217 @@
+import json
+import os
+import numpy
+import logscan
+import block_index
+import sync_series
+
+# Directory with the balance index (override with BALANCE_INDEX_DIR):
+DEFAULT_INDEX_DIR = ".balance_index"
+
+# ERC-20 transfer event signature (mints are from and burns are to zero address):
+TRANSFER_EVENT = 'Transfer(address,address,uint256)'
+
+# EMP events moving the contract state forward, with the index of the state in EMP_STATES they lead to:
+STATE_EVENTS = {
+  'ContractExpired(address)': 1,
+  'EmergencyShutdown(address,uint256,uint256)': 1,
+  'SettleExpiredPosition(address,uint256,uint256)': 2,
+}
+
+# Zero address as indexed event topic:
+ZERO_TOPIC = '0x' + '00' * 32
+
+# Maximum number of addresses (or address topics) in a single eth_getLogs filter:
+ADDRESS_BATCH = 500
+
+# Running values tracked for every contract: collateral tokens held by the contract, synth supply and EMP contract state:
+KINDS = ('collateral', 'synth', 'state')
+
+# One row per series and block with events: block, series (contract position * len(KINDS) + kind), number of events
+# applied so far and running value at the end of the block as big-endian integer. Each column is stored in its own file:
+COLUMNS = numpy.dtype([
+  ('block', '>u8'),
+  ('series', '>u4'),
+  ('events', '>u4'),
+  ('value', 'V32'),
+])
+
+def address_topic(address):
+  return '0x' + '00' * 12 + address[2:].lower()
+
+def log_value(event):
+  data = bytes(event['data']) if not isinstance(event['data'], str) else bytes.fromhex(event['data'][2:])
+  return int.from_bytes(data[:32], 'big')
+
+def log_topic(topic):
+  return topic if isinstance(topic, str) else topic.hex()
+
+def batches(items):
+  return [items[i:i + ADDRESS_BATCH] for i in range(0, len(items), ADDRESS_BATCH)]
+
+class BalanceIndex:
+  def __init__(self, w3, path=None):
+    self.w3 = w3
+    self.index_dir = path or os.environ.get("BALANCE_INDEX_DIR", DEFAULT_INDEX_DIR)
+    os.makedirs(self.index_dir, exist_ok=True)
+    self.meta_path = os.path.join(self.index_dir, "index.json")
+    self.transfer_topic = w3.keccak(text=TRANSFER_EVENT).hex()
+    self.state_topics = {w3.keccak(text=signature).hex(): state for signature, state in STATE_EVENTS.items()}
+    self.load()
+
+  def column_path(self, name):
+    return os.path.join(self.index_dir, name + ".bin")
+
+  def load(self):
+    try:
+      with open(self.meta_path, 'r') as f:
+        meta = json.load(f)
+    except FileNotFoundError:
+      meta = {'rows': 0, 'contracts': []}
+    # Contracts in series order, each with the last block its logs are indexed up to:
+    self.contracts = meta['contracts']
+    self.positions = {contract['address']: position for position, contract in enumerate(self.contracts)}
+    records = numpy.zeros(meta['rows'], dtype=COLUMNS)
+    for name in COLUMNS.names:
+      path = self.column_path(name)
+      column = numpy.fromfile(path, dtype=COLUMNS[name]) if os.path.exists(path) else numpy.zeros(0, dtype=COLUMNS[name])
+      if len(column) < meta['rows']:
+        raise ValueError("Balance index column %s holds %d rows, expected %d" % (path, len(column), meta['rows']))
+      # Drop rows appended after the last saved checkpoint (e.g. interrupted update):
+      if len(column) > meta['rows']:
+        with open(path, 'r+b') as f:
+          f.truncate(meta['rows'] * COLUMNS[name].itemsize)
+      records[name] = column[:meta['rows']]
+    self.records = records
+    # Rows above finality depth are kept only in memory:
+    self.tail = numpy.zeros(0, dtype=COLUMNS)
+    self.lookup_order = None
+    self.lookup_keys = None
+    # Running (value, events) of every series at the last indexed block of its contract:
+    self.values = {}
+    if len(records) > 0:
+      order = numpy.lexsort((records['block'], records['series']))
+      series = records['series'][order]
+      for i in numpy.flatnonzero(numpy.append(series[1:] != series[:-1], True)):
+        record = records[order[i]]
+        self.values[int(record['series'])] = (sync_series.to_int(record['value']), int(record['events']))
+
+  def save_checkpoint(self, records):
+    for name in COLUMNS.names:
+      with open(self.column_path(name), 'ab') as f:
+        records[name].tofile(f)
+    self.records = numpy.concatenate([self.records, records])
+    self.lookup_keys = None
+    tmp_path = self.meta_path + ".%d.tmp" % (os.getpid())
+    with open(tmp_path, 'w') as f:
+      json.dump({'rows': len(self.records), 'contracts': self.contracts}, f)
+    os.replace(tmp_path, self.meta_path)
+
+  def all_records(self):
+    if len(self.tail) == 0:
+      return self.records
+    return numpy.concatenate([self.records, self.tail])
+
+  def series_id(self, address, kind):
+    return self.positions[address] * len(KINDS) + KINDS.index(kind)
+
+  def start_block(self, address):
+    return self.contracts[self.positions[address]]['start_block']
+
+  # Logs of the block range changing any series of the contracts as (block, log index, series, amount) entries, amount is
+  # a signed balance change or the state an EMP moves to:
+  def get_logs(self, contracts, from_block, to_block):
+    entries = []
+    synths = {contract['synth_address'].lower(): self.series_id(contract['address'], 'synth') for contract in contracts}
+    holders = {address_topic(contract['address']): contract for contract in contracts}
+    emps = {contract['address'].lower(): self.series_id(contract['address'], 'state') for contract in contracts if contract['type'] == 'emp'}
+    for synth_addresses in batches([contract['synth_address'] for contract in contracts]):
+      for topics, sign in (([self.transfer_topic, ZERO_TOPIC], 1), ([self.transfer_topic, None, ZERO_TOPIC], -1)):
+        for event in logscan.get_logs(self.w3, {'address': synth_addresses, 'topics': topics}, from_block, to_block):
+          entries.append((event['blockNumber'], event['logIndex'], synths[event['address'].lower()], sign * log_value(event)))
+    # Collateral tokens are shared by many contracts, hence, transfers are filtered by holder topics of any token:
+    for holder_topics in batches(list(holders)):
+      for topic_index, sign in ((1, -1), (2, 1)):
+        topics = [self.transfer_topic, None, None]
+        topics[topic_index] = holder_topics
+        for event in logscan.get_logs(self.w3, {'topics': topics[:topic_index + 1]}, from_block, to_block):
+          contract = holders[log_topic(event['topics'][topic_index])]
+          if event['address'].lower() == contract['collateral_address'].lower():
+            entries.append((event['blockNumber'], event['logIndex'], self.series_id(contract['address'], 'collateral'), sign * log_value(event)))
+    for emp_addresses in batches([contract['address'] for contract in contracts if contract['type'] == 'emp']):
+      for event in logscan.get_logs(self.w3, {'address': emp_addresses, 'topics': [list(self.state_topics)]}, from_block, to_block):
+        entries.append((event['blockNumber'], event['logIndex'], emps[event['address'].lower()], self.state_topics[log_topic(event['topics'][0])]))
+    return entries
+
+  # Apply entries in chain order to running values, returning one row per series and block with events:
+  def replay(self, entries, values):
+    rows = {}
+    for block, log_index, series, amount in sorted(entries):
+      value, events = values.get(series, (0, 0))
+      if KINDS[series % len(KINDS)] == 'state':
+        value = max(value, amount)
+      else:
+        value += amount
+      if value < 0:
+        raise ValueError("Negative %s balance of contract %s at block %d" % (KINDS[series % len(KINDS)], self.contracts[series // len(KINDS)]['address'], block))
+      values[series] = (value, events + 1)
+      rows[(block, series)] = (value, events + 1)
+    return numpy.array([(block, series, events, value.to_bytes(32, 'big')) for (block, series), (value, events) in rows.items()], dtype=COLUMNS)
+
+  # Index logs of contracts from the block after their last indexed block, persisting every chunk as it is processed:
+  def index(self, contracts, from_block, to_block):
+    for start in range(from_block, to_block + 1, logscan.CHUNK_SIZE):
+      end = min(start + logscan.CHUNK_SIZE - 1, to_block)
+      records = self.replay(self.get_logs(contracts, start, end), self.values)
+      for contract in contracts:
+        contract['last_block'] = end
+      self.save_checkpoint(records)
+
+  # Stream new logs of all contracts (dicts with address, type, collateral_address, synth_address and start_block) up to the chain head.
+  # Contracts added since the last update (or left behind by an interrupted one) first catch up with the others:
+  def update(self, contracts, head=None):
+    if head is None:
+      head = self.w3.eth.blockNumber
+    safe_block = head - block_index.FINALITY_DEPTH
+    for contract in contracts:
+      if contract['address'] not in self.positions:
+        self.positions[contract['address']] = len(self.contracts)
+        self.contracts.append(dict(contract, last_block=contract['start_block'] - 1))
+    while self.contracts != []:
+      last_blocks = sorted(set(contract['last_block'] for contract in self.contracts))
+      if last_blocks[0] >= safe_block:
+        break
+      to_block = min(last_blocks[1], safe_block) if len(last_blocks) > 1 else safe_block
+      self.index([contract for contract in self.contracts if contract['last_block'] == last_blocks[0]], last_blocks[0] + 1, to_block)
+    self.tail = numpy.zeros(0, dtype=COLUMNS)
+    self.lookup_keys = None
+    if self.contracts != [] and safe_block < head:
+      from_block = min(contract['last_block'] for contract in self.contracts) + 1
+      # Contracts deployed within finality depth are indexed from their start, logs of other contracts only after the safe block:
+      entries = [entry for entry in self.get_logs(self.contracts, from_block, head) if entry[0] > self.contracts[entry[2] // len(KINDS)]['last_block']]
+      self.tail = self.replay(entries, dict(self.values))
+
+  # Running values and event counts of series at blocks, series without events by then are zero:
+  def lookup(self, series, blocks):
+    records = self.all_records()
+    if self.lookup_keys is None:
+      self.lookup_order = numpy.lexsort((records['block'], records['series']))
+      self.lookup_keys = (records['series'][self.lookup_order].astype(numpy.uint64) << numpy.uint64(32)) | records['block'][self.lookup_order].astype(numpy.uint64)
+    series = numpy.asarray(series, dtype=numpy.uint64)
+    keys = (series << numpy.uint64(32)) | numpy.asarray(blocks, dtype=numpy.uint64)
+    index = numpy.searchsorted(self.lookup_keys, keys, side='right') - 1
+    values = []
+    events = []
+    for i, series_id in zip(index, series):
+      record = records[self.lookup_order[i]] if i >= 0 else None
+      if record is None or record['series'] != series_id:
+        values.append(0)
+        events.append(0)
+        continue
+      values.append(sync_series.to_int(record['value']))
+      events.append(int(record['events']))
+    return values, events
+
+  # Values of one kind for each contract address at the corresponding block:
+  def values_at(self, addresses, kind, blocks):
+    return self.lookup([self.series_id(address, kind) for address in addresses], blocks)
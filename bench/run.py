@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import stand_in
+
+# Repository root with the benchmarked scripts:
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Benchmarks run by default:
+BENCHMARKS = ('track_uma', 'track_uma_discover', 'track_uma_series', 'track_uma_series_logs', 'twap', 'twap_pools', 'twap_series', 'twap_sync', 'twap_v3', 'twap_v3_series', 'exit_pool', 'block_timestamp', 'compound_repay', 'startup_uma', 'startup_twap', 'startup_exit_pool', 'startup_compound_repay', 'startup_block')
+
+# Synthetic user holding pool shares and an EMP position:
+USER_ADDRESS = stand_in.make_address('user')
+
+def benchmark_commands(chain, work_dir):
+  pool = chain.pools[0]
+  window_end = pool.blocks[-1]
+  series_end = stand_in.block_timestamp(window_end)
+  timestamps_file = os.path.join(work_dir, 'timestamps.txt')
+  with open(timestamps_file, 'w') as f:
+    f.write('\n'.join(str(series_end - i * 3600) for i in range(1000)))
+  # Throttling would dominate the numbers, hence, lift the rate limits:
+  unthrottled = ['--etherscan-rps', '1000', '--node-rps', '1000']
+  return {
+    'track_uma': ['track_uma.py', '-w', '8'] + unthrottled,
+    'track_uma_discover': ['track_uma.py', '-d', '-w', '8'] + unthrottled,
+    'track_uma_series': ['track_uma.py', '-d', '-w', '8', '--from', str(series_end - 30 * 86400), '--to', str(series_end), '--output', 'series.npz'] + unthrottled,
+    'track_uma_series_logs': ['track_uma.py', '-d', '-w', '8', '--logs', '--from', str(series_end - 30 * 86400), '--to', str(series_end), '--output', 'series.npz'] + unthrottled,
+    'twap': ['twap.py', pool.address, '-b', str(window_end), '-p', '60'],
+    'twap_pools': ['twap.py'] + [chain_pool.address for chain_pool in chain.pools] + ['-b', str(window_end), '-p', '60', '-o', 'twap.csv'],
+    'twap_series': ['twap.py', pool.address, '-p', '60', '--series', str(series_end - 86400), str(series_end), '-s', '60', '-w', '8', '-o', 'twap.csv'],
+    'twap_sync': ['twap.py', pool.address, '-p', '60', '--series', str(series_end - 86400), str(series_end), '-s', '10', '-e', 'sync', '-o', 'twap.csv'],
+    'twap_v3': ['twap.py', chain.v3_pool.address, '-t', str(series_end), '-p', '60'],
+    'twap_v3_series': ['twap.py', chain.v3_pool.address, '-p', '60', '--series', str(series_end - 86400), str(series_end), '-s', '10', '-o', 'twap.csv'],
+    'exit_pool': ['exit_pool.py', chain.balancer_address, USER_ADDRESS],
+    'block_timestamp': ['block_timestamp.py', '--bulk', 'timestamps', '-i', timestamps_file],
+    'compound_repay': ['compound_repay.py', chain.ctoken_addresses[0], USER_ADDRESS],
+    # Startup time of the defi entry point up to argument parsing:
+    'startup_uma': ['defi.py', 'uma', '--help'],
+    'startup_twap': ['defi.py', 'twap', '--help'],
+    'startup_exit_pool': ['defi.py', 'exit-pool', '--help'],
+    'startup_compound_repay': ['defi.py', 'compound-repay', '--help'],
+    'startup_block': ['defi.py', 'block', '--help'],
+  }
+
+def write_config(chain, work_dir):
+  price_identifier = chain.exit_emp.price_identifier.strip(b'\x00').decode()
+  with open(os.path.join(work_dir, 'config_exit_pool.json'), 'w') as f:
+    json.dump({'price_id_coingecko': {price_identifier: {'id': 'synth', 'vs_currency': 'usd', 'inverse': False}}}, f)
+
+def server_env(url):
+  env = dict(os.environ)
+  env.update({
+    'ETH_NODE_API': url,
+    'ETHERSCAN_API': url + '/api',
+    'COINGECKO_API': url + '/api/v3',
+    'ETHERSCAN_KEY': 'bench',
+    # Keep all caches in the working directory, even if .env points elsewhere:
+    'ABI_CACHE_DIR': '.abi_cache',
+    'BLOCK_INDEX_FILE': '.block_index',
+    'RPC_CACHE_FILE': 'rpc_cache.sqlite',
+    'SYNC_SERIES_DIR': '.sync_series',
+    'BALANCE_INDEX_DIR': '.balance_index',
+  })
+  return env
+
+def request_stats(url):
+  with urllib.request.urlopen(url + '/stats?reset=1') as response:
+    return json.loads(response.read())
+
+# Run one script, returning wall time, peak memory and requests served by the stand-in:
+def run_script(command, work_dir, env, url):
+  request_stats(url)
+  started = time.monotonic()
+  process = subprocess.Popen([sys.executable, os.path.join(ROOT, command[0])] + command[1:], cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+  stderr = process.stderr.read()
+  pid, status, usage = os.wait4(process.pid, 0)
+  process.returncode = os.waitstatus_to_exitcode(status)
+  wall_seconds = time.monotonic() - started
+  counts = request_stats(url)
+  return {
+    'wall_seconds': wall_seconds,
+    # Linux reports ru_maxrss in kilobytes:
+    'peak_memory_mb': usage.ru_maxrss / 1024,
+    'requests': sum(counts.values()),
+    'request_counts': counts,
+    'exit_code': process.returncode,
+    'error': stderr.decode(errors='replace').strip().splitlines()[-1] if process.returncode != 0 and stderr.strip() else None,
+  }
+
+def print_results(results):
+  print('%-24s %-5s %10s %10s %12s %6s' % ('benchmark', 'run', 'wall s', 'requests', 'peak MB', 'exit'))
+  for result in results:
+    print('%-24s %-5s %10.2f %10d %12.1f %6d' % (result['benchmark'], result['run'], result['wall_seconds'], result['requests'], result['peak_memory_mb'], result['exit_code']))
+    if result['error']:
+      print('  %s' % (result['error']))
+
+parser = argparse.ArgumentParser()
+parser.add_argument("benchmarks", nargs="*", help="benchmarks to run (default: all): %s" % (', '.join(BENCHMARKS)))
+parser.add_argument("-c", "--contracts", type=int, default=2000, help="number of synthetic UMA registry contracts")
+parser.add_argument("-s", "--sync-updates", type=int, default=5000, help="number of Sync events of each synthetic Uniswap pool")
+parser.add_argument("-l", "--latency", type=float, default=0.0, help="per-request latency of the stand-in in seconds")
+parser.add_argument("--warm", action="store_true", help="run every benchmark a second time with caches left by the first run")
+parser.add_argument("-o", "--output", type=str, help="write results to this json file")
+args = parser.parse_args()
+
+for name in args.benchmarks:
+  if name not in BENCHMARKS:
+    sys.exit("Unknown benchmark: %s" % (name))
+
+print('Generating synthetic chain with %d contracts' % (args.contracts), file=sys.stderr)
+chain = stand_in.Chain(contracts=args.contracts, sync_updates=args.sync_updates)
+server, server_stand_in = stand_in.serve(chain, latency=args.latency)
+url = 'http://127.0.0.1:%d' % (server.server_address[1])
+env = server_env(url)
+
+results = []
+for name in args.benchmarks or BENCHMARKS:
+  with tempfile.TemporaryDirectory(prefix='bench-') as work_dir:
+    write_config(chain, work_dir)
+    command = benchmark_commands(chain, work_dir)[name]
+    for run in ('cold', 'warm') if args.warm else ('cold',):
+      print('Running %s (%s)' % (name, run), file=sys.stderr)
+      result = run_script(command, work_dir, env, url)
+      result.update({'benchmark': name, 'run': run, 'command': command})
+      results.append(result)
+
+print_results(results)
+
+if args.output:
+  with open(args.output, 'w') as f:
+    json.dump({'contracts': args.contracts, 'sync_updates': args.sync_updates, 'latency': args.latency, 'results': results}, f, indent=2)
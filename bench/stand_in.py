@@ -0,0 +1,907 @@
+#!/usr/bin/env python3
+
+import argparse
+import bisect
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from eth_utils import keccak, to_checksum_address, function_signature_to_4byte_selector
+try:
+  from eth_abi import encode as encode_abi, decode as decode_abi
+except ImportError:
+  from eth_abi import encode_abi, decode_abi
+
+# Chain head of the synthetic chain (after Multicall3 deployment):
+HEAD_BLOCK = 16000000
+
+# Multicall3 contract address:
+MULTICALL_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
+# Mints are transfers from and burns are transfers to the zero address:
+ZERO_ADDRESS = "0x" + "00" * 20
+
+# UMA Finder contract address:
+FINDER_ADDRESS = "0x40f941E48A552bF496B154Af6bf55725f18D77c3"
+
+# WETH address, its ABI is used for all ERC-20 tokens:
+WETH_ADDRESS = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
+
+EMP_CREATE = 'CreatedExpiringMultiParty(address,address)'
+PERP_CREATE = 'CreatedPerpetual(address,address)'
+JARVIS_CREATE = 'DerivativeDeployed(uint8,address,address)'
+JARVIS_SELF_CREATE = 'SelfMintingDerivativeDeployed(uint8,address)'
+REGISTRY_NEW_CONTRACT = 'NewContractRegistered(address,address,address[])'
+SYNC_EVENT = 'Sync(uint112,uint112)'
+TRANSFER_EVENT = 'Transfer(address,address,uint256)'
+CONTRACT_EXPIRED = 'ContractExpired(address)'
+SETTLE_EXPIRED = 'SettleExpiredPosition(address,uint256,uint256)'
+
+# Observation cardinality of the synthetic Uniswap V3 pool:
+V3_CARDINALITY = 60
+
+# Deposits, redemptions and fee payments of every synthetic UMA contract after its creation:
+ACTIVITY_EVENTS = 8
+
+def block_timestamp(block):
+  return 1438269973 + 13 * block - block % 3
+
+def make_address(*seed):
+  return to_checksum_address(keccak(text=':'.join(str(part) for part in seed))[12:])
+
+def make_hash(*seed):
+  return '0x' + keccak(text=':'.join(str(part) for part in seed)).hex()
+
+def topic(signature):
+  return '0x' + keccak(text=signature).hex()
+
+def address_topic(address):
+  return '0x' + '00' * 12 + address[2:].lower()
+
+def int_topic(value):
+  return '0x' + value.to_bytes(32, 'big').hex()
+
+def transfer_log(token, sender, recipient, amount):
+  return {'address': token, 'topics': [topic(TRANSFER_EVENT), address_topic(sender), address_topic(recipient)], 'data': int_topic(amount)}
+
+# ABI json entry from type strings like 'uint256', '(uint256)' or '(address,bool,bytes)[]':
+def abi_param(param_type, name=''):
+  if param_type.startswith('('):
+    depth = 0
+    end = 0
+    for i, char in enumerate(param_type):
+      if char == '(':
+        depth += 1
+      elif char == ')':
+        depth -= 1
+        if depth == 0:
+          end = i
+          break
+    inner = param_type[1:end]
+    components = []
+    depth = 0
+    part = ''
+    for char in inner:
+      if char == ',' and depth == 0:
+        components.append(part)
+        part = ''
+        continue
+      if char == '(':
+        depth += 1
+      elif char == ')':
+        depth -= 1
+      part += char
+    if part:
+      components.append(part)
+    return {'name': name, 'type': 'tuple' + param_type[end + 1:], 'components': [abi_param(component, 'field%d' % (i)) for i, component in enumerate(components)]}
+  return {'name': name, 'type': param_type}
+
+def abi_function(name, inputs, outputs, mutability='view'):
+  return {'type': 'function', 'name': name, 'stateMutability': mutability, 'inputs': [abi_param(param_type, 'arg%d' % (i)) for i, param_type in enumerate(inputs)], 'outputs': [abi_param(param_type) for param_type in outputs]}
+
+class Contract:
+  # {name: ([input types], [output types])}:
+  functions = {}
+
+  def abi(self):
+    return [abi_function(name, inputs, outputs) for name, (inputs, outputs) in self.functions.items()]
+
+  # {selector: (name, inputs, outputs)} of each class:
+  def selectors(self):
+    cls = type(self)
+    if '_selectors' not in cls.__dict__:
+      cls._selectors = {function_signature_to_4byte_selector(name + '(' + ','.join(inputs) + ')'): (name, inputs, outputs) for name, (inputs, outputs) in cls.functions.items()}
+    return cls._selectors
+
+  def dispatch(self, data, block):
+    if data[:4] not in self.selectors():
+      raise ValueError('execution reverted')
+    name, inputs, outputs = self.selectors()[data[:4]]
+    args = decode_abi(inputs, data[4:]) if inputs else ()
+    try:
+      result = getattr(self, name)(block, *args)
+    except (IndexError, KeyError, ZeroDivisionError):
+      raise ValueError('execution reverted')
+    if len(outputs) == 1:
+      result = (result,)
+    return encode_abi(outputs, result)
+
+class Token(Contract):
+  functions = {
+    'name': ([], ['string']),
+    'symbol': ([], ['string']),
+    'decimals': ([], ['uint8']),
+    'totalSupply': ([], ['uint256']),
+    'balanceOf': (['address'], ['uint256']),
+  }
+
+  def __init__(self, symbol, decimals, supply, created=0):
+    self.token_symbol = symbol
+    self.token_decimals = decimals
+    self.supply = supply
+    self.created = created
+
+  def name(self, block):
+    return self.token_symbol
+
+  def symbol(self, block):
+    return self.token_symbol
+
+  def decimals(self, block):
+    return self.token_decimals
+
+  def totalSupply(self, block):
+    return self.supply + (block - self.created) * 10 ** self.token_decimals
+
+  def balanceOf(self, block, address):
+    return int(address[-4:], 16) * 10 ** self.token_decimals
+
+# Synth token with supply following mints and burns of its derivative:
+class Synth(Token):
+  def __init__(self, derivative, symbol):
+    Token.__init__(self, symbol, 18, 0, derivative.created)
+    self.derivative = derivative
+
+  def totalSupply(self, block):
+    return self.derivative.snapshot(block)[2]
+
+class Finder(Contract):
+  functions = {'getImplementationAddress': (['bytes32'], ['address'])}
+
+  def __init__(self, registry_address):
+    self.registry_address = registry_address
+
+  def getImplementationAddress(self, block, name):
+    return self.registry_address
+
+class Registry(Contract):
+  functions = {
+    'getAllRegisteredContracts': ([], ['address[]']),
+    'registeredContracts': (['uint256'], ['address']),
+  }
+
+  def __init__(self, chain):
+    self.chain = chain
+
+  def registered(self, block):
+    return [derivative.address for derivative in self.chain.derivatives if derivative.created <= block]
+
+  def getAllRegisteredContracts(self, block):
+    return self.registered(block)
+
+  def registeredContracts(self, block, index):
+    return self.registered(block)[index]
+
+class Derivative(Contract):
+  def __init__(self, chain, index, contract_type, created):
+    self.index = index
+    self.contract_type = contract_type
+    self.created = created
+    self.address = make_address('derivative', index)
+    self.deployer = make_address('deployer', index % 17)
+    self.collateral_address = chain.collateral_addresses[index % len(chain.collateral_addresses)]
+    self.synth_address = make_address('synth', index)
+    self.price_identifier = ('SYNTH%dUSD' % (index)).encode().ljust(32, b'\x00')
+    self.collateral = 10 ** 24 + index * 10 ** 20
+    self.creation_tx = make_hash('create', index)
+    # Raw collateral, cumulative fee multiplier, synth supply and contract state after each activity (see Chain.add_activity):
+    self.history_blocks = [created]
+    self.history = [(0, 10 ** 18, 0, 0)]
+
+  def snapshot(self, block):
+    return self.history[bisect.bisect_right(self.history_blocks, block) - 1]
+
+  def add_snapshot(self, block, raw_collateral, fee_multiplier, supply, state):
+    self.history_blocks.append(block)
+    self.history.append((raw_collateral, fee_multiplier, supply, state))
+
+  def collateralCurrency(self, block):
+    return self.collateral_address
+
+  def tokenCurrency(self, block):
+    return self.synth_address
+
+  def pfc(self, block):
+    raw_collateral, fee_multiplier, supply, state = self.snapshot(block)
+    return (raw_collateral * fee_multiplier // 10 ** 18,)
+
+  def collateralRequirement(self, block):
+    return 125 * 10 ** 16
+
+  def priceIdentifier(self, block):
+    return self.price_identifier
+
+  def minSponsorTokens(self, block):
+    return 100 * 10 ** 18
+
+  def liquidationLiveness(self, block):
+    return 7200
+
+  def withdrawalLiveness(self, block):
+    return 7200
+
+  def cumulativeFeeMultiplier(self, block):
+    return self.snapshot(block)[1]
+
+  def positions(self, block, address):
+    return ((50 * 10 ** 18,), 0, (0,), (100 * 10 ** 18,), 0)
+
+class EMP(Derivative):
+  functions = dict((name, ([], ['address'])) for name in ('collateralCurrency', 'tokenCurrency'))
+  functions.update({
+    'pfc': ([], ['(uint256)']),
+    'collateralRequirement': ([], ['uint256']),
+    'priceIdentifier': ([], ['bytes32']),
+    'minSponsorTokens': ([], ['uint256']),
+    'liquidationLiveness': ([], ['uint256']),
+    'withdrawalLiveness': ([], ['uint256']),
+    'contractState': ([], ['uint8']),
+    'expirationTimestamp': ([], ['uint256']),
+    'cumulativeFeeMultiplier': ([], ['uint256']),
+    'positions': (['address'], ['((uint256),uint256,(uint256),(uint256),uint256)']),
+  })
+
+  def expirationTimestamp(self, block):
+    return block_timestamp(self.created) + 90 * 86400
+
+  def contractState(self, block):
+    return self.snapshot(block)[3]
+
+class Perpetual(Derivative):
+  functions = dict((name, spec) for name, spec in EMP.functions.items() if name not in ('contractState', 'expirationTimestamp'))
+
+class Jarvis(Derivative):
+  functions = {
+    'collateralCurrency': ([], ['address']),
+    'tokenCurrency': ([], ['address']),
+    'pfc': ([], ['(uint256)']),
+    'liquidatableData': ([], ['(uint256,uint256,(uint256))']),
+    'positionManagerData': ([], ['(address,address,bytes32,uint256,(uint256))']),
+  }
+
+  def liquidatableData(self, block):
+    return (0, 7200, (125 * 10 ** 16,))
+
+  def positionManagerData(self, block):
+    if self.contract_type == 'jarvis_v1':
+      return (self.deployer, self.price_identifier, 7200, (10 ** 18,), self.deployer)
+    return (self.deployer, self.deployer, self.price_identifier, 7200, (10 ** 18,))
+
+class JarvisV1(Jarvis):
+  functions = dict(Jarvis.functions)
+  functions['positionManagerData'] = ([], ['(address,bytes32,uint256,(uint256),address)'])
+
+class UniswapPair(Contract):
+  functions = {
+    'token0': ([], ['address']),
+    'token1': ([], ['address']),
+    'getReserves': ([], ['uint112', 'uint112', 'uint32']),
+    'price0CumulativeLast': ([], ['uint256']),
+    'price1CumulativeLast': ([], ['uint256']),
+  }
+
+  # Random reserve updates between first and last block, cumulative prices as in UniswapV2Pair._update:
+  def __init__(self, address, token0, token1, first_block, last_block, updates, seed):
+    rng = random.Random(seed)
+    self.address = address
+    self.token0_address = token0
+    self.token1_address = token1
+    self.blocks = sorted(rng.sample(range(first_block, last_block), updates))
+    self.records = []
+    reserve0 = 0
+    reserve1 = 0
+    price0_cumulative = 0
+    price1_cumulative = 0
+    timestamp_last = 0
+    for block in self.blocks:
+      timestamp = block_timestamp(block)
+      if reserve0 and reserve1:
+        price0_cumulative += (reserve1 * 2 ** 112 // reserve0) * (timestamp - timestamp_last)
+        price1_cumulative += (reserve0 * 2 ** 112 // reserve1) * (timestamp - timestamp_last)
+      reserve0 = rng.randint(10 ** 23, 2 * 10 ** 23)
+      reserve1 = rng.randint(10 ** 11, 2 * 10 ** 11)
+      timestamp_last = timestamp
+      self.records.append((reserve0, reserve1, timestamp_last, price0_cumulative, price1_cumulative))
+
+  def record(self, block):
+    i = bisect.bisect_right(self.blocks, block) - 1
+    if i < 0:
+      return (0, 0, 0, 0, 0)
+    return self.records[i]
+
+  def token0(self, block):
+    return self.token0_address
+
+  def token1(self, block):
+    return self.token1_address
+
+  def getReserves(self, block):
+    reserve0, reserve1, timestamp_last, price0_cumulative, price1_cumulative = self.record(block)
+    return (reserve0, reserve1, timestamp_last % 2 ** 32)
+
+  def price0CumulativeLast(self, block):
+    return self.record(block)[3]
+
+  def price1CumulativeLast(self, block):
+    return self.record(block)[4]
+
+  def logs(self):
+    return [{
+      'address': self.address,
+      'topics': [topic(SYNC_EVENT)],
+      'data': '0x' + encode_abi(['uint112', 'uint112'], [record[0], record[1]]).hex(),
+      'blockNumber': block,
+      'transactionHash': make_hash('sync', self.address, block),
+      'logIndex': 0,
+    } for block, record in zip(self.blocks, self.records)]
+
+class UniswapV3Pool(Contract):
+  functions = {
+    'token0': ([], ['address']),
+    'token1': ([], ['address']),
+    'slot0': ([], ['uint160', 'int24', 'uint16', 'uint16', 'uint16', 'uint8', 'bool']),
+    'observations': (['uint256'], ['uint32', 'int56', 'uint160', 'bool']),
+    'observe': (['uint32[]'], ['int56[]', 'uint160[]']),
+  }
+
+  # Random tick walk with one swap per block in swap blocks. Observations are written in a ring buffer of cardinality slots
+  # before each swap, with the tick cumulative of the tick in force until then as in Oracle.write:
+  def __init__(self, address, token0, token1, first_block, last_block, swaps, cardinality, seed):
+    rng = random.Random(seed)
+    self.address = address
+    self.token0_address = token0
+    self.token1_address = token1
+    self.cardinality = cardinality
+    self.first_block = first_block
+    self.blocks = sorted(rng.sample(range(first_block + 1, last_block), swaps))
+    # Observation n with (timestamp, tick cumulative) and the tick following it, observation 0 is written on initialization:
+    self.records = [(block_timestamp(first_block), 0)]
+    self.ticks = [-200000]
+    for block in self.blocks:
+      timestamp, tick_cumulative = self.records[-1]
+      self.records.append((block_timestamp(block), tick_cumulative + self.ticks[-1] * (block_timestamp(block) - timestamp)))
+      self.ticks.append(max(-210000, min(-190000, self.ticks[-1] + rng.randint(-200, 200))))
+    self.timestamps = [record[0] for record in self.records]
+
+  # Index of the latest observation written by the block:
+  def latest(self, block):
+    if block < self.first_block:
+      raise ValueError('execution reverted')
+    return bisect.bisect_right(self.blocks, block)
+
+  def token0(self, block):
+    return self.token0_address
+
+  def token1(self, block):
+    return self.token1_address
+
+  def slot0(self, block):
+    n = self.latest(block)
+    tick = self.ticks[n]
+    return (int(1.0001 ** (tick / 2) * 2 ** 96), tick, n % self.cardinality, self.cardinality, self.cardinality, 0, True)
+
+  def observations(self, block, index):
+    n = self.latest(block)
+    if index >= self.cardinality:
+      raise ValueError('execution reverted')
+    # Latest observation stored in this slot:
+    n = n - (n - index) % self.cardinality
+    if n < 0:
+      return (0, 0, 0, False)
+    timestamp, tick_cumulative = self.records[n]
+    return (timestamp % 2 ** 32, tick_cumulative, 0, True)
+
+  # Tick cumulatives secondsAgos before the block timestamp, reverting with OLD before the oldest observation in the buffer:
+  def observe(self, block, seconds_agos):
+    n = self.latest(block)
+    oldest_timestamp = self.timestamps[max(0, n - self.cardinality + 1)]
+    tick_cumulatives = []
+    for seconds_ago in seconds_agos:
+      target = block_timestamp(block) - seconds_ago
+      if target < oldest_timestamp:
+        raise ValueError('execution reverted: OLD')
+      i = min(bisect.bisect_right(self.timestamps, target), n + 1) - 1
+      timestamp, tick_cumulative = self.records[i]
+      tick_cumulatives.append(tick_cumulative + self.ticks[i] * (target - timestamp))
+    return (tick_cumulatives, [0] * len(seconds_agos))
+
+class BalancerPool(Contract):
+  functions = {
+    'getNumTokens': ([], ['uint256']),
+    'getFinalTokens': ([], ['address[]']),
+    'getBalance': (['address'], ['uint256']),
+    'getNormalizedWeight': (['address'], ['uint256']),
+    'totalSupply': ([], ['uint256']),
+    'balanceOf': (['address'], ['uint256']),
+    'getSwapFee': ([], ['uint256']),
+    'calcOutGivenIn': (['uint256'] * 6, ['uint256']),
+    'calcInGivenOut': (['uint256'] * 6, ['uint256']),
+  }
+
+  def __init__(self, tokens, balances):
+    self.tokens = tokens
+    self.balances = dict(zip(tokens, balances))
+
+  def getNumTokens(self, block):
+    return len(self.tokens)
+
+  def getFinalTokens(self, block):
+    return self.tokens
+
+  def getBalance(self, block, token):
+    return self.balances[to_checksum_address(token)]
+
+  def getNormalizedWeight(self, block, token):
+    return 5 * 10 ** 17
+
+  def totalSupply(self, block):
+    return 100 * 10 ** 18
+
+  def balanceOf(self, block, address):
+    return 10 ** 18
+
+  def getSwapFee(self, block):
+    return 3 * 10 ** 15
+
+  def calcOutGivenIn(self, block, balance_in, weight_in, balance_out, weight_out, amount_in, swap_fee):
+    adjusted_in = amount_in * (1 - swap_fee / 10 ** 18)
+    return int(balance_out * (1 - (balance_in / (balance_in + adjusted_in)) ** (weight_in / weight_out)))
+
+  def calcInGivenOut(self, block, balance_in, weight_in, balance_out, weight_out, amount_out, swap_fee):
+    return int(balance_in * ((balance_out / (balance_out - amount_out)) ** (weight_out / weight_in) - 1) / (1 - swap_fee / 10 ** 18))
+
+class CToken(Contract):
+  functions = {
+    'decimals': ([], ['uint8']),
+    'underlying': ([], ['address']),
+    'accrualBlockNumber': ([], ['uint256']),
+    'borrowBalanceStored': (['address'], ['uint256']),
+    'borrowRatePerBlock': ([], ['uint256']),
+  }
+
+  def __init__(self, underlying_address, index):
+    self.underlying_address = underlying_address
+    self.index = index
+
+  def decimals(self, block):
+    return 8
+
+  def underlying(self, block):
+    return self.underlying_address
+
+  def accrualBlockNumber(self, block):
+    return block - 10 - self.index % 5
+
+  def borrowBalanceStored(self, block, address):
+    return (1000 + self.index) * 10 ** 18
+
+  def borrowRatePerBlock(self, block):
+    return 20000000000 + self.index * 1000000
+
+# cETH market, its underlying is ETH and it has no underlying() function:
+class CEther(CToken):
+  functions = dict((name, spec) for name, spec in CToken.functions.items() if name != 'underlying')
+
+  def __init__(self, index):
+    CToken.__init__(self, None, index)
+
+class Multicall(Contract):
+  functions = {
+    'aggregate3': (['(address,bool,bytes)[]'], ['(bool,bytes)[]']),
+    'getCurrentBlockTimestamp': ([], ['uint256']),
+  }
+
+  def __init__(self, chain):
+    self.chain = chain
+
+  def aggregate3(self, block, calls):
+    results = []
+    for target, allow_failure, call_data in calls:
+      try:
+        results.append((True, self.chain.call(to_checksum_address(target), call_data, block)))
+      except ValueError:
+        if not allow_failure:
+          raise
+        results.append((False, b''))
+    return results
+
+  def getCurrentBlockTimestamp(self, block):
+    return block_timestamp(block)
+
+class Chain:
+  def __init__(self, contracts=1000, pools=3, sync_updates=5000, ctokens=10, seed=1):
+    rng = random.Random(seed)
+    self.head = HEAD_BLOCK
+    self.contracts = {}
+    self.logs = []
+    self.receipts = {}
+    self.internal = {}
+    self.collateral_addresses = [make_address('collateral', i) for i in range(5)]
+    self.usdc_address = self.collateral_addresses[0]
+    for i, address in enumerate(self.collateral_addresses):
+      self.contracts[address] = Token('COL%d' % (i), 6 if i == 0 else 18, 10 ** 30)
+    self.contracts[WETH_ADDRESS] = Token('WETH', 18, 10 ** 25)
+    self.registry_address = make_address('registry')
+    self.contracts[FINDER_ADDRESS] = Finder(self.registry_address)
+    self.contracts[self.registry_address] = Registry(self)
+    self.contracts[MULTICALL_ADDRESS] = Multicall(self)
+    self.creators = {contract_type: make_address('creator', contract_type) for contract_type in ('emp', 'perp', 'jarvis')}
+    self.jarvis_deployer = make_address('jarvis-deployer')
+    types = ('emp', 'emp', 'emp', 'perp', 'jarvis_v1', 'jarvis_v2', 'jarvis_self')
+    classes = {'emp': EMP, 'perp': Perpetual, 'jarvis_v1': JarvisV1, 'jarvis_v2': Jarvis, 'jarvis_self': Jarvis}
+    self.derivatives = []
+    created = sorted(rng.sample(range(10200000, self.head - 100000), contracts))
+    for i in range(contracts):
+      contract_type = types[rng.randrange(len(types))]
+      derivative = classes[contract_type](self, i, contract_type, created[i])
+      self.derivatives.append(derivative)
+      self.contracts[derivative.address] = derivative
+      self.contracts[derivative.synth_address] = Synth(derivative, 'SYN%d' % (i))
+      self.add_creation(derivative)
+    self.pools = []
+    for i in range(pools):
+      pool_address = make_address('pool', i)
+      pool = UniswapPair(pool_address, WETH_ADDRESS, self.usdc_address, self.head - 400000, self.head - 10, sync_updates, seed + i)
+      self.contracts[pool_address] = pool
+      self.pools.append(pool)
+      self.logs.extend(pool.logs())
+    self.v3_pool = UniswapV3Pool(make_address('v3-pool'), WETH_ADDRESS, self.usdc_address, self.head - 400000, self.head - 10, sync_updates, V3_CARDINALITY, seed)
+    self.contracts[self.v3_pool.address] = self.v3_pool
+    # Latest EMP is still open, exit_pool.py works only with open contracts:
+    emp = [derivative for derivative in self.derivatives if derivative.contract_type == 'emp'][-1]
+    self.exit_emp = emp
+    self.balancer_address = make_address('balancer')
+    self.contracts[self.balancer_address] = BalancerPool([emp.synth_address, self.usdc_address], [5000 * 10 ** 18, 5000 * 10 ** 6])
+    self.ctoken_addresses = [make_address('ctoken', i) for i in range(ctokens)]
+    for i, address in enumerate(self.ctoken_addresses):
+      self.contracts[address] = CToken(self.collateral_addresses[i % len(self.collateral_addresses)], i)
+    self.ceth_address = make_address('ceth')
+    self.contracts[self.ceth_address] = CEther(ctokens)
+    self.store_address = make_address('store')
+    for derivative in self.derivatives:
+      self.add_activity(derivative, random.Random('%d:%d' % (seed, derivative.index)))
+    # Look-alike creation event of an unrelated contract, contract discovery has to ignore it:
+    impostor = make_address('impostor')
+    self.logs.append({'address': impostor, 'topics': [topic(EMP_CREATE), address_topic(self.derivatives[0].address), address_topic(impostor)], 'data': '0x', 'blockNumber': self.head - 5000, 'transactionHash': make_hash('impostor'), 'logIndex': 0})
+    self.logs.sort(key=lambda log: (log['blockNumber'], log['logIndex']))
+    self.log_blocks = [log['blockNumber'] for log in self.logs]
+
+  # Creation transaction with the same logs as UMA creators and the registry emit, plus unrelated token transfers:
+  def add_creation(self, derivative):
+    contract_type = derivative.contract_type
+    block = derivative.created
+    tx_hash = derivative.creation_tx
+    creator = self.creators['emp' if contract_type == 'emp' else 'perp']
+    logs = [{'address': derivative.synth_address, 'topics': [topic(TRANSFER_EVENT), address_topic(derivative.deployer), address_topic(derivative.address)], 'data': '0x' + '00' * 31 + '01'} for i in range(20)]
+    logs.append({'address': self.registry_address, 'topics': [topic(REGISTRY_NEW_CONTRACT), address_topic(derivative.address), address_topic(creator)], 'data': '0x' + encode_abi(['address[]'], [[]]).hex()})
+    if contract_type == 'emp':
+      logs.append({'address': creator, 'topics': [topic(EMP_CREATE), address_topic(derivative.address), address_topic(derivative.deployer)], 'data': '0x'})
+    else:
+      logs.append({'address': creator, 'topics': [topic(PERP_CREATE), address_topic(derivative.address), address_topic(derivative.deployer)], 'data': '0x'})
+    if contract_type in ('jarvis_v1', 'jarvis_v2'):
+      logs.append({'address': self.jarvis_deployer, 'topics': [topic(JARVIS_CREATE), int_topic(1 if contract_type == 'jarvis_v1' else 2), address_topic(make_address('jarvis-pool', derivative.index)), address_topic(derivative.address)], 'data': '0x'})
+    elif contract_type == 'jarvis_self':
+      logs.append({'address': self.jarvis_deployer, 'topics': [topic(JARVIS_SELF_CREATE), int_topic(1), address_topic(derivative.address)], 'data': '0x'})
+    for i, log in enumerate(logs):
+      log.update({'blockNumber': block, 'transactionHash': tx_hash, 'logIndex': i})
+    self.receipts[tx_hash] = {'block': block, 'from': derivative.deployer, 'to': creator, 'logs': logs}
+    self.logs.extend(log for log in logs if log['topics'][0] != topic(TRANSFER_EVENT))
+    internal_tx = {'blockNumber': str(block), 'timeStamp': str(block_timestamp(block)), 'hash': tx_hash, 'from': creator.lower(), 'to': '', 'contractAddress': derivative.address.lower(), 'type': 'create', 'isError': '0'}
+    self.internal[derivative.address.lower()] = [internal_tx]
+    self.internal[derivative.synth_address.lower()] = [dict(internal_tx, contractAddress=derivative.synth_address.lower())]
+
+  # Deposits, redemptions, regular fee payments and EMP expiry with the same logs as UMA contracts emit. Raw collateral is
+  # rounded with the fee multiplier like FixedPoint does, and every tenth contract also receives collateral sent without a position:
+  def add_activity(self, derivative, rng):
+    raw_collateral, fee_multiplier, supply, state = derivative.history[0]
+    last_block = self.head - 1000
+    if derivative.contract_type == 'emp':
+      expiry_block = bisect.bisect_left(range(self.head + 1), derivative.expirationTimestamp(derivative.created), key=block_timestamp)
+      last_block = min(last_block, expiry_block - 1)
+    activity_blocks = [derivative.created + 1] + sorted(rng.sample(range(derivative.created + 2, last_block), ACTIVITY_EVENTS))
+    collateral = derivative.collateral_address
+    for n, block in enumerate(activity_blocks):
+      sponsor = make_address('sponsor', derivative.index, n % 3)
+      logs = []
+      if n > 0 and derivative.contract_type in ('emp', 'perp'):
+        pfc = raw_collateral * fee_multiplier // 10 ** 18
+        fee = pfc // 1000
+        # FeePayer rounds the fee fraction up and the new multiplier down:
+        fee_multiplier = fee_multiplier * (10 ** 18 - -(-fee * 10 ** 18 // pfc)) // 10 ** 18
+        logs.append(transfer_log(collateral, derivative.address, self.store_address, fee))
+      if n % 4 == 3:
+        tokens = supply // 4
+        amount = raw_collateral * fee_multiplier // 10 ** 18 // 4
+        raw_collateral -= amount * 10 ** 18 // fee_multiplier
+        supply -= tokens
+        logs.append(transfer_log(derivative.synth_address, sponsor, derivative.address, tokens))
+        logs.append(transfer_log(derivative.synth_address, derivative.address, ZERO_ADDRESS, tokens))
+        logs.append(transfer_log(collateral, derivative.address, sponsor, amount))
+      else:
+        amount = derivative.collateral // (1 + n % 3) + rng.randrange(10 ** 6)
+        tokens = amount // 2
+        raw_collateral += amount * 10 ** 18 // fee_multiplier
+        supply += tokens
+        logs.append(transfer_log(collateral, sponsor, derivative.address, amount))
+        logs.append(transfer_log(derivative.synth_address, ZERO_ADDRESS, sponsor, tokens))
+      if n == 5 and derivative.index % 10 == 0:
+        logs.append(transfer_log(collateral, make_address('donor'), derivative.address, 10 ** 6))
+      self.add_logs(logs, block, make_hash('activity', derivative.index, n))
+      derivative.add_snapshot(block, raw_collateral, fee_multiplier, supply, state)
+    if derivative.contract_type == 'emp' and expiry_block + 500 < self.head:
+      for state, block, signature in ((1, expiry_block + 10, CONTRACT_EXPIRED), (2, expiry_block + 500, SETTLE_EXPIRED)):
+        self.add_logs([{'address': derivative.address, 'topics': [topic(signature), address_topic(derivative.deployer)], 'data': '0x'}], block, make_hash('expiry', derivative.index, state))
+        derivative.add_snapshot(block, raw_collateral, fee_multiplier, supply, state)
+
+  # Log indexes of activity transactions follow the creation transaction logs:
+  def add_logs(self, logs, block, tx_hash):
+    for i, log in enumerate(logs):
+      log.update({'blockNumber': block, 'transactionHash': tx_hash, 'logIndex': 100 + i})
+    self.logs.extend(logs)
+
+  def call(self, to, data, block):
+    contract = self.contracts.get(to)
+    if contract is None or block < getattr(contract, 'created', 0):
+      return b''
+    return contract.dispatch(data, block)
+
+  def get_logs(self, log_filter):
+    from_block = parse_block(log_filter.get('fromBlock', 'latest'), self.head)
+    to_block = parse_block(log_filter.get('toBlock', 'latest'), self.head)
+    addresses = log_filter.get('address')
+    if isinstance(addresses, str):
+      addresses = [addresses]
+    if addresses:
+      addresses = set(address.lower() for address in addresses)
+    # Sets keep topic alternatives with hundreds of addresses fast:
+    topics = [set(expected) if isinstance(expected, list) else expected for expected in log_filter.get('topics') or []]
+    logs = []
+    for i in range(bisect.bisect_left(self.log_blocks, from_block), bisect.bisect_right(self.log_blocks, to_block)):
+      log = self.logs[i]
+      if addresses and log['address'].lower() not in addresses:
+        continue
+      if not topics_match(topics, log['topics']):
+        continue
+      logs.append(log)
+    if len(logs) > 10000:
+      raise ValueError('query returned more than 10000 results')
+    return [format_log(log) for log in logs]
+
+def parse_block(block, head):
+  if block in ('latest', 'pending', 'safe', 'finalized', None):
+    return head
+  if block == 'earliest':
+    return 0
+  return int(block, 16)
+
+def topics_match(topics, log_topics):
+  for i, expected in enumerate(topics):
+    if expected is None:
+      continue
+    if i >= len(log_topics):
+      return False
+    if isinstance(expected, set):
+      if log_topics[i] not in expected:
+        return False
+    elif log_topics[i] != expected:
+      return False
+  return True
+
+def format_log(log):
+  return {
+    'address': log['address'],
+    'topics': log['topics'],
+    'data': log['data'],
+    'blockNumber': hex(log['blockNumber']),
+    'blockHash': make_hash('block', log['blockNumber']),
+    'transactionHash': log['transactionHash'],
+    'transactionIndex': '0x0',
+    'logIndex': hex(log['logIndex']),
+    'removed': False,
+  }
+
+def format_block(block):
+  return {
+    'number': hex(block),
+    'hash': make_hash('block', block),
+    'parentHash': make_hash('block', block - 1),
+    'nonce': '0x' + '00' * 8,
+    'sha3Uncles': '0x' + '00' * 32,
+    'logsBloom': '0x' + '00' * 256,
+    'transactionsRoot': '0x' + '00' * 32,
+    'stateRoot': '0x' + '00' * 32,
+    'receiptsRoot': '0x' + '00' * 32,
+    'miner': '0x' + '00' * 20,
+    'difficulty': '0x0',
+    'totalDifficulty': '0x0',
+    'extraData': '0x',
+    'size': '0x1',
+    'gasLimit': '0x1c9c380',
+    'gasUsed': '0x0',
+    'timestamp': hex(block_timestamp(block)),
+    'transactions': [],
+    'uncles': [],
+    'mixHash': '0x' + '00' * 32,
+    'baseFeePerGas': '0x1',
+  }
+
+def format_receipt(tx_hash, receipt):
+  return {
+    'transactionHash': tx_hash,
+    'transactionIndex': '0x0',
+    'blockHash': make_hash('block', receipt['block']),
+    'blockNumber': hex(receipt['block']),
+    'from': receipt['from'],
+    'to': receipt['to'],
+    'cumulativeGasUsed': '0x1',
+    'gasUsed': '0x1',
+    'effectiveGasPrice': '0x1',
+    'contractAddress': None,
+    'logs': [format_log(log) for log in receipt['logs']],
+    'logsBloom': '0x' + '00' * 256,
+    'status': '0x1',
+    'type': '0x2',
+  }
+
+class StandIn:
+  def __init__(self, chain, latency=0.0):
+    self.chain = chain
+    self.latency = latency
+    self.lock = threading.Lock()
+    self.counts = {}
+
+  def count(self, name):
+    with self.lock:
+      self.counts[name] = self.counts.get(name, 0) + 1
+
+  def rpc(self, request):
+    self.count('rpc:' + request['method'])
+    try:
+      result = self.rpc_result(request['method'], request.get('params', []))
+    except ValueError as error:
+      return {'jsonrpc': '2.0', 'id': request.get('id'), 'error': {'code': -32000 if 'reverted' in str(error) else -32005, 'message': str(error)}}
+    return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}
+
+  def rpc_result(self, method, params):
+    chain = self.chain
+    if method == 'eth_chainId':
+      return '0x1'
+    if method == 'net_version':
+      return '1'
+    if method == 'eth_blockNumber':
+      return hex(chain.head)
+    if method == 'eth_getBlockByNumber':
+      block = parse_block(params[0], chain.head)
+      if block > chain.head:
+        return None
+      return format_block(block)
+    if method == 'eth_call':
+      block = parse_block(params[1] if len(params) > 1 else 'latest', chain.head)
+      return '0x' + chain.call(to_checksum_address(params[0]['to']), bytes.fromhex(params[0].get('data', params[0].get('input', '0x'))[2:]), block).hex()
+    if method == 'eth_getLogs':
+      return chain.get_logs(params[0])
+    if method == 'eth_getTransactionReceipt':
+      receipt = chain.receipts.get(params[0])
+      if receipt is None:
+        return None
+      return format_receipt(params[0], receipt)
+    if method == 'eth_getBlockReceipts':
+      block = parse_block(params[0], chain.head)
+      return [format_receipt(tx_hash, receipt) for tx_hash, receipt in chain.receipts.items() if receipt['block'] == block]
+    if method == 'eth_getCode':
+      return '0x60' if to_checksum_address(params[0]) in chain.contracts else '0x'
+    raise ValueError('method %s not supported' % (method))
+
+  def etherscan(self, query):
+    module = query.get('module')
+    action = query.get('action')
+    self.count('etherscan:' + str(action))
+    if action == 'getabi':
+      contract = self.chain.contracts.get(to_checksum_address(query['address']))
+      if contract is None:
+        return {'status': '0', 'message': 'NOTOK', 'result': 'Contract source code not verified'}
+      return {'status': '1', 'message': 'OK', 'result': json.dumps(contract.abi())}
+    if action == 'txlistinternal':
+      transactions = self.chain.internal.get(query['address'].lower())
+      if not transactions:
+        return {'status': '0', 'message': 'No transactions found', 'result': []}
+      return {'status': '1', 'message': 'OK', 'result': transactions}
+    if action == 'getblocknobytime':
+      timestamp = int(query['timestamp'])
+      block = bisect.bisect_right(range(self.chain.head + 1), timestamp, key=block_timestamp) - 1
+      return {'status': '1', 'message': 'OK', 'result': str(block)}
+    return {'status': '0', 'message': 'NOTOK', 'result': 'Error! Unknown action %s/%s' % (module, action)}
+
+  def coingecko(self, path, query):
+    self.count('coingecko:' + path)
+    ids = query.get('ids', '').split(',')
+    currencies = query.get('vs_currencies', '').split(',')
+    return {coin: {currency: round(1 + (sum(coin.encode()) % 97) / 10, 2) for currency in currencies} for coin in ids if coin}
+
+def make_handler(stand_in):
+  class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, Nagle's algorithm would delay every response:
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+      pass
+
+    def reply(self, payload):
+      body = json.dumps(payload).encode()
+      self.send_response(200)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def do_POST(self):
+      request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+      if stand_in.latency:
+        time.sleep(stand_in.latency)
+      if isinstance(request, list):
+        self.reply([stand_in.rpc(item) for item in request])
+      else:
+        self.reply(stand_in.rpc(request))
+
+    def do_GET(self):
+      url = urllib.parse.urlparse(self.path)
+      query = dict(urllib.parse.parse_qsl(url.query))
+      if url.path == '/stats':
+        with stand_in.lock:
+          counts = dict(stand_in.counts)
+          if query.get('reset'):
+            stand_in.counts.clear()
+        self.reply(counts)
+        return
+      if stand_in.latency:
+        time.sleep(stand_in.latency)
+      if url.path.startswith('/api/v3/'):
+        self.reply(stand_in.coingecko(url.path[len('/api/v3'):], query))
+      else:
+        self.reply(stand_in.etherscan(query))
+  return Handler
+
+def serve(chain, port=0, latency=0.0):
+  stand_in = StandIn(chain, latency)
+  server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(stand_in))
+  server.daemon_threads = True
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return server, stand_in
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-p", "--port", type=int, default=8545, help="listen on this port")
+  parser.add_argument("-c", "--contracts", type=int, default=1000, help="number of synthetic UMA registry contracts")
+  parser.add_argument("-s", "--sync-updates", type=int, default=5000, help="number of Sync events of each synthetic Uniswap pool")
+  parser.add_argument("-l", "--latency", type=float, default=0.0, help="per-request latency in seconds")
+  args = parser.parse_args()
+  server, stand_in = serve(Chain(contracts=args.contracts, sync_updates=args.sync_updates), args.port, args.latency)
+  print('Serving synthetic chain on http://127.0.0.1:%d' % (server.server_address[1]))
+  try:
+    while True:
+      time.sleep(3600)
+  except KeyboardInterrupt:
+    pass
@@ -0,0 +1,193 @@
+import array
+import atexit
+import bisect
+import mmap
+import os
+import threading
+import time
+import rpc_batch
+
+# Index file with (block, timestamp) samples sorted by block, stored as native uint64 pairs (override with BLOCK_INDEX_FILE):
+DEFAULT_INDEX_FILE = ".block_index"
+
+# Blocks this close to the chain head may still be reorganized, hence, are not persisted:
+FINALITY_DEPTH = 64
+
+# Chain head is refreshed after this many seconds (about one block), so that long-running callers follow the chain:
+HEAD_TTL = 12
+
+def read_samples(path):
+  samples = array.array('Q')
+  try:
+    with open(path, 'rb') as f:
+      data = f.read()
+  except FileNotFoundError:
+    return samples
+  samples.frombytes(data[:len(data) - len(data) % (2 * samples.itemsize)])
+  return samples
+
+# Number of samples in a flat [block, timestamp, block, timestamp, ...] view with column value <= value:
+def bisect_column(view, column, value):
+  lo = 0
+  hi = len(view) // 2
+  while lo < hi:
+    mid = (lo + hi) // 2
+    if view[2 * mid + column] <= value:
+      lo = mid + 1
+    else:
+      hi = mid
+  return lo
+
+class BlockIndex:
+  def __init__(self, w3, path=None):
+    self.w3 = w3
+    self.path = path or os.environ.get("BLOCK_INDEX_FILE", DEFAULT_INDEX_FILE)
+    self.lock = threading.Lock()
+    # Samples fetched in this process, kept sorted by block:
+    self.new_blocks = []
+    self.new_timestamps = []
+    self.head = None
+    self.head_time = 0
+    self.load()
+    atexit.register(self.save)
+
+  def load(self):
+    self.map = None
+    self.view = memoryview(array.array('Q'))
+    if not os.path.exists(self.path) or os.path.getsize(self.path) < 16:
+      return
+    with open(self.path, 'rb') as f:
+      self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    self.view = memoryview(self.map)[:len(self.map) - len(self.map) % 16].cast('Q')
+
+  def close(self):
+    self.view.release()
+    if self.map:
+      self.map.close()
+      self.map = None
+
+  def __len__(self):
+    return len(self.view) // 2 + len(self.new_blocks)
+
+  def cached_timestamp(self, block):
+    i = bisect_column(self.view, 0, block)
+    if i > 0 and self.view[2 * (i - 1)] == block:
+      return self.view[2 * (i - 1) + 1]
+    # Worker threads insert into both lists in add():
+    with self.lock:
+      i = bisect.bisect_left(self.new_blocks, block)
+      if i < len(self.new_blocks) and self.new_blocks[i] == block:
+        return self.new_timestamps[i]
+    return None
+
+  def add(self, block, timestamp):
+    with self.lock:
+      i = bisect.bisect_left(self.new_blocks, block)
+      if i < len(self.new_blocks) and self.new_blocks[i] == block:
+        return
+      self.new_blocks.insert(i, block)
+      self.new_timestamps.insert(i, timestamp)
+
+  # Latest (block, timestamp), at most HEAD_TTL seconds old:
+  def get_head(self):
+    if self.head is None or time.monotonic() - self.head_time > HEAD_TTL:
+      head = self.w3.eth.getBlock('latest')
+      self.head = (head.number, head.timestamp)
+      self.head_time = time.monotonic()
+      self.add(head.number, head.timestamp)
+    return self.head
+
+  def get_timestamp(self, block):
+    timestamp = self.cached_timestamp(block)
+    if timestamp is None:
+      timestamp = self.w3.eth.getBlock(block).timestamp
+      self.add(block, timestamp)
+    return timestamp
+
+  # Timestamps of many blocks, blocks missing in the index are fetched in JSON-RPC batches instead of one request each:
+  def get_timestamps(self, block_numbers):
+    timestamps = {block: self.cached_timestamp(block) for block in block_numbers}
+    missing = [block for block, timestamp in timestamps.items() if timestamp is None]
+    for block, result in zip(missing, rpc_batch.request(self.w3, 'eth_getBlockByNumber', [[hex(block), False] for block in missing])):
+      if result is None:
+        raise ValueError("Block %d not found" % (block))
+      timestamps[block] = int(result['timestamp'], 16)
+      self.add(block, timestamps[block])
+    return [timestamps[block] for block in block_numbers]
+
+  # Average blocks per second over the last window blocks before the head:
+  def block_rate(self, window):
+    head, head_timestamp = self.get_head()
+    start = max(0, head - window)
+    return (head - start) / (head_timestamp - self.get_timestamp(start))
+
+  # Latest sample at or before timestamp and earliest sample after it, None if there is no such sample:
+  def bracket(self, timestamp):
+    lo = None
+    hi = None
+    i = bisect_column(self.view, 1, timestamp)
+    if i > 0:
+      lo = (self.view[2 * (i - 1)], self.view[2 * (i - 1) + 1])
+    if i < len(self.view) // 2:
+      hi = (self.view[2 * i], self.view[2 * i + 1])
+    with self.lock:
+      i = bisect.bisect_right(self.new_timestamps, timestamp)
+      if i > 0 and (lo is None or self.new_blocks[i - 1] > lo[0]):
+        lo = (self.new_blocks[i - 1], self.new_timestamps[i - 1])
+      if i < len(self.new_blocks) and (hi is None or self.new_blocks[i] < hi[0]):
+        hi = (self.new_blocks[i], self.new_timestamps[i])
+    return lo, hi
+
+  # Latest block with timestamp at or before the requested timestamp (same as Etherscan closest=before):
+  def get_block(self, timestamp):
+    lo, hi = self.bracket(timestamp)
+    if hi is None:
+      head = self.get_head()
+      if head[1] <= timestamp:
+        return head[0]
+      hi = head
+    if lo is None:
+      lo = (0, self.get_timestamp(0))
+      if lo[1] > timestamp:
+        raise ValueError("Timestamp %d is before genesis block" % (timestamp))
+    interpolate = True
+    while hi[0] - lo[0] > 1:
+      span = hi[0] - lo[0]
+      if interpolate:
+        guess = lo[0] + int((timestamp - lo[1]) * span / (hi[1] - lo[1]))
+      else:
+        guess = lo[0] + span // 2
+      guess = min(max(guess, lo[0] + 1), hi[0] - 1)
+      guess_timestamp = self.get_timestamp(guess)
+      if guess_timestamp <= timestamp:
+        lo = (guess, guess_timestamp)
+      else:
+        hi = (guess, guess_timestamp)
+      # Fall back to bisection when interpolation does not at least halve the gap:
+      interpolate = hi[0] - lo[0] <= span // 2
+    return lo[0]
+
+  # Merge samples below finality depth into the index file:
+  def save(self):
+    if self.new_blocks == []:
+      return
+    safe_block = self.get_head()[0] - FINALITY_DEPTH
+    with self.lock:
+      new_samples = {block: timestamp for block, timestamp in zip(self.new_blocks, self.new_timestamps) if block <= safe_block}
+    if new_samples == {}:
+      return
+    samples = read_samples(self.path)
+    merged = dict(zip(samples[0::2], samples[1::2]))
+    if all(block in merged for block in new_samples):
+      return
+    merged.update(new_samples)
+    output = array.array('Q')
+    for block in sorted(merged):
+      output.append(block)
+      output.append(merged[block])
+    tmp_path = self.path + ".%d.tmp" % (os.getpid())
+    with open(tmp_path, 'wb') as f:
+      output.tofile(f)
+    self.close()
+    os.replace(tmp_path, self.path)
+    self.load()
@@ -1,50 +1,61 @@
 #!/usr/bin/env python3
 
-import time
 import datetime
 import argparse
-from web3 import Web3
-from dotenv import load_dotenv
-import requests
-import os
+import sys
+import cli
 
-load_dotenv()
-
-# etherscan.io API:
-etherscan_api = "https://api.etherscan.io/api"
-
-# Get API keys from .env file:
-etherscan_key = os.environ.get("ETHERSCAN_KEY")
-
-# ETH node API:
-eth_node_api = os.environ.get("ETH_NODE_API")
-
-def get_block(timestamp):
-  API_ENDPOINT = etherscan_api+"?module=block&action=getblocknobytime&closest=before&timestamp="+str(timestamp)+"&apikey="+etherscan_key
-  r = requests.get(url = API_ENDPOINT)
-  response = r.json()
-  return int(response["result"])
+def read_values(input_name):
+  if input_name == '-':
+    lines = sys.stdin.read().split()
+  else:
+    with open(input_name, 'r') as f:
+      lines = f.read().split()
+  return [int(line) for line in lines]
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-t", "--timestamp", type=int, help="get the latest block for this timestamp")
 parser.add_argument("-b", "--block", type=int, help="get the block timestamp")
+parser.add_argument("--bulk", choices=["timestamps", "blocks"], help="resolve a list of timestamps or blocks read from input")
+parser.add_argument("-i", "--input", type=str, default="-", help="input file for bulk mode, one value per line (default stdin)")
+cli.add_arguments(parser, refresh_abi=False, rpc_cache=True)
 args = parser.parse_args()
 
-# HTTPProvider:
-w3 = Web3(Web3.HTTPProvider(eth_node_api))
+w3 = cli.setup(args)
+
+import block_index
+import cassette
+
+blocks = block_index.BlockIndex(w3)
+
+if args.bulk:
+  values = read_values(args.input)
+  # Resolve in sorted order so that each lookup narrows the index for the next one:
+  resolved = {}
+  for value in sorted(set(values)):
+    if args.bulk == "timestamps":
+      resolved[value] = blocks.get_block(value)
+    else:
+      resolved[value] = blocks.get_timestamp(value)
+  for value in values:
+    if args.bulk == "timestamps":
+      print('%d\t%d\t%d' % (value, resolved[value], blocks.get_timestamp(resolved[value])))
+    else:
+      print('%d\t%d' % (value, resolved[value]))
+  sys.exit()
 
 if args.block:
   block = args.block
-  timestamp = w3.eth.getBlock(block).timestamp
+  timestamp = blocks.get_timestamp(block)
   r_timestamp = timestamp
 elif args.timestamp:
   r_timestamp = args.timestamp
-  block = get_block(r_timestamp)
-  timestamp = w3.eth.getBlock(block).timestamp
+  block = blocks.get_block(r_timestamp)
+  timestamp = blocks.get_timestamp(block)
 else:
   block = w3.eth.blockNumber
-  timestamp = w3.eth.getBlock(block).timestamp
-  r_timestamp = int(time.time())
+  timestamp = blocks.get_timestamp(block)
+  r_timestamp = int(cassette.now())
 
 print('Requested timestamp: %d is %s UTC' % (r_timestamp, datetime.datetime.utcfromtimestamp(r_timestamp)))
 print('Block timestamp: %d is %s UTC' % (timestamp, datetime.datetime.utcfromtimestamp(timestamp)))
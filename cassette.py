@@ -0,0 +1,215 @@
+import atexit
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+import http_client
+import rate_limit
+
+# Query parameters left out of recorded requests, so that cassettes can be shared:
+SECRET_PARAMS = ('apikey',)
+
+# Local caches are redirected to a temporary directory while recording or replaying, so that every exchange is captured:
+CACHE_VARIABLES = {
+  'ABI_CACHE_DIR': '.abi_cache',
+  'BLOCK_INDEX_FILE': '.block_index',
+  'RPC_CACHE_FILE': 'rpc_cache.sqlite',
+  'SYNC_SERIES_DIR': '.sync_series',
+  'BALANCE_INDEX_DIR': '.balance_index',
+  'PRICE_CACHE_FILE': '.price_cache.json',
+  'CONTRACT_STORE_FILE': 'contracts.sqlite',
+  'CONTRACT_CACHE_FILE': 'cache.json',
+  'DISCOVERY_FILE': 'discovery.json',
+}
+
+# Cassette file format version:
+VERSION = 1
+
+class CassetteError(Exception):
+  pass
+
+# Strip ids of JSON-RPC requests and responses (single or batch), they differ between runs:
+def strip_ids(payload):
+  if isinstance(payload, list):
+    return [strip_ids(item) for item in payload]
+  if isinstance(payload, dict):
+    return {key: value for key, value in payload.items() if key != 'id'}
+  return payload
+
+def request_ids(payload):
+  if isinstance(payload, list):
+    return [item.get('id') for item in payload]
+  return payload.get('id')
+
+def set_ids(payload, ids):
+  if isinstance(payload, list):
+    return [dict(item, id=item_id) for item, item_id in zip(payload, ids)]
+  return dict(payload, id=ids)
+
+# Batch replies may come in any order, they are stored in request order, as ids are stripped and set by position on replay:
+def request_order(payload, reply):
+  if not isinstance(payload, list) or not isinstance(reply, list):
+    return reply
+  positions = {item.get('id'): i for i, item in enumerate(payload)}
+  return sorted(reply, key=lambda item: positions.get(item.get('id'), len(positions)))
+
+def json_rpc_body(request):
+  if request.method != 'POST' or not request.body:
+    return None
+  body = request.body.decode() if isinstance(request.body, bytes) else request.body
+  try:
+    payload = json.loads(body)
+  except ValueError:
+    return None
+  if 'jsonrpc' not in (payload[0] if isinstance(payload, list) and payload else payload):
+    return None
+  return payload
+
+# JSON-RPC requests are keyed by their payload only (node URLs may contain API keys), other requests by path and query without secrets:
+def request_key(request):
+  payload = json_rpc_body(request)
+  if payload is not None:
+    return 'RPC ' + json.dumps(strip_ids(payload), sort_keys=True)
+  url = urllib.parse.urlsplit(request.url)
+  query = urllib.parse.urlencode(sorted((name, value) for name, value in urllib.parse.parse_qsl(url.query, keep_blank_values=True) if name not in SECRET_PARAMS))
+  return request.method + ' ' + urllib.parse.urlunsplit(('', '', url.path, query, ''))
+
+class Cassette:
+  def __init__(self, path):
+    self.path = path
+    self.lock = threading.Lock()
+    # {request key: [recorded responses in order]}:
+    self.entries = {}
+    # Responses already replayed per request key:
+    self.positions = {}
+    self.time = time.time()
+
+  def load(self):
+    try:
+      with gzip.open(self.path, 'rt') as f:
+        data = json.load(f)
+    except FileNotFoundError:
+      sys.exit("Cassette file %s not found" % (self.path))
+    if data.get('version') != VERSION:
+      sys.exit("Unsupported cassette version in %s" % (self.path))
+    self.entries = data['entries']
+    self.time = data['time']
+
+  def save(self):
+    tmp_path = self.path + ".%d.tmp" % (os.getpid())
+    with self.lock:
+      data = {'version': VERSION, 'time': self.time, 'entries': self.entries}
+    with gzip.open(tmp_path, 'wt') as f:
+      json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, self.path)
+
+  def record(self, request, response):
+    payload = json_rpc_body(request)
+    body = response.content.decode(response.encoding or 'utf-8')
+    if payload is not None:
+      try:
+        body = json.dumps(strip_ids(request_order(payload, json.loads(body))), separators=(',', ':'))
+      except ValueError:
+        pass
+    entry = {'status': response.status_code, 'content_type': response.headers.get('Content-Type'), 'body': body}
+    with self.lock:
+      self.entries.setdefault(request_key(request), []).append(entry)
+
+  # Responses to repeated requests are replayed in recorded order, the last one is repeated when they run out:
+  def replay(self, request):
+    key = request_key(request)
+    with self.lock:
+      if key not in self.entries:
+        raise CassetteError("Request not recorded in cassette %s: %s" % (self.path, key[:200]))
+      position = self.positions.get(key, 0)
+      self.positions[key] = position + 1
+      entry = self.entries[key][min(position, len(self.entries[key]) - 1)]
+    body = entry['body']
+    payload = json_rpc_body(request)
+    if payload is not None:
+      try:
+        body = json.dumps(set_ids(json.loads(body), request_ids(payload)))
+      except ValueError:
+        pass
+    response = requests.Response()
+    response.status_code = entry['status']
+    response.headers = CaseInsensitiveDict({'Content-Type': entry['content_type'] or 'application/json'})
+    response._content = body.encode()
+    response.encoding = 'utf-8'
+    response.url = request.url
+    response.request = request
+    response.reason = 'OK' if entry['status'] < 400 else 'Error'
+    return response
+
+class RecordAdapter(http_client.RetryAdapter):
+  def __init__(self, cassette, **kwargs):
+    super().__init__(**kwargs)
+    self.cassette = cassette
+
+  def send(self, request, **kwargs):
+    response = super().send(request, **kwargs)
+    self.cassette.record(request, response)
+    return response
+
+class ReplayAdapter(BaseAdapter):
+  def __init__(self, cassette):
+    super().__init__()
+    self.cassette = cassette
+
+  def send(self, request, **kwargs):
+    return self.cassette.replay(request)
+
+  def close(self):
+    pass
+
+# Cassette being recorded or replayed, None otherwise:
+active = None
+
+# Current time, frozen at recording time when recording or replaying, so that default timestamps resolve to the same blocks:
+def now():
+  if active:
+    return active.time
+  return time.time()
+
+def isolate_caches():
+  cache_dir = tempfile.mkdtemp(prefix='cassette-')
+  atexit.register(shutil.rmtree, cache_dir, True)
+  for variable, name in CACHE_VARIABLES.items():
+    os.environ[variable] = os.path.join(cache_dir, name)
+
+# Requests missing from the cassette end the script with a message instead of a traceback (the exit status is 1 as with sys.exit):
+def excepthook(exc_type, exc_value, exc_traceback):
+  if issubclass(exc_type, CassetteError):
+    print("Replay failed, the run differs from the recorded one (record it again with --record): %s" % (exc_value), file=sys.stderr)
+    return
+  sys.__excepthook__(exc_type, exc_value, exc_traceback)
+
+# Record all HTTP and JSON-RPC exchanges of the shared session to record_path, or serve them from replay_path without network access:
+def install(record_path=None, replay_path=None):
+  global active
+  if record_path and replay_path:
+    sys.exit("Cannot record and replay at the same time")
+  if not record_path and not replay_path:
+    return
+  isolate_caches()
+  if record_path:
+    active = Cassette(record_path)
+    adapter = RecordAdapter(active, pool_connections=http_client.POOL_SIZE, pool_maxsize=http_client.POOL_SIZE)
+    atexit.register(active.save)
+  else:
+    active = Cassette(replay_path)
+    active.load()
+    adapter = ReplayAdapter(active)
+    sys.excepthook = excepthook
+    # Nothing to throttle without network access:
+    rate_limit.enabled = False
+  http_client.session.mount('https://', adapter)
+  http_client.session.mount('http://', adapter)
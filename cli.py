@@ -0,0 +1,54 @@
+import sys
+
+# Command line options and setup shared by the scripts. Web3 and the modules using it are only imported by setup, after
+# the arguments are parsed, so that --help starts fast.
+
+# Add the shared options, optional groups are enabled for scripts using the ABI cache, the RPC cache and rate limits:
+def add_arguments(parser, refresh_abi=True, rpc_cache=False, rate_limits=False):
+  if rate_limits:
+    parser.add_argument("--etherscan-rps", type=float, default=5, help="Etherscan requests per second limit (0 disables throttling)")
+    parser.add_argument("--node-rps", type=float, default=25, help="ETH node requests per second limit (0 disables throttling)")
+  if refresh_abi:
+    parser.add_argument("--refresh-abi", action="store_true", help="ignore cached ABIs and fetch them again from Etherscan")
+  if rpc_cache:
+    parser.add_argument("--rpc-cache-stats", action="store_true", help="print RPC cache hit and miss counts")
+  parser.add_argument("--profile", nargs="?", const="-", metavar="FILE", help="print request counts and latencies to stderr, or write them to FILE (.json or .prom)")
+  parser.add_argument("--record", type=str, metavar="FILE", help="record all HTTP and JSON-RPC exchanges to this cassette file")
+  parser.add_argument("--replay", type=str, metavar="FILE", help="replay HTTP and JSON-RPC exchanges from this cassette file without network access")
+
+# Load .env, install the cassette, caches, rate limits and profiler for the options added by add_arguments and return
+# the web3 instance:
+def setup(args):
+  if 'node_rps' in args and (args.etherscan_rps < 0 or args.node_rps < 0):
+    sys.exit("Requests per second limits cannot be negative")
+
+  from web3 import Web3
+  from dotenv import load_dotenv
+  import abi_cache
+  import cassette
+  import http_client
+  import profiler
+  import rate_limit
+  import rpc_cache
+
+  load_dotenv()
+
+  cassette.install(args.record, args.replay)
+
+  if 'refresh_abi' in args:
+    abi_cache.refresh = args.refresh_abi
+
+  if 'node_rps' in args:
+    rate_limit.etherscan.set_rate(args.etherscan_rps)
+    rate_limit.node.set_rate(args.node_rps)
+
+  # HTTPProvider:
+  w3 = Web3(http_client.provider())
+  if 'rpc_cache_stats' in args:
+    rpc_cache.install(w3, args.rpc_cache_stats)
+  if 'node_rps' in args:
+    # Innermost layer, so that cached responses are not throttled:
+    w3.middleware_onion.inject(rate_limit.middleware(rate_limit.node), 'rate_limit', layer=0)
+  if args.profile:
+    profiler.install(w3, args.profile)
+  return w3
@@ -1,58 +1,112 @@
 #!/usr/bin/env python3
 
 import argparse
-from web3 import Web3
-from dotenv import load_dotenv
-import requests
-import os
-
-load_dotenv()
-
-# etherscan.io API:
-etherscan_api = "https://api.etherscan.io/api"
-
-# Get API keys from .env file:
-etherscan_key = os.environ.get("ETHERSCAN_KEY")
-alchemy_key = os.environ.get("ALCHEMY_KEY")
+import csv
+import sys
+import cli
 
 # default time till transaction in minutes:
 DEFAULT_TIME = 2
 
-# approx 4 blocks per minute:
-BLOCKS_PER_MINUTE = 4
+# Block rate is measured over this many recent blocks (about a day):
+RATE_WINDOW = 7200
+
+# Default projection horizon and step in minutes for positions mode:
+DEFAULT_HORIZON = 1440
+DEFAULT_STEP = 60
 
 # Mantissa in Compound contracts:
 mantissa = 10 ** 18
 
-# Some tokens don't have ABI available, hence, use WETH for all ERC-20 tokens:
-weth_address = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
-
-def load_abi(abi_address):
-  API_ENDPOINT = etherscan_api+"?module=contract&action=getabi&address="+str(abi_address)+"&apikey="+etherscan_key
-  r = requests.get(url = API_ENDPOINT)
-  response = r.json()
-  return response["result"]
-
-def load_token(token_address):
-  ABI = load_abi(weth_address)
-  return w3.eth.contract(address=token_address, abi=ABI)
-
-def load_contract(contract_address):
-  ABI = load_abi(contract_address)
-  return w3.eth.contract(address=contract_address, abi=ABI)
+# Positions file is a CSV table with contract and address columns, and optional keep column:
+def read_positions(path):
+  with open(path, 'r', newline='') as f:
+    rows = list(csv.DictReader(f))
+  for row in rows:
+    if not row.get('contract') or not row.get('address'):
+      sys.exit("Positions file %s needs contract and address on every row" % (path))
+    row['contract'] = w3.toChecksumAddress(row['contract'])
+    row['address'] = w3.toChecksumAddress(row['address'])
+  return rows
+
+# Borrow balance curves of all positions, all markets and accounts are read in multicalls at the head block:
+def projection(rows, head, blocks_per_minute, minutes):
+  ctoken_contracts = {contract_address: contracts.load_contract(w3, contract_address) for contract_address in dict.fromkeys(row['contract'] for row in rows)}
+  market_calls = []
+  for contract in ctoken_contracts.values():
+    calls = {
+        'accrual_block_number': contract.functions.accrualBlockNumber(),
+        'borrow_rate_per_block': contract.functions.borrowRatePerBlock(),
+    }
+    # cETH has no underlying() function:
+    if any(entry.get('type') == 'function' and entry.get('name') == 'underlying' for entry in contract.abi):
+      calls['underlying'] = contract.functions.underlying()
+    market_calls.append(calls)
+  position_calls = [{'borrow_balance_stored': ctoken_contracts[row['contract']].functions.borrowBalanceStored(row['address'])} for row in rows]
+  results = multicall.aggregate_named(w3, market_calls + position_calls, head)
+  markets = dict(zip(ctoken_contracts, results[:len(market_calls)]))
+  positions = results[len(market_calls):]
+  for contract_address, market in markets.items():
+    if None in market.values():
+      sys.exit("Failed reading Compound market %s" % (contract_address))
+    market.setdefault('underlying', None)
+  for row, position in zip(rows, positions):
+    if position['borrow_balance_stored'] is None:
+      sys.exit("Failed reading borrow balance of %s in %s" % (row['address'], row['contract']))
+
+  # cETH has no underlying token, its balances are in ETH:
+  underlyings = [underlying for underlying in dict.fromkeys(market['underlying'] for market in markets.values()) if underlying]
+  token_contracts = [contracts.load_token(w3, underlying) for underlying in underlyings]
+  token_results = multicall.aggregate_named(w3, [{'symbol': contract.functions.symbol(), 'decimals': contract.functions.decimals()} for contract in token_contracts], head)
+  tokens = dict(zip(underlyings, token_results))
+  tokens[None] = {'symbol': 'ETH', 'decimals': 18}
+
+  transaction_blocks = head + numpy.floor(minutes * blocks_per_minute)
+  stored = numpy.array([float(position['borrow_balance_stored']) for position in positions])
+  rate = numpy.array([float(markets[row['contract']]['borrow_rate_per_block']) for row in rows])
+  accrual = numpy.array([float(markets[row['contract']]['accrual_block_number']) for row in rows])
+  scaling = numpy.array([10.0 ** tokens[markets[row['contract']]['underlying']]['decimals'] for row in rows])
+  keep = numpy.array([float(row.get('keep') or keep_balance) for row in rows])
+  # Simple interest since last accrual as in CToken.accrueInterest, one row per position and one column per point:
+  balances = (stored[:, None] + rate[:, None] * (transaction_blocks[None, :] - accrual[:, None]) * stored[:, None] / mantissa) / scaling[:, None]
+  points = len(minutes)
+  return {
+      'contract': [row['contract'] for row in rows for i in range(points)],
+      'address': [row['address'] for row in rows for i in range(points)],
+      'symbol': [tokens[markets[row['contract']]['underlying']]['symbol'] for row in rows for i in range(points)],
+      'minutes': numpy.tile(minutes, len(rows)),
+      'block': numpy.tile(transaction_blocks.astype(numpy.int64), len(rows)),
+      'borrow_balance': balances.ravel(),
+      'repay': (balances - keep[:, None]).ravel(),
+  }
 
 parser = argparse.ArgumentParser()
-parser.add_argument("contract", type=str, help="calculate repay amount for this contract")
-parser.add_argument("address", type=str, help="user address")
+parser.add_argument("contract", type=str, nargs="?", help="calculate repay amount for this contract")
+parser.add_argument("address", type=str, nargs="?", help="user address")
 parser.add_argument("-k", "--keep", type=str, help="calculate repay amount targeting this balance")
 parser.add_argument("-t", "--time", type=str, help="time in minutes till borrow balance calculation")
+parser.add_argument("--positions", type=str, metavar="FILE", help="project borrow balances of all contract and address positions in this CSV file")
+parser.add_argument("--horizon", type=int, default=DEFAULT_HORIZON, metavar="MINUTES", help="projection horizon in positions mode (default: %d)" % (DEFAULT_HORIZON))
+parser.add_argument("--step", type=int, default=DEFAULT_STEP, metavar="MINUTES", help="projection step in positions mode (default: %d)" % (DEFAULT_STEP))
+parser.add_argument("-o", "--output", type=str, default="-", help="projection output file in positions mode (.csv, .tsv, .parquet or .npz, default stdout)")
+cli.add_arguments(parser)
 args = parser.parse_args()
 
-# HTTPProvider:
-w3 = Web3(Web3.HTTPProvider('https://eth-mainnet.alchemyapi.io/v2/'+alchemy_key))
+if not args.positions and not (args.contract and args.address):
+  sys.exit("Provide contract and user address, or positions file with --positions option")
 
-contract_address = args.contract
-my_address = args.address 
+if args.step <= 0:
+  sys.exit("Projection step must be a positive number of minutes")
+
+w3 = cli.setup(args)
+
+import numpy
+import block_index
+import multicall
+import tables
+import contracts
+
+blocks = block_index.BlockIndex(w3)
 
 if args.keep:
   keep_balance = float(args.keep)
@@ -64,14 +118,26 @@ if args.time:
 else:
   transaction_time = DEFAULT_TIME
 
-transaction_block = w3.eth.blockNumber + transaction_time * BLOCKS_PER_MINUTE
+head = blocks.get_head()[0]
+blocks_per_minute = blocks.block_rate(RATE_WINDOW) * 60
+
+if args.positions:
+  print('Measured %f blocks per minute over the last %d blocks' % (blocks_per_minute, RATE_WINDOW), file=sys.stderr)
+  minutes = numpy.arange(0, args.horizon + 1, args.step, dtype=numpy.float64)
+  tables.write_table(args.output, projection(read_positions(args.positions), head, blocks_per_minute, minutes))
+  sys.exit()
+
+contract_address = args.contract
+my_address = args.address 
+
+transaction_block = head + int(transaction_time * blocks_per_minute)
 
-contract = load_contract(w3.toChecksumAddress(contract_address))
+contract = contracts.load_contract(w3, w3.toChecksumAddress(contract_address))
 
 decimals = contract.functions.decimals().call()
 underlying = contract.functions.underlying().call()
 
-underlying_contract = load_token(underlying)
+underlying_contract = contracts.load_token(w3, underlying)
 underlying_decimals = underlying_contract.functions.decimals().call()
 underlying_symbol = underlying_contract.functions.symbol().call()
 
@@ -82,6 +148,7 @@ borrow_rate_per_block = contract.functions.borrowRatePerBlock().call()
 add_borrow_interest = int(borrow_rate_per_block * (transaction_block - accrual_block_number) * borrow_balance_stored / mantissa)
 transaction_borrow_balance = borrow_balance_stored + add_borrow_interest
 
+print('Measured %f blocks per minute over the last %d blocks' % (blocks_per_minute, RATE_WINDOW), file=sys.stderr)
 print('Borrow balance at transaction at block # %d : %f %s' % (transaction_block, transaction_borrow_balance / 10 ** underlying_decimals, underlying_symbol))
 print('Repay: %f %s' % (transaction_borrow_balance / 10 ** underlying_decimals - keep_balance, underlying_symbol))
 print('Remaining balance: %f %s' % (keep_balance, underlying_symbol))
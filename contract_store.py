@@ -0,0 +1,77 @@
+import json
+import sqlite3
+import threading
+
+class ContractStore:
+  def __init__(self, path):
+    # Write-ahead log lets other processes read the store while a crawl is committing:
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    self.db.execute('PRAGMA journal_mode=WAL')
+    self.db.execute('CREATE TABLE IF NOT EXISTS contracts (address TEXT PRIMARY KEY, position INTEGER, data TEXT)')
+    self.db.execute('CREATE TABLE IF NOT EXISTS state (address TEXT PRIMARY KEY, data TEXT)')
+    self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    self.db.commit()
+    self.lock = threading.Lock()
+
+  def __contains__(self, address):
+    with self.lock:
+      return self.db.execute('SELECT 1 FROM contracts WHERE address = ?', (address,)).fetchone() is not None
+
+  def __len__(self):
+    with self.lock:
+      return self.db.execute('SELECT COUNT(*) FROM contracts').fetchone()[0]
+
+  def get(self, address):
+    with self.lock:
+      row = self.db.execute('SELECT data FROM contracts WHERE address = ?', (address,)).fetchone()
+    if row is None:
+      return None
+    return json.loads(row[0])
+
+  # Commit a single contract, so that an interrupted crawl keeps everything read before:
+  def put(self, address, position, contract):
+    with self.lock:
+      self.db.execute('INSERT OR REPLACE INTO contracts (address, position, data) VALUES (?, ?, ?)', (address, position, json.dumps(contract)))
+      self.db.commit()
+
+  def get_meta(self, key, default=None):
+    with self.lock:
+      row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    if row is None:
+      return default
+    return json.loads(row[0])
+
+  def set_meta(self, key, value):
+    with self.lock:
+      self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+      self.db.commit()
+
+  # Stream (address, contract) pairs in registry order:
+  def contracts(self):
+    for address, data in self.db.execute('SELECT address, data FROM contracts ORDER BY position'):
+      yield address, json.loads(data)
+
+  # Replace point-in-time fields of all contracts in one transaction:
+  def replace_state(self, state):
+    with self.lock:
+      self.db.execute('DELETE FROM state')
+      self.db.executemany('INSERT INTO state (address, data) VALUES (?, ?)', [(address, json.dumps(fields)) for address, fields in state.items()])
+      self.db.commit()
+
+  # Replace point-in-time fields of some contracts, keeping the others:
+  def update_state(self, state):
+    with self.lock:
+      self.db.executemany('INSERT OR REPLACE INTO state (address, data) VALUES (?, ?)', [(address, json.dumps(fields)) for address, fields in state.items()])
+      self.db.commit()
+
+  # Stream (address, contract fields, point-in-time fields) of contracts with refreshed state in registry order:
+  def rows(self):
+    for address, data, state in self.db.execute('SELECT contracts.address, contracts.data, state.data FROM contracts JOIN state ON state.address = contracts.address ORDER BY contracts.position'):
+      yield address, json.loads(data), json.loads(state)
+
+  def clear(self):
+    with self.lock:
+      self.db.execute('DELETE FROM contracts')
+      self.db.execute('DELETE FROM state')
+      self.db.execute('DELETE FROM meta')
+      self.db.commit()
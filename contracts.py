@@ -0,0 +1,21 @@
+import abi_cache
+import http_client
+
+# Some tokens don't have ABI available, hence, use WETH for all ERC-20 tokens:
+weth_address = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
+
+def load_token(w3, token_address):
+  return w3.eth.contract(address=token_address, abi=abi_cache.load_abi(weth_address))
+
+def load_contract(w3, contract_address):
+  return w3.eth.contract(address=contract_address, abi=abi_cache.load_abi(contract_address))
+
+# First internal transaction of a contract if it was its successful creation (contract deployed by another contract), None otherwise:
+def first_internal(contract_address):
+  transactions = http_client.etherscan({'module': 'account', 'action': 'txlistinternal', 'address': contract_address, 'sort': 'asc'})
+  if transactions == []:
+    return None
+  if transactions[0]["type"] == "create" and transactions[0]["isError"] == '0':
+    return transactions[0]
+  else:
+    return None
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+# Subcommands with the scripts implementing them, a script is only imported when its subcommand runs:
+COMMANDS = {
+  'uma': ('track_uma.py', 'fetch UMA contracts and their parameters'),
+  'twap': ('twap.py', 'calculate TWAP for Uniswap/Sushiswap pools'),
+  'exit-pool': ('exit_pool.py', 'estimate exit results from UMA LM pools on Balancer'),
+  'compound-repay': ('compound_repay.py', 'calculate expected Compound borrow balance in future'),
+  'block': ('block_timestamp.py', 'convert between blocks and timestamps'),
+}
+
+def usage():
+  lines = ['usage: defi COMMAND [-h] ...', '', 'commands:']
+  for name, (script, description) in COMMANDS.items():
+    lines.append('  %-16s %s' % (name, description))
+  lines.append('')
+  lines.append("Run 'defi COMMAND -h' for options of a command.")
+  return '\n'.join(lines)
+
+if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+  print(usage())
+  sys.exit()
+
+if sys.argv[1] not in COMMANDS:
+  sys.exit("Unknown command %s\n\n%s" % (sys.argv[1], usage()))
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), COMMANDS[sys.argv[1]][0])
+# Scripts parse sys.argv themselves, the program name shows up in their usage:
+sys.argv = ['defi ' + sys.argv[1]] + sys.argv[2:]
+with open(script, 'r') as f:
+  code = compile(f.read(), script, 'exec')
+exec(code, {'__name__': '__main__', '__file__': script})
@@ -1,27 +1,10 @@
 #!/usr/bin/env python3
 
 import argparse
+import csv
 import json
-from web3 import Web3
-from dotenv import load_dotenv
-import requests
-import os
 import sys
-
-load_dotenv()
-
-# etherscan.io API:
-etherscan_api = "https://api.etherscan.io/api"
-
-# Coingecko API:
-coingecko_api = "https://api.coingecko.com/api/v3"
-
-# Get API keys from .env file:
-etherscan_key = os.environ.get("ETHERSCAN_KEY")
-alchemy_key = os.environ.get("ALCHEMY_KEY")
-
-# Some tokens don't have ABI available, hence, use WETH for all ERC-20 tokens:
-weth_address = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
+import cli
 
 # Config json file
 config_file = 'config_exit_pool.json'
@@ -32,30 +15,14 @@ EMP_REGISTER = 'CreatedExpiringMultiParty(address,address)'
 # Default scaling:
 DECIMALS = 18
 
-def load_abi(abi_address):
-  API_ENDPOINT = etherscan_api+"?module=contract&action=getabi&address="+str(abi_address)+"&apikey="+etherscan_key
-  r = requests.get(url = API_ENDPOINT)
-  response = r.json()
-  return response["result"]
-
-def load_token(token_address):
-  ABI = load_abi(weth_address)
-  return w3.eth.contract(address=token_address, abi=ABI)
-
-def load_contract(contract_address):
-  ABI = load_abi(contract_address)
-  return w3.eth.contract(address=contract_address, abi=ABI)
-
-def first_internal(contract_address):
-  API_ENDPOINT = etherscan_api+"?module=account&action=txlistinternal&address="+contract_address+"&sort=asc&apikey="+etherscan_key
-  r = requests.get(url = API_ENDPOINT)
-  response = r.json()
-  if response["status"] == '0':
-    return None
-  if response["result"][0]["type"] == "create" and response["result"][0]["isError"] == '0':
-    return response["result"][0]
-  else:
-    return None
+# EMP address (or None) by token address, looked up once per token:
+creations = {}
+
+# Number of grid points where local Balancer math is checked against the pool contract:
+GRID_CHECKS = 5
+
+# Maximum relative difference between local and on-chain swap amounts:
+GRID_TOLERANCE = 1e-6
 
 def get_emp(tx):
   tx_logs = w3.eth.getTransactionReceipt(tx["hash"]).logs
@@ -67,7 +34,7 @@ def get_emp(tx):
   return None
 
 def load_creation(contract_address):
-  creation_tx = first_internal(contract_address)
+  creation_tx = contracts.first_internal(contract_address)
   if creation_tx:
     return get_emp(creation_tx)
   else:
@@ -79,76 +46,339 @@ def safe_div(x, y):
   return x / y
 
 def get_coingecko(price_identifier):
-  if price_identifier not in config["price_id_coingecko"]:
-    return None
-  id = config["price_id_coingecko"][price_identifier]["id"]
-  vs = config["price_id_coingecko"][price_identifier]["vs_currency"]
-  API_ENDPOINT = coingecko_api+"/simple/price?ids="+id+"&vs_currencies="+vs
-  r = requests.get(url = API_ENDPOINT)
-  response = r.json()
-  if id not in response:
-    return None
-  if vs not in response[id]:
-    return None
-  if config["price_id_coingecko"][price_identifier]["inverse"]:
-    return 1 / response[id][vs]
+  return price_cache.get_price(config["price_id_coingecko"], price_identifier)
+
+# Single value or START:END:COUNT range of evenly spaced values:
+def parse_range(value):
+  parts = value.split(':')
+  if len(parts) == 1:
+    return numpy.array([float(value)])
+  if len(parts) != 3 or int(parts[2]) < 1:
+    sys.exit("Invalid range %s, expected START:END:COUNT" % (value))
+  return numpy.linspace(float(parts[0]), float(parts[1]), int(parts[2]))
+
+# BMath.calcOutGivenIn in floating point, works on NumPy arrays:
+def calc_out_given_in(balance_in, weight_in, balance_out, weight_out, amount_in, swap_fee):
+  adjusted_in = amount_in * (1 - swap_fee / 10 ** DECIMALS)
+  return balance_out * (1 - (balance_in / (balance_in + adjusted_in)) ** (weight_in / weight_out))
+
+# BMath.calcInGivenOut in floating point, works on NumPy arrays (NaN when buying out the whole balance):
+def calc_in_given_out(balance_in, weight_in, balance_out, weight_out, amount_out, swap_fee):
+  return balance_in * ((balance_out / (balance_out - amount_out)) ** (weight_out / weight_in) - 1) / (1 - swap_fee / 10 ** DECIMALS)
+
+# Spot price of the synth in the pool and pool invariant from balances and weights:
+def pool_invariant(position):
+  synth_weight = position['synth_pool_weight'] / 10 ** DECIMALS
+  pair_weight = position['pair_pool_weight'] / 10 ** DECIMALS
+  position['pool_v'] = position['synth_pool_balance'] ** synth_weight * position['pair_pool_balance'] ** pair_weight
+  position['current_pool_price'] = safe_div(position['pair_pool_balance'] / pair_weight / 10 ** position['pair_decimals'], position['synth_pool_balance'] / synth_weight / 10 ** position['synth_decimals'])
+  return position
+
+# Outcomes A and B of a position for every combination of settlement price, pool price (None to keep current pool) and relative pool size.
+# Returns the outcome columns together with (pool function, local result) swap checks at a few grid points:
+def exit_grid(position, settlement_prices, pool_prices, relatives):
+  if pool_prices is None:
+    settlement_price, pool_price, relative = [values.ravel() for values in numpy.meshgrid(settlement_prices, [position['current_pool_price']], relatives, indexing='ij')]
   else:
-    return response[id][vs]
+    settlement_price, pool_price, relative = [values.ravel() for values in numpy.meshgrid(settlement_prices, pool_prices, relatives, indexing='ij')]
+  synth_pool_weight = position['synth_pool_weight']
+  pair_pool_weight = position['pair_pool_weight']
+  synth_weight = synth_pool_weight / 10 ** DECIMALS
+  pair_weight = pair_pool_weight / 10 ** DECIMALS
+  synth_decimals = position['synth_decimals']
+  pair_decimals = position['pair_decimals']
+  collateral_decimals = position['collateral_decimals']
+  pool_shares = position['pool_shares']
+  user_collateral = position['user_collateral']
+  user_debt = position['user_debt']
+  swap_fee = position['swap_fee']
+  with numpy.errstate(divide='ignore', invalid='ignore'):
+    if pool_prices is not None:
+      # Rebalance pool to keep the same value at exit:
+      price_scaling = 10 ** (pair_decimals - synth_decimals)
+      synth_balance = position['pool_v'] / ((pool_price * price_scaling) ** pair_weight * (pair_pool_weight / synth_pool_weight) ** pair_weight)
+      pair_balance = (position['pool_v'] / synth_balance ** synth_weight) ** (1 / pair_weight)
+    else:
+      synth_balance = numpy.full(pool_price.shape, float(position['synth_pool_balance']))
+      pair_balance = numpy.full(pool_price.shape, float(position['pair_pool_balance']))
+    user_synth = numpy.floor(synth_balance / pool_shares * position['user_shares']) if pool_shares else numpy.zeros(pool_price.shape)
+    user_pair = numpy.floor(pair_balance / pool_shares * position['user_shares']) if pool_shares else numpy.zeros(pool_price.shape)
+    # Adjust pool size after exit and factor in relative size:
+    synth_rest = numpy.floor((synth_balance - user_synth) * relative)
+    pair_rest = numpy.floor((pair_balance - user_pair) * relative)
+    excess = user_synth + position['user_synth_balance'] - user_debt
+    swap_pair = numpy.where(excess > 0, calc_out_given_in(synth_rest, synth_pool_weight, pair_rest, pair_pool_weight, numpy.abs(excess), swap_fee), 0.0)
+    swap_pair = numpy.where(excess < 0, -calc_in_given_out(pair_rest, pair_pool_weight, synth_rest, synth_pool_weight, numpy.abs(excess), swap_fee), swap_pair)
+  checks = []
+  functions = position['pool_contract'].functions
+  for i in numpy.unique(numpy.linspace(0, len(excess) - 1, GRID_CHECKS).astype(int)).tolist():
+    if excess[i] == 0 or not numpy.isfinite(swap_pair[i]):
+      continue
+    if excess[i] > 0:
+      checks.append((functions.calcOutGivenIn(int(synth_rest[i]), synth_pool_weight, int(pair_rest[i]), pair_pool_weight, int(excess[i]), swap_fee), swap_pair[i]))
+    else:
+      checks.append((functions.calcInGivenOut(int(pair_rest[i]), pair_pool_weight, int(synth_rest[i]), synth_pool_weight, int(-excess[i]), swap_fee), -swap_pair[i]))
+  columns = {
+      'settlement_price': settlement_price,
+      'pool_price': pool_price,
+      'relative': relative,
+      'user_synth_pool': user_synth / 10 ** synth_decimals,
+      'user_pair_pool': user_pair / 10 ** pair_decimals,
+      'swap_pair': swap_pair / 10 ** pair_decimals,
+      'a_collateral': numpy.full(pool_price.shape, user_collateral / 10 ** collateral_decimals),
+      'a_pair': (user_pair + swap_pair) / 10 ** pair_decimals,
+      'b_collateral': (user_synth + position['user_synth_balance']) / 10 ** synth_decimals * settlement_price + numpy.maximum(0, user_collateral / 10 ** collateral_decimals - user_debt / 10 ** synth_decimals * settlement_price),
+      'b_pair': user_pair / 10 ** pair_decimals,
+  }
+  return columns, checks
+
+# Compare local swap amounts with calcOutGivenIn/calcInGivenOut of the pools in one multicall:
+def check_swaps(checks, block):
+  checked = 0
+  for (function, local), onchain in zip(checks, multicall.aggregate(w3, [function for function, local in checks], block)):
+    # Pool contract rejects swaps out of its power approximation range:
+    if onchain is None:
+      continue
+    difference = abs(local - onchain) / max(onchain, 1)
+    if difference > GRID_TOLERANCE:
+      sys.exit("Local Balancer math differs from pool %s by %e" % (function.address, difference))
+    checked += 1
+  print('Checked local Balancer math against pool contracts at %d points' % (checked), file=sys.stderr)
+
+# EMP, synth and pair addresses of 2-token pool with one EMP synth token, None if neither token was created by an EMP:
+def find_emp(pool_tokens):
+  for synth_address, pair_address in ((pool_tokens[0], pool_tokens[1]), (pool_tokens[1], pool_tokens[0])):
+    if synth_address not in creations:
+      creations[synth_address] = load_creation(synth_address)
+    if creations[synth_address]:
+      return creations[synth_address], synth_address, pair_address
+  return None
+
+# Portfolio file is a CSV table with pool and address columns, and optional settlement_price, pool_price and relative columns per position:
+def read_portfolio(path):
+  with open(path, 'r', newline='') as f:
+    rows = list(csv.DictReader(f))
+  for row in rows:
+    if not row.get('pool') or not row.get('address'):
+      sys.exit("Portfolio file %s needs pool and address on every row" % (path))
+  return rows
+
+def skip_position(row, reason):
+  print('Skipping pool %s of %s: %s' % (row['pool'], row['address'], reason), file=sys.stderr)
+
+# Outcomes of all portfolio positions, shared pools, EMPs and tokens are read once and all calls are batched in multicalls at the same block:
+def portfolio(rows, block):
+  for row in rows:
+    row['pool'] = w3.toChecksumAddress(row['pool'])
+    row['address'] = w3.toChecksumAddress(row['address'])
+  pool_contracts = {pool_address: contracts.load_contract(w3, pool_address) for pool_address in dict.fromkeys(row['pool'] for row in rows)}
+  pools = dict(zip(pool_contracts, multicall.aggregate_named(w3, [{
+      'num_tokens': contract.functions.getNumTokens(),
+      'tokens': contract.functions.getFinalTokens(),
+      'pool_shares': contract.functions.totalSupply(),
+      'swap_fee': contract.functions.getSwapFee(),
+  } for contract in pool_contracts.values()], block)))
+
+  skipped = {}
+  for pool_address, pool in pools.items():
+    # getFinalTokens() fails for pools that are not finalized, which are rejected below:
+    if None in (pool['num_tokens'], pool['pool_shares'], pool['swap_fee']):
+      skipped[pool_address] = "Failed reading pool"
+      continue
+    if pool['num_tokens'] != 2 or pool['tokens'] is None:
+      skipped[pool_address] = "This script works only with 2 Balancer pool tokens"
+      continue
+    found = find_emp(pool['tokens'])
+    if not found:
+      skipped[pool_address] = "Cannot find EMP synth token in the pool"
+      continue
+    pool['emp_address'], pool['synth_address'], pool['pair_address'] = found
+
+  valid_pools = [pool_address for pool_address in pools if pool_address not in skipped]
+  emp_contracts = {emp_address: contracts.load_contract(w3, emp_address) for emp_address in dict.fromkeys(pools[pool_address]['emp_address'] for pool_address in valid_pools)}
+  emp_calls = [{
+      'contract_state': contract.functions.contractState(),
+      'price_identifier': contract.functions.priceIdentifier(),
+      'collateral_address': contract.functions.collateralCurrency(),
+      'cum_fee_mul': contract.functions.cumulativeFeeMultiplier(),
+  } for contract in emp_contracts.values()]
+  balance_calls = [{
+      'synth_pool_balance': pool_contracts[pool_address].functions.getBalance(pools[pool_address]['synth_address']),
+      'synth_pool_weight': pool_contracts[pool_address].functions.getNormalizedWeight(pools[pool_address]['synth_address']),
+      'pair_pool_balance': pool_contracts[pool_address].functions.getBalance(pools[pool_address]['pair_address']),
+      'pair_pool_weight': pool_contracts[pool_address].functions.getNormalizedWeight(pools[pool_address]['pair_address']),
+  } for pool_address in valid_pools]
+  results = multicall.aggregate_named(w3, emp_calls + balance_calls, block)
+  emps = dict(zip(emp_contracts, results[:len(emp_calls)]))
+  for pool_address, balances in zip(valid_pools, results[len(emp_calls):]):
+    pools[pool_address].update(balances)
+    emp = emps[pools[pool_address]['emp_address']]
+    if None in emp.values():
+      skipped[pool_address] = "Failed reading EMP %s" % (pools[pool_address]['emp_address'])
+    elif None in balances.values():
+      skipped[pool_address] = "Failed reading pool balances"
+    elif emp['contract_state'] != 0:
+      skipped[pool_address] = "This script works only with open EMP contracts"
+
+  valid_rows = []
+  for row in rows:
+    if row['pool'] in skipped:
+      skip_position(row, skipped[row['pool']])
+    else:
+      valid_rows.append(row)
+  rows = valid_rows
+  token_contracts = {}
+  for row in rows:
+    pool = pools[row['pool']]
+    for token_address in (pool['synth_address'], pool['pair_address'], emps[pool['emp_address']]['collateral_address']):
+      if token_address not in token_contracts:
+        token_contracts[token_address] = contracts.load_token(w3, token_address)
+  token_calls = [{'symbol': contract.functions.symbol(), 'decimals': contract.functions.decimals()} for contract in token_contracts.values()]
+  user_calls = [{
+      'user_shares': pool_contracts[row['pool']].functions.balanceOf(row['address']),
+      'user_synth_balance': token_contracts[pools[row['pool']]['synth_address']].functions.balanceOf(row['address']),
+      'user_positions': emp_contracts[pools[row['pool']]['emp_address']].functions.positions(row['address']),
+  } for row in rows]
+  results = multicall.aggregate_named(w3, token_calls + user_calls, block)
+  tokens = dict(zip(token_contracts, results[:len(token_calls)]))
+
+  report = {}
+  checks = []
+  for row, user in zip(rows, results[len(token_calls):]):
+    pool = pools[row['pool']]
+    emp = emps[pool['emp_address']]
+    if None in user.values():
+      skip_position(row, "Failed reading user position")
+      continue
+    failed_tokens = [token_address for token_address in (pool['synth_address'], pool['pair_address'], emp['collateral_address']) if None in tokens[token_address].values()]
+    if failed_tokens != []:
+      skip_position(row, "Failed reading token %s" % (', '.join(failed_tokens)))
+      continue
+    if user['user_positions'][1] != 0:
+      skip_position(row, "This script does not handle pending withrawal requests")
+      continue
+    if row.get('settlement_price'):
+      settlement_prices = parse_range(row['settlement_price'])
+    elif args.settlement_price:
+      settlement_prices = parse_range(args.settlement_price)
+    else:
+      price_identifier = emp['price_identifier'].strip(b'\x00').decode()
+      # Coingecko prices of the whole config are fetched together on the first lookup:
+      coingecko_price = get_coingecko(price_identifier)
+      if not coingecko_price:
+        skip_position(row, "Price identifier %s does not have Coingecko source, set settlement_price column" % (price_identifier))
+        continue
+      settlement_prices = numpy.array([coingecko_price])
+    pool_price = row.get('pool_price') or args.pool_price
+    relative = row.get('relative') or args.relative or '1'
+    synth = tokens[pool['synth_address']]
+    pair = tokens[pool['pair_address']]
+    collateral = tokens[emp['collateral_address']]
+    position = pool_invariant({
+        'pool_contract': pool_contracts[row['pool']],
+        'pool_shares': pool['pool_shares'],
+        'swap_fee': pool['swap_fee'],
+        'synth_pool_balance': pool['synth_pool_balance'],
+        'synth_pool_weight': pool['synth_pool_weight'],
+        'pair_pool_balance': pool['pair_pool_balance'],
+        'pair_pool_weight': pool['pair_pool_weight'],
+        'synth_decimals': synth['decimals'],
+        'pair_decimals': pair['decimals'],
+        'collateral_decimals': collateral['decimals'],
+        'user_shares': user['user_shares'],
+        'user_synth_balance': user['user_synth_balance'],
+        'user_debt': user['user_positions'][0][0],
+        'user_collateral': int(user['user_positions'][3][0] * emp['cum_fee_mul'] / 10 ** DECIMALS),
+    })
+    columns, position_checks = exit_grid(position, settlement_prices, parse_range(pool_price) if pool_price else None, parse_range(relative))
+    checks.extend(position_checks)
+    points = len(columns['settlement_price'])
+    for name, value in (('pool', row['pool']), ('address', row['address']), ('synth', synth['symbol']), ('pair', pair['symbol']), ('collateral', collateral['symbol'])):
+      report.setdefault(name, []).extend([value] * points)
+    for name, values in columns.items():
+      report.setdefault(name, []).extend(values.tolist())
+  check_swaps(checks, block)
+  return report
 
 parser = argparse.ArgumentParser()
-parser.add_argument("pool", type=str, help="calculate exit from this Balancer pool")
-parser.add_argument("address", type=str, help="user address")
-parser.add_argument("-s", "--settlement_price", type=str, help="Expected settlement price on expiration")
-parser.add_argument("-r", "--relative", type=str, help="relative pool size at exit (1=100%) without user position")
-parser.add_argument("-p", "--pool_price", type=str, help="synth price in pool at exit")
+parser.add_argument("pool", type=str, nargs="?", help="calculate exit from this Balancer pool")
+parser.add_argument("address", type=str, nargs="?", help="user address")
+parser.add_argument("--portfolio", type=str, metavar="FILE", help="calculate exits of all pool and address positions in this CSV file in one batched fetch")
+parser.add_argument("-s", "--settlement_price", type=str, help="Expected settlement price on expiration, or START:END:COUNT range")
+parser.add_argument("-r", "--relative", type=str, help="relative pool size at exit (1=100%%) without user position, or START:END:COUNT range")
+parser.add_argument("-p", "--pool_price", type=str, help="synth price in pool at exit, or START:END:COUNT range")
+parser.add_argument("-o", "--output", type=str, default="-", help="grid or portfolio output file (.csv, .tsv, .parquet or .npz, default stdout)")
+parser.add_argument("--prefetch-prices", action="store_true", help="fetch Coingecko prices of all price identifiers in the config into the price cache and exit")
+parser.add_argument("--price-ttl", type=int, metavar="SECONDS", help="use cached Coingecko prices not older than SECONDS (default: 300)")
+cli.add_arguments(parser)
 args = parser.parse_args()
 
+w3 = cli.setup(args)
+
+import numpy
+import abi_cache
+import multicall
+import price_cache
+import tables
+import contracts
+
+if args.price_ttl is not None:
+  price_cache.ttl = args.price_ttl
+
 try:
   with open(config_file, 'r') as f:
     config = json.load(f)
 except FileNotFoundError:
   config = {"price_id_coingecko": {}}
 
+if args.prefetch_prices:
+  cached, fetched = price_cache.prefetch(config["price_id_coingecko"])
+  print('Cached %d Coingecko prices, fetched %d' % (cached, fetched))
+  sys.exit()
+
+if not args.portfolio and not (args.pool and args.address):
+  sys.exit("Provide pool and user address, or portfolio file with --portfolio option")
+
+# Any range switches to grid mode, evaluated locally after a single state fetch:
+grid = any(':' in value for value in (args.settlement_price, args.pool_price, args.relative) if value)
+
 if args.relative:
-  relative = float(args.relative)
+  relatives = parse_range(args.relative)
 else:
-  relative = 1
+  relatives = numpy.array([1.0])
+relative = float(relatives[0])
 
 if args.settlement_price:
-  settlement_price = float(args.settlement_price)
+  settlement_prices = parse_range(args.settlement_price)
+  settlement_price = float(settlement_prices[0])
 else:
   settlement_price = None
 
-# HTTPProvider:
-w3 = Web3(Web3.HTTPProvider('https://eth-mainnet.alchemyapi.io/v2/'+alchemy_key))
+register_event_hash = w3.keccak(text=EMP_REGISTER)
 
-pool_address = w3.toChecksumAddress(args.pool)
-user_address = w3.toChecksumAddress(args.address)
+token_abi = abi_cache.load_abi(contracts.weth_address)
 
-register_event_hash = w3.keccak(text=EMP_REGISTER)
+if args.portfolio:
+  # All positions are read at the same block:
+  tables.write_table(args.output, portfolio(read_portfolio(args.portfolio), w3.eth.blockNumber))
+  sys.exit()
 
-token_abi = load_abi(weth_address)
+pool_address = w3.toChecksumAddress(args.pool)
+user_address = w3.toChecksumAddress(args.address)
 
-pool_contract = load_contract(pool_address)
+pool_contract = contracts.load_contract(w3, pool_address)
 
 if pool_contract.functions.getNumTokens().call() != 2:
   sys.exit("This script works only with 2 Balancer pool tokens")
 
 pool_tokens = pool_contract.functions.getFinalTokens().call()
 
-emp_address = load_creation(pool_tokens[0])
-if emp_address:
-  synth_address = pool_tokens[0]
-  pair_address = pool_tokens[1]
-else:
-  emp_address = load_creation(pool_tokens[1])
-  if emp_address:
-    synth_address = pool_tokens[1]
-    pair_address = pool_tokens[0]
-  else:
-    sys.exit("Cannot find EMP synth token in the pool")
+found = find_emp(pool_tokens)
+if not found:
+  sys.exit("Cannot find EMP synth token in the pool")
+emp_address, synth_address, pair_address = found
 
-emp_contract = load_contract(emp_address)
+emp_contract = contracts.load_contract(w3, emp_address)
 if emp_contract.functions.contractState().call() != 0:
   sys.exit("This script works only with open EMP contracts")
 
@@ -158,15 +388,15 @@ if not settlement_price:
     sys.exit("This price identifier does not have Coingecko source. Set expected expiration with '--settlement-price' option")
 
 collateral_address = emp_contract.functions.collateralCurrency().call()
-collateral_contract = load_token(collateral_address)
+collateral_contract = contracts.load_token(w3, collateral_address)
 collateral_symbol = collateral_contract.functions.symbol().call()
 collateral_decimals = collateral_contract.functions.decimals().call()
 
-pair_contract = load_token(pair_address)
+pair_contract = contracts.load_token(w3, pair_address)
 pair_symbol = pair_contract.functions.symbol().call()
 pair_decimals = pair_contract.functions.decimals().call()
 
-synth_contract = load_token(synth_address)
+synth_contract = contracts.load_token(w3, synth_address)
 synth_symbol = synth_contract.functions.symbol().call()
 synth_decimals = synth_contract.functions.decimals().call()
 user_synth_balance = synth_contract.functions.balanceOf(user_address).call()
@@ -189,9 +419,35 @@ current_pool_price = safe_div(pair_pool_balance / (pair_pool_weight / 10 ** DECI
 current_synth_pool_balance = synth_pool_balance
 current_pair_pool_balance = pair_pool_balance
 
+swap_fee = pool_contract.functions.getSwapFee().call()
+
+if grid:
+  if not args.settlement_price:
+    settlement_prices = numpy.array([settlement_price])
+  position = pool_invariant({
+      'pool_contract': pool_contract,
+      'pool_shares': pool_shares,
+      'swap_fee': swap_fee,
+      'synth_pool_balance': synth_pool_balance,
+      'synth_pool_weight': synth_pool_weight,
+      'pair_pool_balance': pair_pool_balance,
+      'pair_pool_weight': pair_pool_weight,
+      'synth_decimals': synth_decimals,
+      'pair_decimals': pair_decimals,
+      'collateral_decimals': collateral_decimals,
+      'user_shares': user_shares,
+      'user_synth_balance': user_synth_balance,
+      'user_debt': user_debt,
+      'user_collateral': user_collateral,
+  })
+  columns, checks = exit_grid(position, settlement_prices, parse_range(args.pool_price) if args.pool_price else None, relatives)
+  check_swaps(checks, 'latest')
+  tables.write_table(args.output, columns)
+  sys.exit()
+
 # Rebalance pool to keep the same value at exit if pool price provided
 if args.pool_price:
-  pool_price = float(args.pool_price)
+  pool_price = float(parse_range(args.pool_price)[0])
   price_scaling = 10 ** (pair_decimals - synth_decimals) 
   pair_pool_balance = (pool_v / ((pool_v / ((pool_price * price_scaling) ** (pair_pool_weight / 10 ** DECIMALS) * (pair_pool_weight / synth_pool_weight) ** (pair_pool_weight / 10 ** DECIMALS))) ** (synth_pool_weight / 10 ** DECIMALS))) ** (1 / (pair_pool_weight / 10 ** DECIMALS)) 
   synth_pool_balance = pool_v / ((pool_price * price_scaling) ** (pair_pool_weight / 10 ** DECIMALS) * (pair_pool_weight / synth_pool_weight) ** (pair_pool_weight / 10 ** DECIMALS))
@@ -205,8 +461,6 @@ user_pair_pool = int(safe_div(pair_pool_balance, pool_shares) * user_shares)
 synth_pool_balance = int((synth_pool_balance - user_synth_pool) * relative)
 pair_pool_balance = int((pair_pool_balance - user_pair_pool) * relative)
 
-swap_fee = pool_contract.functions.getSwapFee().call()
-
 if user_synth_pool + user_synth_balance > user_debt:
   swap_pair = pool_contract.functions.calcOutGivenIn(synth_pool_balance, synth_pool_weight, pair_pool_balance, pair_pool_weight, user_synth_pool + user_synth_balance - user_debt, swap_fee).call()
 elif user_synth_pool + user_synth_balance < user_debt:
@@ -0,0 +1,124 @@
+import os
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from web3 import Web3
+import rate_limit
+
+# etherscan.io API (override with ETHERSCAN_API):
+DEFAULT_ETHERSCAN_API = "https://api.etherscan.io/api"
+
+# Coingecko API (override with COINGECKO_API):
+DEFAULT_COINGECKO_API = "https://api.coingecko.com/api/v3"
+
+# ETH node API used when ETH_NODE_API is not set:
+ALCHEMY_API = "https://eth-mainnet.alchemyapi.io/v2/"
+
+# Kept-alive connections per host, enough for all concurrent workers:
+POOL_SIZE = 32
+
+# Request timeout in seconds:
+TIMEOUT = 30
+
+# Retries of failed requests, waiting a random time up to BACKOFF_BASE * 2 ** attempt (capped at BACKOFF_MAX) seconds:
+MAX_RETRIES = 6
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+# HTTP statuses worth retrying:
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# Etherscan reports rate limiting with HTTP 200 and one of these results:
+ETHERSCAN_RATE_LIMIT = ('Max rate limit reached', 'Max calls per sec rate limit reached')
+
+# Etherscan results meaning that the query is valid but has nothing to return:
+ETHERSCAN_EMPTY = ('No transactions found', 'No records found')
+
+class EtherscanError(Exception):
+  pass
+
+def backoff(attempt):
+  return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def retry_delay(response, attempt):
+  retry_after = response.headers.get('Retry-After')
+  if retry_after and retry_after.isdigit():
+    return int(retry_after)
+  return backoff(attempt)
+
+# Retry connection errors, timeouts and overloaded servers with jittered exponential backoff:
+class RetryAdapter(HTTPAdapter):
+  def send(self, request, **kwargs):
+    attempt = 0
+    while True:
+      try:
+        response = super().send(request, **kwargs)
+      except (requests.ConnectionError, requests.Timeout):
+        if attempt == MAX_RETRIES:
+          raise
+        time.sleep(backoff(attempt))
+        attempt += 1
+        continue
+      if response.status_code not in RETRY_STATUS or attempt == MAX_RETRIES:
+        return response
+      response.close()
+      time.sleep(retry_delay(response, attempt))
+      attempt += 1
+
+def make_session():
+  new_session = requests.Session()
+  adapter = RetryAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+  new_session.mount('https://', adapter)
+  new_session.mount('http://', adapter)
+  return new_session
+
+# Shared by all threads, so that connections are kept alive between requests:
+session = make_session()
+
+def etherscan_api():
+  return os.environ.get("ETHERSCAN_API", DEFAULT_ETHERSCAN_API)
+
+def coingecko_api():
+  return os.environ.get("COINGECKO_API", DEFAULT_COINGECKO_API)
+
+def node_api():
+  if os.environ.get("ETH_NODE_API"):
+    return os.environ["ETH_NODE_API"]
+  return ALCHEMY_API + os.environ.get("ALCHEMY_KEY", "")
+
+def get_json(url, params=None):
+  response = session.get(url, params=params, timeout=TIMEOUT)
+  response.raise_for_status()
+  return response.json()
+
+# Etherscan API result, [] for empty lists, raises EtherscanError on errors:
+def etherscan(params):
+  params = dict(params, apikey=os.environ.get("ETHERSCAN_KEY", ""))
+  attempt = 0
+  while True:
+    rate_limit.etherscan.acquire()
+    response = get_json(etherscan_api(), params)
+    if response["status"] == '1':
+      return response["result"]
+    if response["message"].startswith('No ') or response["result"] in ETHERSCAN_EMPTY:
+      return []
+    if not isinstance(response["result"], str) or not response["result"].startswith(ETHERSCAN_RATE_LIMIT) or attempt == MAX_RETRIES:
+      raise EtherscanError("%s: %s" % (response["message"], response["result"]))
+    time.sleep(backoff(attempt))
+    attempt += 1
+
+def coingecko(path, params=None):
+  rate_limit.coingecko.acquire()
+  return get_json(coingecko_api() + path, params)
+
+# Web3 HTTPProvider sending all requests through the shared session (web3 otherwise keeps a session per thread):
+class HTTPProvider(Web3.HTTPProvider):
+  def make_request(self, method, params):
+    request_data = self.encode_rpc_request(method, params)
+    response = session.post(self.endpoint_uri, data=request_data, **self.get_request_kwargs())
+    response.raise_for_status()
+    return self.decode_rpc_response(response.content)
+
+def provider(endpoint_uri=None):
+  return HTTPProvider(endpoint_uri or node_api(), request_kwargs={'timeout': TIMEOUT})
@@ -0,0 +1,48 @@
+# Initial number of blocks per eth_getLogs request:
+CHUNK_SIZE = 500000
+
+# Node error messages meaning the requested range holds too many logs:
+TOO_MANY_RESULTS = (
+  'query returned more than',
+  'log response size exceeded',
+  'response size exceeded',
+  'too many',
+  'limit exceeded',
+  'range is too large',
+  'block range',
+  'timeout',
+)
+
+def too_many_results(error):
+  message = str(error).lower()
+  return any(pattern in message for pattern in TOO_MANY_RESULTS)
+
+# Yield (from_block, to_block, logs) for consecutive chunks, halving the chunk when the node rejects it as too large
+# and growing it back after successful requests:
+def iter_chunks(w3, log_filter, from_block, to_block, chunk_size=CHUNK_SIZE):
+  max_chunk_size = chunk_size
+  start = from_block
+  while start <= to_block:
+    end = min(start + chunk_size - 1, to_block)
+    try:
+      logs = w3.eth.getLogs(dict(log_filter, fromBlock=start, toBlock=end))
+    except ValueError as error:
+      if end == start or not too_many_results(error):
+        raise
+      chunk_size = max(1, (end - start + 1) // 2)
+      continue
+    yield start, end, logs
+    start = end + 1
+    chunk_size = min(chunk_size * 2, max_chunk_size)
+
+def get_logs(w3, log_filter, from_block, to_block, chunk_size=CHUNK_SIZE):
+  logs = []
+  for start, end, chunk_logs in iter_chunks(w3, log_filter, from_block, to_block, chunk_size):
+    logs.extend(chunk_logs)
+  return logs
+
+# Address from an indexed event topic, either HexBytes or raw hex string:
+def topic_address(topic):
+  if not isinstance(topic, str):
+    topic = topic.hex()
+  return '0x' + topic[-40:]
@@ -0,0 +1,89 @@
+from web3 import Web3
+from web3.exceptions import BadFunctionCallOutput
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from eth_abi.exceptions import DecodingError
+
+# Multicall3 contract address (same on all EVM chains):
+multicall_address = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
+# Multicall3 deployment block on mainnet, earlier blocks fall back to single calls:
+MULTICALL_BLOCK = 14353601
+
+# Maximum number of calls aggregated in a single eth_call:
+BATCH_SIZE = 500
+
+MULTICALL_ABI = [
+  {
+    "inputs": [{"components": [{"name": "target", "type": "address"}, {"name": "allowFailure", "type": "bool"}, {"name": "callData", "type": "bytes"}], "name": "calls", "type": "tuple[]"}],
+    "name": "aggregate3",
+    "outputs": [{"components": [{"name": "success", "type": "bool"}, {"name": "returnData", "type": "bytes"}], "name": "returnData", "type": "tuple[]"}],
+    "stateMutability": "payable",
+    "type": "function"
+  },
+  {
+    "inputs": [],
+    "name": "getCurrentBlockTimestamp",
+    "outputs": [{"name": "timestamp", "type": "uint256"}],
+    "stateMutability": "view",
+    "type": "function"
+  }
+]
+
+# aggregate3 selector and argument types, matching MULTICALL_ABI:
+AGGREGATE3_SELECTOR = Web3.keccak(text='aggregate3((address,bool,bytes)[])')[:4]
+AGGREGATE3_INPUT = '(address,bool,bytes)[]'
+AGGREGATE3_OUTPUT = '(bool,bytes)[]'
+
+# Decode return data the same way as ContractFunction.call() does:
+def decode(w3, function, data):
+  output_types = get_abi_output_types(function.abi)
+  decoded = w3.codec.decode_abi(output_types, data)
+  normalized = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, decoded)
+  if len(normalized) == 1:
+    return normalized[0]
+  return normalized
+
+def call_single(function, block):
+  try:
+    return function.call(block_identifier=block)
+  except (ValueError, BadFunctionCallOutput, DecodingError):
+    return None
+
+# Batches are encoded with the ABI codec directly, as encoding through the aggregate3 contract function validates and
+# normalizes every address of the batch again, which dominates the CPU time of large batches:
+def aggregate_batch(w3, batch, block):
+  calls = [(function.address, True, Web3.toBytes(hexstr=function._encode_transaction_data())) for function in batch]
+  data = AGGREGATE3_SELECTOR + w3.codec.encode_abi([AGGREGATE3_INPUT], [calls])
+  response = w3.codec.decode_abi([AGGREGATE3_OUTPUT], w3.eth.call({'to': multicall_address, 'data': data}, block))[0]
+  results = []
+  for function, (success, data) in zip(batch, response):
+    # Calls to addresses without code succeed with empty return data:
+    if not success or len(data) == 0:
+      results.append(None)
+      continue
+    try:
+      results.append(decode(w3, function, data))
+    except DecodingError:
+      results.append(None)
+  return results
+
+# Call all contract functions at the same block, failed calls are returned as None.
+# Batches are sent concurrently when executor is provided, results keep the order of functions:
+def aggregate(w3, functions, block='latest', batch_size=BATCH_SIZE, executor=None):
+  if isinstance(block, int) and block < MULTICALL_BLOCK:
+    if executor:
+      return list(executor.map(lambda function: call_single(function, block), functions))
+    return [call_single(function, block) for function in functions]
+  batches = [functions[i:i+batch_size] for i in range(0, len(functions), batch_size)]
+  if executor:
+    batch_results = executor.map(lambda batch: aggregate_batch(w3, batch, block), batches)
+  else:
+    batch_results = [aggregate_batch(w3, batch, block) for batch in batches]
+  return [result for results in batch_results for result in results]
+
+# Same as aggregate, but takes a list of {name: function} dicts and returns a list of {name: result} dicts:
+def aggregate_named(w3, named_calls, block='latest', batch_size=BATCH_SIZE, executor=None):
+  functions = [function for calls in named_calls for function in calls.values()]
+  results = iter(aggregate(w3, functions, block, batch_size, executor))
+  return [{name: next(results) for name in calls} for calls in named_calls]
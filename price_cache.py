@@ -0,0 +1,77 @@
+import json
+import os
+import time
+import http_client
+
+# JSON file holding {coingecko id: {vs_currency: [price, fetch time]}} (override with PRICE_CACHE_FILE):
+DEFAULT_CACHE_FILE = ".price_cache.json"
+
+# Seconds a cached price is used before it is fetched again:
+ttl = 300
+
+# Maximum number of ids in a single /simple/price request, all vs_currencies are requested together:
+IDS_BATCH = 100
+
+# Cache contents loaded in this process:
+memo = None
+
+def get_cache_file():
+  return os.environ.get("PRICE_CACHE_FILE", DEFAULT_CACHE_FILE)
+
+def read_cache():
+  try:
+    with open(get_cache_file(), 'r') as f:
+      return json.load(f)
+  except (FileNotFoundError, ValueError):
+    return {}
+
+def write_cache(cache):
+  path = get_cache_file()
+  tmp_path = path + ".%d.tmp" % (os.getpid())
+  with open(tmp_path, 'w') as f:
+    json.dump(cache, f)
+  os.replace(tmp_path, path)
+
+def load_cache():
+  global memo
+  if memo is None:
+    memo = read_cache()
+  return memo
+
+def is_fresh(cache, coin, currency, now):
+  entry = cache.get(coin, {}).get(currency)
+  return entry is not None and now - entry[1] < ttl
+
+# Fetch prices of all (id, vs_currency) pairs in as few requests as possible, ids missing on Coingecko are cached as None:
+def fetch(pairs, cache, now):
+  coins = sorted(set(coin for coin, currency in pairs))
+  currencies = sorted(set(currency for coin, currency in pairs))
+  for i in range(0, len(coins), IDS_BATCH):
+    response = http_client.coingecko("/simple/price", {'ids': ','.join(coins[i:i + IDS_BATCH]), 'vs_currencies': ','.join(currencies)})
+    for coin in coins[i:i + IDS_BATCH]:
+      for currency in currencies:
+        cache.setdefault(coin, {})[currency] = [response.get(coin, {}).get(currency), now]
+
+# Make sure prices of all price identifiers in {price identifier: {id, vs_currency, inverse}} config are cached and fresh:
+def prefetch(price_ids):
+  cache = load_cache()
+  now = time.time()
+  pairs = set((source["id"], source["vs_currency"]) for source in price_ids.values())
+  stale = [(coin, currency) for coin, currency in pairs if not is_fresh(cache, coin, currency, now)]
+  if stale != []:
+    fetch(stale, cache, now)
+    write_cache(cache)
+  return len(pairs), len(stale)
+
+# Price of a price identifier, the first lookup fetches the whole config so that later lookups are served from the cache:
+def get_price(price_ids, price_identifier):
+  if price_identifier not in price_ids:
+    return None
+  prefetch(price_ids)
+  source = price_ids[price_identifier]
+  price = load_cache()[source["id"]][source["vs_currency"]][0]
+  if not price:
+    return None
+  if source["inverse"]:
+    return 1 / price
+  return price
@@ -0,0 +1,214 @@
+import atexit
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from eth_utils import function_abi_to_4byte_selector
+import abi_cache
+import http_client
+import multicall
+
+# Latency histogram bucket bounds in seconds (same as Prometheus client defaults):
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Prefix of Prometheus metric names:
+METRIC_PREFIX = 'defi'
+
+class Stat:
+  def __init__(self):
+    self.count = 0
+    self.errors = 0
+    self.bytes_sent = 0
+    self.bytes_received = 0
+    self.seconds = 0.0
+    self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+  def add(self, seconds, bytes_sent=0, bytes_received=0, error=False):
+    self.count += 1
+    self.errors += int(error)
+    self.bytes_sent += bytes_sent
+    self.bytes_received += bytes_received
+    self.seconds += seconds
+    self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+  def to_dict(self):
+    return {
+      'count': self.count,
+      'errors': self.errors,
+      'bytes_sent': self.bytes_sent,
+      'bytes_received': self.bytes_received,
+      'seconds': self.seconds,
+      'buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], self.buckets)),
+    }
+
+class Profile:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.started = time.monotonic()
+    # {(kind, name): Stat}, kind is rpc (JSON-RPC method), call (contract function), multicall (function inside aggregate3) or http (endpoint):
+    self.stats = {}
+
+  def record(self, kind, name, seconds, bytes_sent=0, bytes_received=0, error=False):
+    with self.lock:
+      if (kind, name) not in self.stats:
+        self.stats[(kind, name)] = Stat()
+      self.stats[(kind, name)].add(seconds, bytes_sent, bytes_received, error)
+
+  def snapshot(self):
+    with self.lock:
+      return {key: stat.to_dict() for key, stat in sorted(self.stats.items())}
+
+# Profile of this process:
+profile = Profile()
+
+# Map 4-byte selectors to function signatures of all ABIs loaded so far:
+def function_names():
+  names = {}
+  abis = [multicall.MULTICALL_ABI]
+  for abi in abi_cache.memo.values():
+    try:
+      abis.append(json.loads(abi))
+    except ValueError:
+      continue
+  for abi in abis:
+    for entry in abi:
+      if entry.get('type') == 'function':
+        signature = entry['name'] + '(' + ','.join(argument['type'] for argument in entry['inputs']) + ')'
+        names['0x' + function_abi_to_4byte_selector(entry).hex()] = signature
+  return names
+
+def call_data(params):
+  data = params[0].get('data') or params[0].get('input') or '0x'
+  if not isinstance(data, str):
+    data = '0x' + bytes(data).hex()
+  return data
+
+# Functions called through aggregate3, resolved to names in the report:
+def multicall_selectors(w3, data):
+  calls = w3.codec.decode_abi(['(address,bool,bytes)[]'], bytes.fromhex(data[10:]))[0]
+  return ['0x' + call[2][:4].hex() for call in calls]
+
+def middleware(make_request, w3):
+  aggregate3_selector = '0x' + function_abi_to_4byte_selector(multicall.MULTICALL_ABI[0]).hex()
+  def middleware(method, params):
+    started = time.monotonic()
+    error = False
+    try:
+      response = make_request(method, params)
+      error = 'error' in response
+      return response
+    except Exception:
+      error = True
+      response = None
+      raise
+    finally:
+      seconds = time.monotonic() - started
+      bytes_sent = len(json.dumps(params, default=str))
+      bytes_received = len(json.dumps(response.get('result'), default=str)) if response else 0
+      profile.record('rpc', method, seconds, bytes_sent, bytes_received, error)
+      if method == 'eth_call':
+        data = call_data(params)
+        profile.record('call', data[:10], seconds, bytes_sent, bytes_received, error)
+        if data[:10] == aggregate3_selector:
+          for selector in multicall_selectors(w3, data):
+            profile.record('multicall', selector, 0)
+  return middleware
+
+def endpoint_name(request):
+  url = urllib.parse.urlparse(request.url)
+  query = dict(urllib.parse.parse_qsl(url.query))
+  if 'action' in query:
+    return url.netloc + ' ' + query['action']
+  if request.method == 'POST':
+    return url.netloc + ' POST'
+  return url.netloc + url.path
+
+# requests response hook, measures all HTTP traffic of the shared session:
+def response_hook(response, *args, **kwargs):
+  request = response.request
+  bytes_sent = len(request.body or b'')
+  profile.record('http', endpoint_name(request), response.elapsed.total_seconds(), bytes_sent, len(response.content), not response.ok)
+
+def resolve(kind, name, names):
+  if kind in ('call', 'multicall'):
+    return names.get(name, name)
+  return name
+
+def table(snapshot, wall_seconds):
+  names = function_names()
+  lines = ['Wall time: %.2fs' % (wall_seconds), '%-10s %-60s %8s %6s %12s %12s %10s %10s' % ('kind', 'name', 'count', 'errors', 'sent', 'received', 'total s', 'mean ms')]
+  for (kind, name), stat in snapshot.items():
+    mean = stat['seconds'] / stat['count'] * 1000 if stat['count'] else 0
+    lines.append('%-10s %-60s %8d %6d %12d %12d %10.2f %10.1f' % (kind, resolve(kind, name, names)[:60], stat['count'], stat['errors'], stat['bytes_sent'], stat['bytes_received'], stat['seconds'], mean))
+  return '\n'.join(lines)
+
+def to_json(snapshot, wall_seconds):
+  names = function_names()
+  return json.dumps({
+    'script': os.path.basename(sys.argv[0]),
+    'wall_seconds': wall_seconds,
+    'stats': [dict(stat, kind=kind, name=resolve(kind, name, names)) for (kind, name), stat in snapshot.items()],
+  }, indent=2)
+
+def label(value):
+  return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+# Prometheus textfile collector format:
+def to_prometheus(snapshot, wall_seconds):
+  names = function_names()
+  script = label(os.path.basename(sys.argv[0]))
+  lines = [
+    '# HELP %s_wall_seconds Wall time of the last run.' % (METRIC_PREFIX),
+    '# TYPE %s_wall_seconds gauge' % (METRIC_PREFIX),
+    '%s_wall_seconds{script="%s"} %f' % (METRIC_PREFIX, script, wall_seconds),
+  ]
+  metrics = [
+    ('requests_total', 'counter', 'Requests by kind and name.', 'count'),
+    ('request_errors_total', 'counter', 'Failed requests by kind and name.', 'errors'),
+    ('request_sent_bytes_total', 'counter', 'Request payload bytes.', 'bytes_sent'),
+    ('request_received_bytes_total', 'counter', 'Response payload bytes.', 'bytes_received'),
+  ]
+  for metric, metric_type, description, field in metrics:
+    lines.append('# HELP %s_%s %s' % (METRIC_PREFIX, metric, description))
+    lines.append('# TYPE %s_%s %s' % (METRIC_PREFIX, metric, metric_type))
+    for (kind, name), stat in snapshot.items():
+      lines.append('%s_%s{script="%s",kind="%s",name="%s"} %d' % (METRIC_PREFIX, metric, script, kind, label(resolve(kind, name, names)), stat[field]))
+  lines.append('# HELP %s_request_duration_seconds Request latency by kind and name.' % (METRIC_PREFIX))
+  lines.append('# TYPE %s_request_duration_seconds histogram' % (METRIC_PREFIX))
+  for (kind, name), stat in snapshot.items():
+    labels = 'script="%s",kind="%s",name="%s"' % (script, kind, label(resolve(kind, name, names)))
+    cumulative = 0
+    for bound, count in stat['buckets'].items():
+      cumulative += count
+      lines.append('%s_request_duration_seconds_bucket{%s,le="%s"} %d' % (METRIC_PREFIX, labels, bound, cumulative))
+    lines.append('%s_request_duration_seconds_sum{%s} %f' % (METRIC_PREFIX, labels, stat['seconds']))
+    lines.append('%s_request_duration_seconds_count{%s} %d' % (METRIC_PREFIX, labels, stat['count']))
+  return '\n'.join(lines) + '\n'
+
+# Print the summary table to stderr ('-') or write JSON (.json) or Prometheus textfile (.prom) output:
+def report(output):
+  snapshot = profile.snapshot()
+  wall_seconds = time.monotonic() - profile.started
+  if output == '-':
+    print(table(snapshot, wall_seconds), file=sys.stderr)
+    return
+  if output.endswith('.json'):
+    content = to_json(snapshot, wall_seconds)
+  elif output.endswith('.prom'):
+    content = to_prometheus(snapshot, wall_seconds)
+  else:
+    content = table(snapshot, wall_seconds) + '\n'
+  # Atomic replace, so that textfile collectors never read a partial file:
+  tmp_path = output + ".%d.tmp" % (os.getpid())
+  with open(tmp_path, 'w') as f:
+    f.write(content)
+  os.replace(tmp_path, output)
+
+# Measure all JSON-RPC requests as the outermost middleware (including cache hits and rate limiting) and all HTTP traffic:
+def install(w3, output):
+  w3.middleware_onion.add(middleware, 'profiler')
+  http_client.session.hooks['response'].append(response_hook)
+  atexit.register(report, output)
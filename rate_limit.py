@@ -0,0 +1,53 @@
+import threading
+import time
+
+# Set to False to disable throttling (e.g. when replaying recorded responses):
+enabled = True
+
+# Rate in requests per second, rate 0 disables throttling:
+class TokenBucket:
+  def __init__(self, rate, capacity=None):
+    self.rate = rate
+    self.capacity = capacity or max(1, rate)
+    self.tokens = self.capacity
+    self.updated = time.monotonic()
+    self.lock = threading.Lock()
+
+  def set_rate(self, rate):
+    with self.lock:
+      self.rate = rate
+      self.capacity = max(1, rate)
+      self.tokens = min(self.tokens, self.capacity)
+
+  # Block until a request may be sent:
+  def acquire(self):
+    if not enabled or self.rate == 0:
+      return
+    while True:
+      with self.lock:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return
+        wait = (1 - self.tokens) / self.rate
+      time.sleep(wait)
+
+# Etherscan free tier allows 5 requests per second:
+etherscan = TokenBucket(5)
+
+# Coingecko free tier allows about 30 requests per minute:
+coingecko = TokenBucket(0.5, 5)
+
+# ETH node requests per second:
+node = TokenBucket(25)
+
+# Web3 middleware taking a token from the bucket before every JSON-RPC request:
+def middleware(bucket):
+  def rate_limit_middleware(make_request, w3):
+    def middleware(method, params):
+      bucket.acquire()
+      return make_request(method, params)
+    return middleware
+  return rate_limit_middleware
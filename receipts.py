@@ -0,0 +1,10 @@
+import rpc_batch
+
+# Receipts requested in a single JSON-RPC batch:
+BATCH_SIZE = 100
+
+# Raw receipts (JSON-RPC dicts with hex strings, no web3 formatting) of all transactions in JSON-RPC batches of
+# eth_getTransactionReceipt, in the order of tx_hashes, None for unknown transactions. Receipts are served from the RPC
+# cache where possible. Batches are sent concurrently when executor is provided:
+def get_receipts(w3, tx_hashes, batch_size=BATCH_SIZE, executor=None):
+  return rpc_batch.request(w3, 'eth_getTransactionReceipt', [[tx_hash] for tx_hash in tx_hashes], batch_size, executor)
@@ -0,0 +1,63 @@
+import json
+import time
+import http_client
+import profiler
+import rate_limit
+import rpc_cache
+
+# Requests sent in a single JSON-RPC batch:
+BATCH_SIZE = 100
+
+def post(endpoint, payload):
+  rate_limit.node.acquire()
+  response = http_client.session.post(endpoint, json=payload, timeout=http_client.TIMEOUT)
+  response.raise_for_status()
+  return response.json()
+
+def rpc_request(request_id, method, params):
+  return {'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': params}
+
+# Result of a JSON-RPC reply, errors are raised as ValueError like web3 does:
+def reply_result(reply):
+  if 'error' in reply:
+    raise ValueError(reply['error'])
+  return reply['result']
+
+# Raw results of one batch in the order of params_list:
+def send_batch(endpoint, method, params_list):
+  replies = post(endpoint, [rpc_request(i, method, params) for i, params in enumerate(params_list)])
+  # Nodes without batch support answer with a single error, fall back to one request at a time:
+  if not isinstance(replies, list):
+    return [reply_result(post(endpoint, rpc_request(0, method, params))) for params in params_list]
+  results = {reply['id']: reply_result(reply) for reply in replies}
+  return [results.get(i) for i in range(len(params_list))]
+
+# Batches bypass the web3 middleware, hence, requests are served from and stored to the RPC cache and counted by the
+# profiler here, the same way as single requests:
+def request_batch(w3, method, params_list):
+  cache = rpc_cache.active
+  make_request = w3.provider.make_request
+  keys = [cache.cache_key(method, params, make_request) if cache else None for params in params_list]
+  results = [cache.lookup(key, method) if key else None for key in keys]
+  missing = [i for i, result in enumerate(results) if result is None]
+  seconds = 0
+  if missing != []:
+    started = time.monotonic()
+    for i, result in zip(missing, send_batch(w3.provider.endpoint_uri, method, [params_list[i] for i in missing])):
+      results[i] = result
+    seconds = (time.monotonic() - started) / len(missing)
+    if cache:
+      cache.store([(keys[i], method, results[i]) for i in missing if keys[i]], make_request)
+  for i, (params, result) in enumerate(zip(params_list, results)):
+    profiler.profile.record('rpc', method, seconds if i in missing else 0, len(json.dumps(params, default=str)), len(json.dumps(result, default=str)))
+  return results
+
+# Raw results (JSON-RPC values with hex strings, no web3 formatting) of one method for every params list, sent in JSON-RPC
+# batches and in the order of params_lists. Batches are sent concurrently when executor is provided:
+def request(w3, method, params_lists, batch_size=BATCH_SIZE, executor=None):
+  batches = [params_lists[i:i + batch_size] for i in range(0, len(params_lists), batch_size)]
+  if executor:
+    batch_results = executor.map(lambda batch: request_batch(w3, method, batch), batches)
+  else:
+    batch_results = [request_batch(w3, method, batch) for batch in batches]
+  return [result for results in batch_results for result in results]
@@ -0,0 +1,157 @@
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import block_index
+
+# SQLite file with cached JSON-RPC responses:
+DEFAULT_CACHE_FILE = "rpc_cache.sqlite"
+
+# Chain head is refreshed after this many seconds:
+HEAD_TTL = 60
+
+# Position of block parameter for methods pinned to a block:
+BLOCK_PARAM = {
+  'eth_call': 1,
+  'eth_getBalance': 1,
+  'eth_getCode': 1,
+  'eth_getTransactionCount': 1,
+  'eth_getStorageAt': 2,
+  'eth_getBlockByNumber': 0,
+}
+
+# Methods where the block is only known from the response:
+RESULT_BLOCK = ('eth_getTransactionReceipt', 'eth_getTransactionByHash', 'eth_getBlockByHash')
+
+def block_number(block_identifier):
+  if isinstance(block_identifier, int):
+    return block_identifier
+  if isinstance(block_identifier, str) and block_identifier.startswith('0x'):
+    return int(block_identifier, 16)
+  # latest, pending, earliest, safe or finalized:
+  return None
+
+class RPCCache:
+  def __init__(self, path, finality_depth):
+    self.finality_depth = finality_depth
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    self.db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, method TEXT, result TEXT)')
+    self.db.commit()
+    self.lock = threading.Lock()
+    self.hits = {}
+    self.misses = {}
+    self.head = None
+    self.head_time = 0
+
+  def safe_block(self, make_request):
+    if self.head is None or time.monotonic() - self.head_time > HEAD_TTL:
+      response = make_request('eth_blockNumber', [])
+      self.head = int(response['result'], 16)
+      self.head_time = time.monotonic()
+    return self.head - self.finality_depth
+
+  # Block number the request is pinned to, None if it is not pinned to a fixed block:
+  def request_block(self, method, params):
+    if method in BLOCK_PARAM:
+      if len(params) <= BLOCK_PARAM[method]:
+        return None
+      return block_number(params[BLOCK_PARAM[method]])
+    if method == 'eth_getLogs':
+      if 'blockHash' in params[0]:
+        return None
+      from_block = block_number(params[0].get('fromBlock'))
+      to_block = block_number(params[0].get('toBlock'))
+      if from_block is None or to_block is None:
+        return None
+      return to_block
+    return None
+
+  def key(self, method, params):
+    return hashlib.sha256(json.dumps([method, params], sort_keys=True, default=str).encode()).hexdigest()
+
+  def get(self, key):
+    with self.lock:
+      row = self.db.execute('SELECT result FROM responses WHERE key = ?', (key,)).fetchone()
+    if row is None:
+      return None
+    return json.loads(row[0])
+
+  # Store (key, method, result) rows in one transaction:
+  def put(self, rows):
+    with self.lock:
+      self.db.executemany('INSERT OR REPLACE INTO responses (key, method, result) VALUES (?, ?, ?)', [(key, method, json.dumps(result)) for key, method, result in rows])
+      self.db.commit()
+
+  def count(self, counter, method):
+    with self.lock:
+      counter[method] = counter.get(method, 0) + 1
+
+  # Cache key of a request that may be answered from the cache, None if it is not pinned to a final block:
+  def cache_key(self, method, params, make_request):
+    if method not in BLOCK_PARAM and method not in RESULT_BLOCK and method != 'eth_getLogs':
+      return None
+    if method not in RESULT_BLOCK:
+      block = self.request_block(method, params)
+      if block is None or block > self.safe_block(make_request):
+        return None
+    return self.key(method, params)
+
+  # Cached result of the request, None on a miss:
+  def lookup(self, key, method):
+    result = self.get(key)
+    self.count(self.hits if result is not None else self.misses, method)
+    return result
+
+  # Store results of (key, method, result) requests, results of RESULT_BLOCK methods only when their block is final:
+  def store(self, requests, make_request):
+    rows = []
+    for key, method, result in requests:
+      if result is None:
+        continue
+      if method in RESULT_BLOCK:
+        block = block_number(result.get('blockNumber', result.get('number')))
+        if block is None or block > self.safe_block(make_request):
+          continue
+      rows.append((key, method, result))
+    if rows != []:
+      self.put(rows)
+
+  def middleware(self, make_request, w3):
+    def middleware(method, params):
+      key = self.cache_key(method, params, make_request)
+      if key is None:
+        return make_request(method, params)
+      result = self.lookup(key, method)
+      if result is not None:
+        return {'jsonrpc': '2.0', 'id': 0, 'result': result}
+      response = make_request(method, params)
+      if 'error' not in response:
+        self.store([(key, method, response.get('result'))], make_request)
+      return response
+    return middleware
+
+  def report(self):
+    lines = ['RPC cache: %d hits, %d misses' % (sum(self.hits.values()), sum(self.misses.values()))]
+    for method in sorted(set(self.hits) | set(self.misses)):
+      lines.append('  %s: %d hits, %d misses' % (method, self.hits.get(method, 0), self.misses.get(method, 0)))
+    return '\n'.join(lines)
+
+# Cache installed in this process, JSON-RPC batches sent outside of web3 (see rpc_batch.py) use it directly:
+active = None
+
+# Install the cache as the innermost middleware, cache file and finality depth can be set in RPC_CACHE_FILE and RPC_CACHE_FINALITY.
+# Responses for blocks closer to the chain head than the finality depth may still be reorganized, hence, are not cached:
+def install(w3, stats=False):
+  path = os.environ.get("RPC_CACHE_FILE", DEFAULT_CACHE_FILE)
+  finality_depth = int(os.environ.get("RPC_CACHE_FINALITY", block_index.FINALITY_DEPTH))
+  global active
+  cache = RPCCache(path, finality_depth)
+  active = cache
+  w3.middleware_onion.inject(cache.middleware, 'rpc_cache', layer=0)
+  if stats:
+    atexit.register(lambda: print(cache.report(), file=sys.stderr))
+  return cache
@@ -0,0 +1,183 @@
+import json
+import os
+import numpy
+import logscan
+import block_index
+
+# Directory with reconstructed pool price series (override with SYNC_SERIES_DIR):
+DEFAULT_SERIES_DIR = ".sync_series"
+
+# Uniswap V2 factory deployment, no pool has Sync events before this block:
+START_BLOCK = 10000835
+
+# Sync event signature, emitted on every reserves update:
+SYNC_EVENT = 'Sync(uint112,uint112)'
+
+# One record per block with Sync events: reserves and cumulative prices at the end of the block as big-endian integers:
+RECORD_DTYPE = numpy.dtype([
+  ('block', '>u8'),
+  ('timestamp', '>u8'),
+  ('reserve0', 'V16'),
+  ('reserve1', 'V16'),
+  ('price0_cumulative', 'V32'),
+  ('price1_cumulative', 'V32'),
+])
+
+Q112 = 2 ** 112
+UINT256 = 2 ** 256
+UINT32 = 2 ** 32
+
+def to_int(value):
+  return int.from_bytes(bytes(value), 'big')
+
+def pack_record(block, timestamp, reserve0, reserve1, price0_cumulative, price1_cumulative):
+  return (block, timestamp, reserve0.to_bytes(16, 'big'), reserve1.to_bytes(16, 'big'), price0_cumulative.to_bytes(32, 'big'), price1_cumulative.to_bytes(32, 'big'))
+
+# Cumulative prices the pool would report at timestamp, same as UniswapV2OracleLibrary.currentCumulativePrices:
+def counterfactual(record, timestamp):
+  reserve0 = to_int(record['reserve0'])
+  reserve1 = to_int(record['reserve1'])
+  price0_cumulative = to_int(record['price0_cumulative'])
+  price1_cumulative = to_int(record['price1_cumulative'])
+  elapsed = timestamp - int(record['timestamp'])
+  if elapsed > 0 and reserve0 != 0 and reserve1 != 0:
+    price0_cumulative = (price0_cumulative + (reserve1 * Q112 // reserve0) * elapsed) % UINT256
+    price1_cumulative = (price1_cumulative + (reserve0 * Q112 // reserve1) * elapsed) % UINT256
+  return price0_cumulative, price1_cumulative
+
+class SyncSeries:
+  def __init__(self, w3, pool_address, blocks, path=None):
+    self.w3 = w3
+    self.pool_address = w3.toChecksumAddress(pool_address)
+    self.blocks = blocks
+    series_dir = path or os.environ.get("SYNC_SERIES_DIR", DEFAULT_SERIES_DIR)
+    os.makedirs(series_dir, exist_ok=True)
+    self.data_path = os.path.join(series_dir, self.pool_address.lower() + ".bin")
+    self.meta_path = os.path.join(series_dir, self.pool_address.lower() + ".json")
+    self.sync_event_hash = w3.keccak(text=SYNC_EVENT)
+    self.load()
+
+  def load(self):
+    try:
+      with open(self.meta_path, 'r') as f:
+        self.last_block = json.load(f)['last_block']
+    except FileNotFoundError:
+      self.last_block = START_BLOCK - 1
+    records = numpy.fromfile(self.data_path, dtype=RECORD_DTYPE) if os.path.exists(self.data_path) else numpy.zeros(0, dtype=RECORD_DTYPE)
+    # Drop records appended after the last saved checkpoint (e.g. interrupted update):
+    valid = int(numpy.searchsorted(records['block'], self.last_block, side='right'))
+    if valid < len(records):
+      records = records[:valid]
+      with open(self.data_path, 'r+b') as f:
+        f.truncate(valid * RECORD_DTYPE.itemsize)
+    self.records = records
+    # Records above finality depth are kept only in memory:
+    self.tail = numpy.zeros(0, dtype=RECORD_DTYPE)
+
+  def save_checkpoint(self, last_block):
+    tmp_path = self.meta_path + ".%d.tmp" % (os.getpid())
+    with open(tmp_path, 'w') as f:
+      json.dump({'last_block': last_block}, f)
+    os.replace(tmp_path, self.meta_path)
+    self.last_block = last_block
+
+  def all_records(self):
+    if len(self.tail) == 0:
+      return self.records
+    return numpy.concatenate([self.records, self.tail])
+
+  # Some nodes include block timestamp in logs, None otherwise:
+  def log_timestamp(self, event):
+    if 'blockTimestamp' in event and event['blockTimestamp'] is not None:
+      return int(event['blockTimestamp'], 16) if isinstance(event['blockTimestamp'], str) else int(event['blockTimestamp'])
+    return None
+
+  # Replay Sync events the same way as UniswapV2Pair._update accumulates prices:
+  def replay(self, logs, state):
+    reserve0, reserve1, price0_cumulative, price1_cumulative, timestamp_last = state
+    last_sync = {}
+    for event in sorted(logs, key=lambda event: (event['blockNumber'], event['logIndex'])):
+      last_sync[event['blockNumber']] = event
+    # Timestamps missing in logs are resolved for all blocks of the chunk at once through the block index:
+    timestamps = {block: self.log_timestamp(event) for block, event in last_sync.items()}
+    missing = sorted(block for block, timestamp in timestamps.items() if timestamp is None)
+    timestamps.update(zip(missing, self.blocks.get_timestamps(missing)))
+    records = []
+    for block in sorted(last_sync):
+      event = last_sync[block]
+      timestamp = timestamps[block]
+      elapsed = (timestamp - timestamp_last) % UINT32
+      if elapsed > 0 and reserve0 != 0 and reserve1 != 0:
+        price0_cumulative = (price0_cumulative + (reserve1 * Q112 // reserve0) * elapsed) % UINT256
+        price1_cumulative = (price1_cumulative + (reserve0 * Q112 // reserve1) * elapsed) % UINT256
+      data = bytes(event['data']) if not isinstance(event['data'], str) else bytes.fromhex(event['data'][2:])
+      reserve0 = int.from_bytes(data[:32], 'big')
+      reserve1 = int.from_bytes(data[32:64], 'big')
+      timestamp_last = timestamp
+      records.append(pack_record(block, timestamp, reserve0, reserve1, price0_cumulative, price1_cumulative))
+    return numpy.array(records, dtype=RECORD_DTYPE), (reserve0, reserve1, price0_cumulative, price1_cumulative, timestamp_last)
+
+  def last_state(self, records):
+    if len(records) == 0:
+      return (0, 0, 0, 0, 0)
+    record = records[-1]
+    return (to_int(record['reserve0']), to_int(record['reserve1']), to_int(record['price0_cumulative']), to_int(record['price1_cumulative']), int(record['timestamp']))
+
+  # Stream new Sync events up to the chain head, persisting finalized chunks as they are processed:
+  def update(self, head=None):
+    if head is None:
+      head = self.w3.eth.blockNumber
+    # Blocks close to the chain head may still be reorganized, hence, are not persisted:
+    safe_block = head - block_index.FINALITY_DEPTH
+    log_filter = {'address': self.pool_address, 'topics': [self.sync_event_hash.hex()]}
+    state = self.last_state(self.records)
+    if self.last_block < safe_block:
+      for start, end, logs in logscan.iter_chunks(self.w3, log_filter, self.last_block + 1, safe_block):
+        records, state = self.replay(logs, state)
+        if len(records) > 0:
+          with open(self.data_path, 'ab') as f:
+            records.tofile(f)
+          self.records = numpy.concatenate([self.records, records])
+        self.save_checkpoint(end)
+    if self.last_block < head:
+      self.tail, state = self.replay(logscan.get_logs(self.w3, log_filter, self.last_block + 1, head), state)
+    else:
+      self.tail = numpy.zeros(0, dtype=RECORD_DTYPE)
+
+  def record_index(self, records, timestamps):
+    index = numpy.searchsorted(records['timestamp'].astype(numpy.int64), numpy.asarray(timestamps, dtype=numpy.int64), side='right') - 1
+    if len(records) == 0:
+      raise ValueError("Pool %s has no Sync events" % (self.pool_address))
+    if numpy.any(index < 0):
+      raise ValueError("Requested timestamp %d is before the first Sync event of pool %s at block %d" % (numpy.min(timestamps), self.pool_address, records[0]['block']))
+    return index
+
+  # Reserves at the given timestamps as float arrays:
+  def reserves_at(self, timestamps):
+    records = self.all_records()
+    index = self.record_index(records, timestamps)
+    reserve0 = numpy.array([to_int(records[i]['reserve0']) for i in index], dtype=numpy.float64)
+    reserve1 = numpy.array([to_int(records[i]['reserve1']) for i in index], dtype=numpy.float64)
+    return reserve0, reserve1
+
+  # Raw TWAP of price0 and price1 (without decimals scaling) for windows [timestamps_1, timestamps_2]:
+  def twap(self, timestamps_1, timestamps_2):
+    records = self.all_records()
+    timestamps_1 = numpy.asarray(timestamps_1, dtype=numpy.int64)
+    timestamps_2 = numpy.asarray(timestamps_2, dtype=numpy.int64)
+    index_1 = self.record_index(records, timestamps_1)
+    index_2 = self.record_index(records, timestamps_2)
+    twap_0 = numpy.empty(len(timestamps_1))
+    twap_1 = numpy.empty(len(timestamps_1))
+    # Exact integer differences of cumulative prices, only the records used by the windows are decoded:
+    for i in range(len(timestamps_1)):
+      price0_cumulative_1, price1_cumulative_1 = counterfactual(records[index_1[i]], int(timestamps_1[i]))
+      price0_cumulative_2, price1_cumulative_2 = counterfactual(records[index_2[i]], int(timestamps_2[i]))
+      duration = int(timestamps_2[i] - timestamps_1[i])
+      if duration <= 0:
+        twap_0[i] = numpy.nan
+        twap_1[i] = numpy.nan
+        continue
+      twap_0[i] = ((price0_cumulative_2 - price0_cumulative_1) % UINT256) / duration / Q112
+      twap_1[i] = ((price1_cumulative_2 - price1_cumulative_1) % UINT256) / duration / Q112
+    return twap_0, twap_1
@@ -0,0 +1,37 @@
+import csv
+import sys
+
+def write_parquet(path, columns):
+  try:
+    import pyarrow
+    import pyarrow.parquet
+  except ImportError:
+    sys.exit("Writing Parquet files requires pyarrow: pip install pyarrow")
+  pyarrow.parquet.write_table(pyarrow.table({name: list(values) for name, values in columns.items()}), path)
+
+def write_npz(path, columns):
+  import numpy
+  numpy.savez_compressed(path, **{name: numpy.asarray(list(values)) for name, values in columns.items()})
+
+# Write {column name: values} as Parquet (.parquet), NumPy arrays (.npz), tab separated (.tsv) or comma separated table ('-' for stdout):
+def write_table(path, columns):
+  if path.endswith('.parquet'):
+    write_parquet(path, columns)
+    return
+  if path.endswith('.npz'):
+    write_npz(path, columns)
+    return
+  if path.endswith('.tsv'):
+    delimiter = '\t'
+  else:
+    delimiter = ','
+  if path == '-':
+    table_file = sys.stdout
+  else:
+    table_file = open(path, 'w', newline='')
+  table_writer = csv.writer(table_file, delimiter=delimiter)
+  table_writer.writerow(list(columns))
+  for row in zip(*columns.values()):
+    table_writer.writerow(row)
+  if table_file is not sys.stdout:
+    table_file.close()
@@ -1,28 +1,15 @@
 #!/usr/bin/env python3
 
+import os
 import time
+import functools
 import datetime
 import json
+import sys
 import csv
 import argparse
-from web3 import Web3
-from dotenv import load_dotenv
-import requests
-import os
-
-load_dotenv()
-
-# etherscan.io API:
-etherscan_api = "https://api.etherscan.io/api"
-
-# Get API keys from .env file:
-etherscan_key = os.environ.get("ETHERSCAN_KEY")
-
-# ETH node API:
-eth_node_api = os.environ.get("ETH_NODE_API")
-
-# Some tokens don't have ABI available, hence, use WETH for all ERC-20 tokens:
-weth_address = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
+import concurrent.futures
+import cli
 
 # Finder contract address:
 finder_address = "0x40f941E48A552bF496B154Af6bf55725f18D77c3"
@@ -39,282 +26,726 @@ JARVIS_CREATE = 'DerivativeDeployed(uint8,address,address)'
 # Jarvis contract creation event signature:
 JARVIS_SELF_CREATE = 'SelfMintingDerivativeDeployed(uint8,address)'
 
+# Registry contract registration event signature:
+REGISTRY_NEW_CONTRACT = 'NewContractRegistered(address,address,address[])'
+
 # Possible EMP contract states:
 EMP_STATES = ('Open', 'ExpiredPriceRequested', 'ExpiredPriceReceived')
 
 # Default scaling:
 DECIMALS = 18
 
-# Use the same ABI for all EMP contracts (will fetch it for the first EMP discovered):
-emp_abi = []
+# Supported contract types: EMP, Perpetual, Jarvis v1, Jarvis v2 and Jarvis Self Minting:
+CONTRACT_TYPES = ('emp', 'perp', 'jarvis_v1', 'jarvis_v2', 'jarvis_self')
 
-# Use the same ABI for all Perpetual contracts (will fetch it for the first Perpetual discovered):
-perp_abi = []
+# Use the same ABI for all contracts of the same type (will fetch it for the first contract of each type discovered):
+type_abis = {}
 
-# Use the same ABI for all Jarvis v1 contracts (will fetch it for the first Jarvis v1 discovered):
-jarvis_v1_abi = []
+# Contract functions read at every block (point-in-time fields and balance checks) by registered address:
+dynamic_functions = {}
+check_functions = {}
 
-# Use the same ABI for all Jarvis v2 contracts (will fetch it for the first Jarvis v2 discovered):
-jarvis_v2_abi = []
+# Contract fields in output order:
+FIELDS = ('type', 'creator', 'deployer', 'deployed_at', 'collateral_requirement', 'contract_state', 'expires_at', 'price_id', 'min_sponsor_tokens', 'liquidation_liveness', 'withdrawal_liveness', 'collateral_address', 'collateral_symbol', 'collateral_decimals', 'collateral_locked', 'synth_address', 'synth_symbol', 'synth_decimals', 'synth_minted')
 
-# Use the same ABI for all Jarvis Self Minting contracts (will fetch it for the first Jarvis Self Minting discovered):
-jarvis_self_abi = []
+# Point-in-time fields refreshed on every run, all other fields are cached permanently:
+DYNAMIC_FIELDS = ('contract_state', 'collateral_locked', 'synth_minted')
 
-# Cache json file
-cache_file = 'cache.json'
+# Number of registry entries read per multicall when walking new registrations:
+REGISTRY_BATCH = 100
 
-# CSV file name
-csv_name = 'contracts.csv'
+# Number of new registry entries whose creations are looked up, read and stored together when crawling:
+CRAWL_BATCH = 100
 
-def load_abi(abi_address):
-  API_ENDPOINT = etherscan_api+"?module=contract&action=getabi&address="+str(abi_address)+"&apikey="+etherscan_key
-  r = requests.get(url = API_ENDPOINT)
-  response = r.json()
-  return response["result"]
-
-def load_token(token_address):
-  ABI = load_abi(weth_address)
-  return w3.eth.contract(address=token_address, abi=ABI)
-
-def load_contract(contract_address):
-  ABI = load_abi(contract_address)
-  return w3.eth.contract(address=contract_address, abi=ABI)
-
-def first_internal(contract_address):
-  API_ENDPOINT = etherscan_api+"?module=account&action=txlistinternal&address="+contract_address+"&sort=asc&apikey="+etherscan_key
-  r = requests.get(url = API_ENDPOINT)
-  response = r.json()
-  if response["status"] == '0':
-    return None
-  if response["result"][0]["type"] == "create" and response["result"][0]["isError"] == '0':
-    return response["result"][0]
-  else:
-    return None
+# Default seconds between polls for new blocks in watch mode:
+WATCH_INTERVAL = 15
 
-def print_cache(registered_address):
-  print('Contract: %s' % (registered_address))
-  print('  Contract type: %s' % (cache[registered_address]['type']))
-  print('  Deployed at: %s UTC' % (datetime.datetime.utcfromtimestamp(cache[registered_address]['deployed_at'])))
-  print('  Creator: %s' % (cache[registered_address]['creator']))
-  print('  Deployer: %s' % (cache[registered_address]['deployer']))
-  print('  Collateral: %s' % (cache[registered_address]['collateral_symbol']))
-  print('  Synth token: %s' % (cache[registered_address]['synth_symbol']))
-  print('  Collateral requirement: %f' % (cache[registered_address]['collateral_requirement']))
-  if cache[registered_address]['contract_state']:
-    print('  Contract state: %s' % (cache[registered_address]['contract_state']))
-  if cache[registered_address]['expires_at']:
-    print('  Expires at: %s UTC' % (datetime.datetime.utcfromtimestamp(cache[registered_address]['expires_at'])))
-  print('  Price identifier: %s' % (cache[registered_address]['price_id']))
-  print('  Minimum sponsor tokens %f' % (cache[registered_address]['min_sponsor_tokens']))
-  print('  Liquidation liveness: %f hours' % (cache[registered_address]['liquidation_liveness'] / 3600))
-  print('  Withdrawal liveness: %f hours' % (cache[registered_address]['withdrawal_liveness'] / 3600))
-  print('  Locked collateral: %f %s' % (cache[registered_address]['collateral_locked'], cache[registered_address]['collateral_symbol']))
-  print('  Synths minted: %f %s' % (cache[registered_address]['synth_minted'], cache[registered_address]['synth_symbol']))
-
-def get_create(tx):
-  tx_logs = w3.eth.getTransactionReceipt(tx["hash"]).logs
-  if tx_logs == []:
-    return None
-  for event in tx_logs:
-    if event["topics"][0] == create_emp_event_hash:
-      if event["address"].lower() == tx["from"]:
-        return {'creator': event["address"], 'deployer': w3.toChecksumAddress('0x'+event["topics"][2].hex()[26:]), 'type': 'emp'}
-    if event["topics"][0] == create_perp_event_hash:
-      if event["address"].lower() == tx["from"]:
-        for perp_event in tx_logs:
-          if perp_event["topics"][0] == create_jarvis_event_hash and int(perp_event["topics"][1].hex(), 16) == 1: 
-            return {'creator': event["address"], 'deployer': w3.toChecksumAddress('0x'+event["topics"][2].hex()[26:]), 'type': 'jarvis_v1'}
-          elif perp_event["topics"][0] == create_jarvis_event_hash and int(perp_event["topics"][1].hex(), 16) == 2: 
-            return {'creator': event["address"], 'deployer': w3.toChecksumAddress('0x'+event["topics"][2].hex()[26:]), 'type': 'jarvis_v2'}
-          elif perp_event["topics"][0] == create_jarvis_self_event_hash:
-            return {'creator': event["address"], 'deployer': w3.toChecksumAddress('0x'+event["topics"][2].hex()[26:]), 'type': 'jarvis_self'}
-        return {'creator': event["address"], 'deployer': w3.toChecksumAddress('0x'+event["topics"][2].hex()[26:]), 'type': 'perp'}
-  return None
-
-def load_creation(contract_address):
-  creation_tx = first_internal(contract_address)
-  if creation_tx:
-    create = get_create(creation_tx)
-    if create:
-      return {'create_time': int(creation_tx["timeStamp"]), 'creator': create['creator'], 'deployer': create['deployer'], 'type': create['type']}
-    else:
-      return None
-  else:
-    return None
-
-def get_block(timestamp):
-  API_ENDPOINT = etherscan_api+"?module=block&action=getblocknobytime&closest=before&timestamp="+str(timestamp)+"&apikey="+etherscan_key
-  r = requests.get(url = API_ENDPOINT)
-  response = r.json()
-  return int(response["result"])
+# Maximum number of addresses in a single eth_getLogs filter in watch mode:
+WATCH_ADDRESS_BATCH = 500
 
-def write_csv():
-  csv_file = open(csv_name, 'w')
-  csv_writer = csv.writer(csv_file, delimiter='\t')
-  first_contract = list(cache.keys())[0]
-  header = ["registered_address"]
-  for column in cache[first_contract]:
-    if isinstance(cache[first_contract][column], dict):
-      for subcolumn in cache[first_contract][column]:
-        header.append(column+"_"+subcolumn)
-    else:
-      header.append(column)
-  csv_writer.writerow(header)
-  for registered_address in cache:
-    row = [registered_address]
-    for column in cache[registered_address].values():
-      if isinstance(column, dict):
-        for subcolumn in column.values():
-          row.append(subcolumn)
-      else:
-        row.append(column)
-    csv_writer.writerow(row)
-  csv_file.close()
+# Contract store sqlite file (override with CONTRACT_STORE_FILE)
+DEFAULT_STORE_FILE = 'contracts.sqlite'
 
-parser = argparse.ArgumentParser()
-parser.add_argument('-o', '--overwrite-cache', action='store_true', help='Overwrite cache file')
-parser.add_argument("-t", "--timestamp", type=str, help="fetch balances ending at this timestamp")
-args = parser.parse_args()
+# Cache json file of earlier versions, imported into the store once (override with CONTRACT_CACHE_FILE)
+DEFAULT_CACHE_FILE = 'cache.json'
 
-# HTTPProvider:
-w3 = Web3(Web3.HTTPProvider(eth_node_api))
-
-if args.timestamp:
-  timestamp = int(args.timestamp)
-  block = get_block(timestamp)
-else:
-  timestamp = int(time.time())
-  block = 'latest'
-
-create_emp_event_hash = w3.keccak(text=EMP_CREATE)
-create_perp_event_hash = w3.keccak(text=PERP_CREATE)
-create_jarvis_event_hash = w3.keccak(text=JARVIS_CREATE)
-create_jarvis_self_event_hash = w3.keccak(text=JARVIS_SELF_CREATE)
+# CSV file name
+csv_name = 'contracts.csv'
 
-token_abi = load_abi(weth_address)
+# Discovery index json file (override with DISCOVERY_FILE)
+DEFAULT_DISCOVERY_FILE = 'discovery.json'
 
-finder_contract = load_contract(finder_address)
+# Start scanning creation events from this block (before UMA mainnet launch):
+DISCOVERY_START_BLOCK = 9000000
 
-registry_address = finder_contract.functions.getImplementationAddress('0x'+'Registry'.encode("utf-8").hex()).call()
+# Discovery index format, indexes of other versions are rebuilt:
+DISCOVERY_VERSION = 2
 
-registry_contract = load_contract(registry_address)
+def type_abi(contract_type, registered_address):
+  if contract_type not in type_abis:
+    type_abis[contract_type] = abi_cache.load_abi(registered_address)
+  return type_abis[contract_type]
 
-all_registered_contracts = registry_contract.functions.getAllRegisteredContracts().call()
+def print_cache(registered_address, contract):
+  print('Contract: %s' % (registered_address))
+  print('  Contract type: %s' % (contract['type']))
+  print('  Deployed at: %s UTC' % (datetime.datetime.utcfromtimestamp(contract['deployed_at'])))
+  print('  Creator: %s' % (contract['creator']))
+  print('  Deployer: %s' % (contract['deployer']))
+  print('  Collateral: %s' % (contract['collateral_symbol']))
+  print('  Synth token: %s' % (contract['synth_symbol']))
+  print('  Collateral requirement: %f' % (contract['collateral_requirement']))
+  if contract['contract_state']:
+    print('  Contract state: %s' % (contract['contract_state']))
+  if contract['expires_at']:
+    print('  Expires at: %s UTC' % (datetime.datetime.utcfromtimestamp(contract['expires_at'])))
+  print('  Price identifier: %s' % (contract['price_id']))
+  print('  Minimum sponsor tokens %f' % (contract['min_sponsor_tokens']))
+  print('  Liquidation liveness: %f hours' % (contract['liquidation_liveness'] / 3600))
+  print('  Withdrawal liveness: %f hours' % (contract['withdrawal_liveness'] / 3600))
+  print('  Locked collateral: %f %s' % (contract['collateral_locked'], contract['collateral_symbol']))
+  print('  Synths minted: %f %s' % (contract['synth_minted'], contract['synth_symbol']))
+
+# Checksummed creator and deployer addresses repeat across creations, hence, are memoized:
+@functools.lru_cache(maxsize=None)
+def checksum_address(address):
+  return w3.toChecksumAddress(address)
+
+# Single pass over logs of one transaction with raw hex string topics. Returns the first EMP or perpetual creation event
+# (emitted by tx_from when given) and contract type, perpetuals deployed together with a Jarvis deployment event are Jarvis contracts:
+def classify_events(tx_logs, tx_from=None):
+  create_event = None
+  contract_type = None
+  jarvis_type = None
+  for event in tx_logs:
+    topics = event["topics"]
+    if topics == []:
+      continue
+    topic = topics[0]
+    if topic in creator_topics:
+      if create_event is None and (tx_from is None or event["address"].lower() == tx_from):
+        create_event = event
+        contract_type = creator_topics[topic]
+    elif jarvis_type is None and topic == jarvis_topic and int(topics[1], 16) in (1, 2):
+      jarvis_type = 'jarvis_v%d' % (int(topics[1], 16))
+    elif jarvis_type is None and topic == jarvis_self_topic:
+      jarvis_type = 'jarvis_self'
+  if create_event is None:
+    return None
+  if contract_type == 'perp' and jarvis_type:
+    contract_type = jarvis_type
+  return create_event, contract_type
 
-if args.overwrite_cache:
-  cache = {}
-else:
+def get_create(tx, receipt):
+  if receipt is None:
+    return None
+  classified = classify_events(receipt["logs"], tx["from"])
+  if classified is None:
+    return None
+  event, contract_type = classified
+  return {'creator': checksum_address(event["address"]), 'deployer': checksum_address(logscan.topic_address(event["topics"][2])), 'type': contract_type}
+
+# Creations of contracts deployed by UMA creator contracts, creation receipts are fetched in JSON-RPC batches:
+def load_creations(contract_addresses):
+  creation_txs = list(parallel_map(contracts.first_internal, contract_addresses))
+  tx_receipts = receipts.get_receipts(w3, [creation_tx["hash"] for creation_tx in creation_txs if creation_tx], executor=executor)
+  receipt_iter = iter(tx_receipts)
+  creations = []
+  for creation_tx in creation_txs:
+    create = get_create(creation_tx, next(receipt_iter)) if creation_tx else None
+    if create:
+      creations.append({'create_time': int(creation_tx["timeStamp"]), 'creator': create['creator'], 'deployer': create['deployer'], 'type': create['type']})
+    else:
+      creations.append(None)
+  return creations
+
+# All EMP and perpetual creations in the logs of one transaction, perpetuals with a Jarvis deployment event for the same
+# derivative are Jarvis contracts:
+def classify_logs(tx_logs):
+  creations = []
+  jarvis_types = {}
+  for event in tx_logs:
+    topics = [topic.hex() for topic in event["topics"]]
+    if topics == []:
+      continue
+    if topics[0] in creator_topics:
+      creations.append((topics, event["address"], creator_topics[topics[0]]))
+    elif topics[0] == jarvis_topic and int(topics[1], 16) in (1, 2):
+      jarvis_types[logscan.topic_address(topics[3]).lower()] = 'jarvis_v%d' % (int(topics[1], 16))
+    elif topics[0] == jarvis_self_topic:
+      jarvis_types[logscan.topic_address(topics[2]).lower()] = 'jarvis_self'
+  return [{
+      'address': checksum_address(logscan.topic_address(topics[1])),
+      'creator': checksum_address(creator),
+      'deployer': checksum_address(logscan.topic_address(topics[2])),
+      'type': jarvis_types.get(logscan.topic_address(topics[1]).lower(), contract_type) if contract_type == 'perp' else contract_type,
+      'block': tx_logs[0]["blockNumber"],
+  } for topics, creator, contract_type in creations]
+
+# Creators of contracts registered in the block range, from NewContractRegistered events of the registry:
+def registered_creators(from_block, to_block):
+  creators = {}
+  for event in logscan.get_logs(w3, {'address': registry_address, 'topics': [registry_new_contract_event_hash.hex()]}, from_block, to_block):
+    creators[checksum_address(logscan.topic_address(event["topics"][1]))] = checksum_address(logscan.topic_address(event["topics"][2]))
+  return creators
+
+# Scan creation events with chunked eth_getLogs and index created contracts by address. Any contract can emit look-alike
+# creation events, hence, a creation is only accepted from the creator that registered the contract in the registry:
+def discover_contracts(to_block):
   try:
-    with open(cache_file, 'r') as f:
-      cache = json.load(f)
+    with open(discovery_file, 'r') as f:
+      discovery = json.load(f)
   except FileNotFoundError:
-    cache = {}
-
-for registered_address in all_registered_contracts:
-  if registered_address in cache:
-    print_cache(registered_address)
-    continue
-  creation = load_creation(registered_address)
-  if creation and creation["deployer"]:
-    if creation["create_time"] > timestamp:
-      print('Contract %s created after requested timestamp, stopping' % (registered_address))
-      break
-    contract_type = creation["type"]
-    if contract_type == "emp":
-      if emp_abi == []:
-        emp_abi = load_abi(registered_address)
-      contract_abi = emp_abi
-    elif contract_type == "perp":
-      if perp_abi == []:
-        perp_abi = load_abi(registered_address)
-      contract_abi = perp_abi
-    elif contract_type == "jarvis_v1":
-      if jarvis_v1_abi == []:
-        jarvis_v1_abi = load_abi(registered_address)
-      contract_abi = jarvis_v1_abi
-    elif contract_type == "jarvis_v2":
-      if jarvis_v2_abi == []:
-        jarvis_v2_abi = load_abi(registered_address)
-      contract_abi = jarvis_v2_abi
-    elif contract_type == "jarvis_self":
-      if jarvis_self_abi == []:
-        jarvis_self_abi = load_abi(registered_address)
-      contract_abi = jarvis_self_abi
-    else:
+    discovery = {}
+  # Indexes of earlier versions did not check creators, scan again:
+  if discovery.get('version') != DISCOVERY_VERSION:
+    discovery = {'version': DISCOVERY_VERSION, 'last_block': DISCOVERY_START_BLOCK - 1, 'contracts': {}}
+  if discovery['last_block'] >= to_block:
+    return discovery['contracts']
+  log_filter = {'topics': [[create_emp_event_hash.hex(), create_perp_event_hash.hex(), create_jarvis_event_hash.hex(), create_jarvis_self_event_hash.hex()]]}
+  tx_logs = {}
+  for event in logscan.get_logs(w3, log_filter, discovery['last_block'] + 1, to_block):
+    tx_logs.setdefault(event["transactionHash"], []).append(event)
+  creators = registered_creators(discovery['last_block'] + 1, to_block)
+  for tx_hash in tx_logs:
+    for create in classify_logs(sorted(tx_logs[tx_hash], key=lambda event: event["logIndex"])):
+      if creators.get(create['address']) == create['creator']:
+        discovery['contracts'][create['address']] = {'type': create['type'], 'creator': create['creator'], 'deployer': create['deployer'], 'block': create['block']}
+  discovery['last_block'] = to_block
+  with open(discovery_file, 'w') as f:
+    json.dump(discovery, f)
+  return discovery['contracts']
+
+def discovered_creation(contract_address):
+  if contract_address not in discovered:
+    return None
+  create = discovered[contract_address]
+  return {'create_time': blocks.get_timestamp(create['block']), 'creator': create['creator'], 'deployer': create['deployer'], 'type': create['type']}
+
+def contract_calls(contract_type, registered_contract):
+  functions = registered_contract.functions
+  calls = {
+      'collateral_address': functions.collateralCurrency(),
+      'synth_address': functions.tokenCurrency(),
+  }
+  if contract_type == 'jarvis_v1' or contract_type == 'jarvis_v2' or contract_type == 'jarvis_self':
+    calls['liquidatable_data'] = functions.liquidatableData()
+    calls['position_manager_data'] = functions.positionManagerData()
+  else:
+    calls['collateral_requirement'] = functions.collateralRequirement()
+    calls['price_identifier'] = functions.priceIdentifier()
+    calls['min_sponsor_tokens'] = functions.minSponsorTokens()
+    calls['liquidation_liveness'] = functions.liquidationLiveness()
+    calls['withdrawal_liveness'] = functions.withdrawalLiveness()
+  if contract_type == 'emp':
+    calls['expiration'] = functions.expirationTimestamp()
+  return calls
+
+def token_calls(token_address):
+  functions = w3.eth.contract(address=token_address, abi=token_abi).functions
+  return {
+      'symbol': functions.symbol(),
+      'decimals': functions.decimals(),
+  }
+
+# Read static parameters of all pending contracts in two multicall passes pinned to the requested block:
+def read_contracts(pending, block):
+  if pending == []:
+    return
+  contract_results = multicall.aggregate_named(w3, [contract_calls(creation['type'], registered_contract) for registered_address, position, creation, registered_contract in pending], block, executor=executor)
+  token_addresses = []
+  for results in contract_results:
+    for token_address in (results['collateral_address'], results['synth_address']):
+      if token_address and token_address not in token_addresses:
+        token_addresses.append(token_address)
+  token_results = dict(zip(token_addresses, multicall.aggregate_named(w3, [token_calls(token_address) for token_address in token_addresses], block, executor=executor)))
+
+  for (registered_address, position, creation, registered_contract), results in zip(pending, contract_results):
+    contract_type = creation['type']
+    collateral = token_results.get(results['collateral_address'])
+    synth = token_results.get(results['synth_address'])
+    if None in results.values() or not collateral or not synth or None in (collateral['symbol'], collateral['decimals'], synth['symbol'], synth['decimals']):
+      print('Failed reading contract %s at block %s' % (registered_address, block))
       continue
 
-    registered_contract = w3.eth.contract(address=registered_address, abi=contract_abi)
-
-    collateral_address = registered_contract.functions.collateralCurrency().call()
-    collateral_token = w3.eth.contract(address=collateral_address, abi=token_abi)
-    collateral_symbol = collateral_token.functions.symbol().call()
-    collateral_decimals = collateral_token.functions.decimals().call()
-
-    collateral_locked = registered_contract.functions.pfc().call(block_identifier=block)[0] / 10 ** collateral_decimals
-
-    synth_address = registered_contract.functions.tokenCurrency().call()
-    synth_token = w3.eth.contract(address=synth_address, abi=token_abi)
-    synth_symbol = synth_token.functions.symbol().call()
-    synth_decimals = synth_token.functions.decimals().call()
-    synth_minted = synth_token.functions.totalSupply().call(block_identifier=block) / 10 ** synth_decimals
+    collateral_decimals = collateral['decimals']
+    synth_decimals = synth['decimals']
 
     if contract_type == 'jarvis_v1' or contract_type == 'jarvis_v2' or contract_type == 'jarvis_self':
-      liquidatable_data = registered_contract.functions.liquidatableData().call(block_identifier=block)
+      liquidatable_data = results['liquidatable_data']
       collateral_requirement = liquidatable_data[2][0] / 10 ** DECIMALS
       liquidation_liveness = liquidatable_data[1]
     else:
-      collateral_requirement = registered_contract.functions.collateralRequirement().call() / 10 ** DECIMALS
+      collateral_requirement = results['collateral_requirement'] / 10 ** DECIMALS
 
     if contract_type == 'emp':
-      emp_state = EMP_STATES[registered_contract.functions.contractState().call(block_identifier=block)]
-      expiration = int(registered_contract.functions.expirationTimestamp().call())
+      expiration = int(results['expiration'])
     else:
-      emp_state = None
       expiration = None
 
     if contract_type == 'jarvis_v1':
-      position_manager_data = registered_contract.functions.positionManagerData().call(block_identifier=block)
+      position_manager_data = results['position_manager_data']
       price_identifier = position_manager_data[1].strip(b'\x00').decode()
       withdrawal_liveness = position_manager_data[2]
       min_sponsor_tokens = position_manager_data[3][0]
     elif contract_type == 'jarvis_self' or contract_type == 'jarvis_v2':
-      position_manager_data = registered_contract.functions.positionManagerData().call(block_identifier=block)
+      position_manager_data = results['position_manager_data']
       price_identifier = position_manager_data[2].strip(b'\x00').decode()
       withdrawal_liveness = position_manager_data[3]
       min_sponsor_tokens = position_manager_data[4][0]
     else:
-      price_identifier = registered_contract.functions.priceIdentifier().call().strip(b'\x00').decode()
-      min_sponsor_tokens = registered_contract.functions.minSponsorTokens().call() / 10 ** synth_decimals
-      liquidation_liveness = registered_contract.functions.liquidationLiveness().call()
-      withdrawal_liveness = registered_contract.functions.withdrawalLiveness().call()
+      price_identifier = results['price_identifier'].strip(b'\x00').decode()
+      min_sponsor_tokens = results['min_sponsor_tokens'] / 10 ** synth_decimals
+      liquidation_liveness = results['liquidation_liveness']
+      withdrawal_liveness = results['withdrawal_liveness']
 
-    cache[registered_address] = {
+    store.put(registered_address, position, {
         'type': contract_type,
         'creator': creation['creator'],
         'deployer': creation['deployer'],
         'deployed_at': creation['create_time'],
         'collateral_requirement': collateral_requirement,
-        'contract_state': emp_state,
         'expires_at': expiration,
         'price_id': price_identifier,
         'min_sponsor_tokens': min_sponsor_tokens,
         'liquidation_liveness': liquidation_liveness,
         'withdrawal_liveness': withdrawal_liveness,
-        'collateral_address': collateral_address,
-        'collateral_address': collateral_address,
-        'collateral_symbol': collateral_symbol,
+        'collateral_address': results['collateral_address'],
+        'collateral_symbol': collateral['symbol'],
         'collateral_decimals': collateral_decimals,
-        'collateral_locked': collateral_locked,
-        'synth_address': synth_address,
-        'synth_symbol': synth_symbol,
+        'synth_address': results['synth_address'],
+        'synth_symbol': synth['symbol'],
         'synth_decimals': synth_decimals,
-        'synth_minted': synth_minted,
+    })
+
+# Functions of point-in-time fields are built once per contract (building contracts is expensive) and aggregated at every block:
+def dynamic_calls(registered_address, contract):
+  if registered_address not in dynamic_functions:
+    registered_contract = w3.eth.contract(address=registered_address, abi=type_abi(contract['type'], registered_address))
+    synth_token = w3.eth.contract(address=contract['synth_address'], abi=token_abi)
+    calls = {
+        'pfc': registered_contract.functions.pfc(),
+        'total_supply': synth_token.functions.totalSupply(),
+    }
+    if contract['type'] == 'emp':
+      calls['contract_state'] = registered_contract.functions.contractState()
+    dynamic_functions[registered_address] = calls
+  return dynamic_functions[registered_address]
+
+# Read point-in-time fields of cached contracts in one multicall pass pinned to the block:
+def refresh_dynamic(tracked_contracts, block):
+  dynamic = {}
+  if tracked_contracts == {}:
+    return dynamic
+  all_results = multicall.aggregate_named(w3, [dynamic_calls(registered_address, contract) for registered_address, contract in tracked_contracts.items()], block, executor=executor)
+  for (registered_address, contract), results in zip(tracked_contracts.items(), all_results):
+    if None in results.values():
+      print('Failed reading balances of contract %s at block %s' % (registered_address, block))
+      continue
+    if 'contract_state' in results:
+      emp_state = EMP_STATES[results['contract_state']]
+    else:
+      emp_state = None
+    dynamic[registered_address] = {
+        'contract_state': emp_state,
+        'collateral_locked': results['pfc'][0] / 10 ** contract['collateral_decimals'],
+        'synth_minted': results['total_supply'] / 10 ** contract['synth_decimals'],
+    }
+  return dynamic
+
+# Point-in-time fields of contracts at the block from the balance index, without reading the contracts. Locked collateral
+# is the collateral held by the contract, which matches pfc() up to fee multiplier rounding (see check_balances):
+def log_dynamic(tracked_contracts, block):
+  addresses = list(tracked_contracts)
+  points = [block] * len(addresses)
+  collateral = balances.values_at(addresses, 'collateral', points)[0]
+  synth = balances.values_at(addresses, 'synth', points)[0]
+  state = balances.values_at(addresses, 'state', points)[0]
+  dynamic = {}
+  for i, registered_address in enumerate(addresses):
+    contract = tracked_contracts[registered_address]
+    dynamic[registered_address] = {
+        'contract_state': EMP_STATES[state[i]] if contract['type'] == 'emp' else None,
+        'collateral_locked': collateral[i] / 10 ** contract['collateral_decimals'],
+        'synth_minted': synth[i] / 10 ** contract['synth_decimals'],
     }
-    print_cache(registered_address)
+  return dynamic
+
+# Point-in-time fields at the block, from the balance index with --logs option or read from the contracts otherwise:
+def read_dynamic(tracked_contracts, block):
+  if args.logs:
+    return log_dynamic(tracked_contracts, block)
+  return refresh_dynamic(tracked_contracts, block)
+
+# Bring the balance index up to the head. Contracts new to the index are indexed together from the deployment block of the
+# earliest one, as they have no logs before their deployment:
+def index_balances(tracked_contracts, head):
+  new_contracts = [registered_address for registered_address in tracked_contracts if registered_address not in balances.positions]
+  if new_contracts != []:
+    start_block = blocks.get_block(int(min(tracked_contracts[registered_address]['deployed_at'] for registered_address in new_contracts)))
+  balances.update([{
+      'address': registered_address,
+      'type': tracked_contracts[registered_address]['type'],
+      'collateral_address': tracked_contracts[registered_address]['collateral_address'],
+      'synth_address': tracked_contracts[registered_address]['synth_address'],
+      'start_block': start_block,
+  } for registered_address in new_contracts], head)
+
+def check_calls(registered_address, contract):
+  if registered_address not in check_functions:
+    calls = dict(dynamic_calls(registered_address, contract))
+    if contract['type'] == 'emp' or contract['type'] == 'perp':
+      calls['fee_multiplier'] = w3.eth.contract(address=registered_address, abi=type_abi(contract['type'], registered_address)).functions.cumulativeFeeMultiplier()
+    check_functions[registered_address] = calls
+  return check_functions[registered_address]
+
+# Compare the balance index with pfc(), totalSupply() and EMP state read at count blocks spread evenly up to the head (only the head
+# is checked by default, earlier blocks need an archive node). pfc() is raw collateral times the cumulative fee multiplier, which
+# drifts from the held balance: deposits and withdrawals round raw collateral and fee payments round the multiplier, moving pfc()
+# by up to raw collateral / 10^18 per collateral transfer. Larger surpluses are collateral sent to the contract outside of
+# positions and are reported, any other difference is an error:
+def check_balances(tracked_contracts, head, count):
+  first_block = min(balances.start_block(registered_address) for registered_address in tracked_contracts)
+  check_blocks = sorted(set(int(check_block) for check_block in numpy.linspace(head, first_block, count)))
+  checked = 0
+  mismatches = []
+  for check_block in check_blocks:
+    check_timestamp = blocks.get_timestamp(check_block)
+    deployed_contracts = {registered_address: contract for registered_address, contract in tracked_contracts.items() if contract['deployed_at'] <= check_timestamp}
+    all_results = multicall.aggregate_named(w3, [check_calls(registered_address, contract) for registered_address, contract in deployed_contracts.items()], check_block, executor=executor)
+    addresses = list(deployed_contracts)
+    points = [check_block] * len(addresses)
+    collateral, collateral_events = balances.values_at(addresses, 'collateral', points)
+    synth = balances.values_at(addresses, 'synth', points)[0]
+    state = balances.values_at(addresses, 'state', points)[0]
+    for i, (registered_address, results) in enumerate(zip(addresses, all_results)):
+      contract = deployed_contracts[registered_address]
+      if None in results.values():
+        print('Failed reading balances of contract %s at block %s' % (registered_address, check_block))
+        continue
+      checked += 1
+      pfc = results['pfc'][0]
+      raw_collateral = pfc * 10 ** DECIMALS // results.get('fee_multiplier', 10 ** DECIMALS)
+      tolerance = (collateral_events[i] + 1) * 2 * (raw_collateral // 10 ** DECIMALS + 1)
+      surplus = collateral[i] - pfc
+      if synth[i] != results['total_supply'] or results.get('contract_state', 0) != state[i] or surplus < -tolerance:
+        mismatches.append('%s at block %d' % (registered_address, check_block))
+      elif surplus > tolerance:
+        print('Contract %s holds %f %s above pfc() at block %d' % (registered_address, surplus / 10 ** contract['collateral_decimals'], contract['collateral_symbol'], check_block))
+  print('Checked balances of %d contracts at %d blocks against pfc() and totalSupply()' % (checked, len(check_blocks)))
+  if mismatches != []:
+    sys.exit('Balances from logs differ from contract reads: %s' % (', '.join(mismatches)))
+
+# Walk registry entries starting at index until the end of registeredContracts array:
+def registered_contracts_from(index, block='latest'):
+  new_contracts = []
+  while True:
+    start = index + len(new_contracts)
+    for registered_address in multicall.aggregate(w3, [registry_contract.functions.registeredContracts(i) for i in range(start, start + REGISTRY_BATCH)], block):
+      if registered_address is None:
+        return new_contracts
+      new_contracts.append(registered_address)
+
+# Point-in-time fields of all contracts deployed by each timestamp, one multicall pass per block:
+def dynamic_series(tracked_contracts, start, end, step):
+  timestamps = list(range(start, end + 1, step))
+  series_blocks = list(parallel_map(blocks.get_block, timestamps))
+  series = {'timestamp': [], 'block': [], 'registered_address': [], 'contract_state': [], 'collateral_locked': [], 'synth_minted': []}
+  for point_timestamp, point_block in zip(timestamps, series_blocks):
+    deployed_contracts = {registered_address: contract for registered_address, contract in tracked_contracts.items() if contract['deployed_at'] <= point_timestamp}
+    dynamic = read_dynamic(deployed_contracts, point_block)
+    for registered_address in deployed_contracts:
+      if registered_address not in dynamic:
+        continue
+      series['timestamp'].append(point_timestamp)
+      series['block'].append(point_block)
+      series['registered_address'].append(registered_address)
+      series['contract_state'].append(dynamic[registered_address]['contract_state'] or '')
+      series['collateral_locked'].append(dynamic[registered_address]['collateral_locked'])
+      series['synth_minted'].append(dynamic[registered_address]['synth_minted'])
+  return series
+
+# Number of new registry entries to skip next run: resume after the last contract that was cached or is not recognized,
+# failed contracts and contracts not crawled yet are retried:
+def resume_offset(new_contracts, unrecognized):
+  offset = 0
+  for registered_address in new_contracts:
+    if registered_address not in store and registered_address not in unrecognized:
+      break
+    offset += 1
+  return offset
+
+# Read new registry entries up to the block and commit recognized contracts to the store:
+def crawl_registry(block, timestamp):
+  global discovered
+  if args.discover:
+    discovered = discover_contracts(w3.eth.blockNumber)
+  registry_index = store.get_meta('registry_index', 0)
+
+  new_contracts = registered_contracts_from(registry_index, block)
+
+  positions = {registered_address: registry_index + i for i, registered_address in enumerate(new_contracts)}
+
+  uncached_contracts = [registered_address for registered_address in new_contracts if registered_address not in store]
+
+  unrecognized = set()
+
+  # Contracts are read and stored one chunk at a time, so that an interrupted crawl resumes after the last stored chunk:
+  for start in range(0, len(uncached_contracts), CRAWL_BATCH):
+    chunk = uncached_contracts[start:start + CRAWL_BATCH]
+    if args.discover:
+      creations = list(parallel_map(discovered_creation, chunk))
+      # Contracts missing in the discovery index (e.g. created by an unknown creator) are looked up by creation transaction:
+      undiscovered = [i for i, creation in enumerate(creations) if creation is None]
+      for i, creation in zip(undiscovered, load_creations([chunk[i] for i in undiscovered])):
+        creations[i] = creation
+    else:
+      creations = load_creations(chunk)
+
+    pending = []
+    stopped = False
+
+    for registered_address, creation in zip(chunk, creations):
+      if creation and creation["deployer"]:
+        if creation["create_time"] > timestamp:
+          print('Contract %s created after requested timestamp, stopping' % (registered_address))
+          stopped = True
+          break
+        if creation["type"] not in CONTRACT_TYPES:
+          unrecognized.add(registered_address)
+          continue
+        pending.append((registered_address, positions[registered_address], creation, w3.eth.contract(address=registered_address, abi=type_abi(creation["type"], registered_address))))
+      else:
+        print('Unrecognized contract type: %s' % (registered_address))
+        unrecognized.add(registered_address)
+
+    read_contracts(pending, block)
+
+    store.set_meta('registry_index', registry_index + resume_offset(new_contracts, unrecognized))
+
+    if stopped:
+      break
+
+  store.set_meta('registry_index', registry_index + resume_offset(new_contracts, unrecognized))
+
+# Addresses of all contracts with own events, synth mints or synth burns in the block range:
+def touched_contracts(tracked_contracts, from_block, to_block):
+  touched = set()
+  contract_addresses = list(tracked_contracts)
+  synths = {contract['synth_address']: registered_address for registered_address, contract in tracked_contracts.items()}
+  synth_addresses = list(synths)
+  for i in range(0, len(contract_addresses), WATCH_ADDRESS_BATCH):
+    for event in logscan.get_logs(w3, {'address': contract_addresses[i:i + WATCH_ADDRESS_BATCH]}, from_block, to_block):
+      touched.add(event["address"])
+  for i in range(0, len(synth_addresses), WATCH_ADDRESS_BATCH):
+    for topics in ([transfer_event_hash.hex(), balance_index.ZERO_TOPIC], [transfer_event_hash.hex(), None, balance_index.ZERO_TOPIC]):
+      for event in logscan.get_logs(w3, {'address': synth_addresses[i:i + WATCH_ADDRESS_BATCH], 'topics': topics}, from_block, to_block):
+        touched.add(synths[event["address"]])
+  return touched
+
+# Follow new blocks, registering new contracts and re-reading only contracts with activity since the last poll:
+def watch(last_block, interval):
+  tracked_contracts = dict(store.contracts())
+  # Newly registered contracts have no state yet, they are read until it succeeds even without own activity:
+  unread_contracts = set()
+  while True:
+    time.sleep(interval)
+    head = w3.eth.blockNumber
+    if head <= last_block:
+      continue
+    if logscan.get_logs(w3, {'address': registry_address, 'topics': [registry_new_contract_event_hash.hex()]}, last_block + 1, head) != []:
+      crawl_registry(head, blocks.get_timestamp(head))
+      registered_contracts = dict(store.contracts())
+      unread_contracts.update(registered_address for registered_address in registered_contracts if registered_address not in tracked_contracts)
+      tracked_contracts = registered_contracts
+    touched = touched_contracts(tracked_contracts, last_block + 1, head) | unread_contracts
+    dynamic = refresh_dynamic({registered_address: tracked_contracts[registered_address] for registered_address in tracked_contracts if registered_address in touched}, head)
+    unread_contracts.difference_update(dynamic)
+    print('Blocks %d-%d: %d contracts updated' % (last_block + 1, head, len(dynamic)))
+    if dynamic != {}:
+      store.update_state(dynamic)
+      for registered_address in dynamic:
+        print_cache(registered_address, contract_row(tracked_contracts[registered_address], dynamic[registered_address]))
+      write_csv()
+    last_block = head
+
+# Map over items with the worker pool (if any), results keep the order of items:
+def parallel_map(function, items):
+  if executor:
+    return executor.map(function, items)
+  return map(function, items)
+
+def contract_row(contract, state):
+  return {field: state[field] if field in DYNAMIC_FIELDS else contract.get(field) for field in FIELDS}
+
+def flatten(row):
+  columns = {}
+  for column in row:
+    if isinstance(row[column], dict):
+      for subcolumn in row[column]:
+        columns[column+"_"+subcolumn] = row[column][subcolumn]
+    else:
+      columns[column] = row[column]
+  return columns
+
+# Stream rows from the store, header is the union of columns of all rows:
+def write_csv():
+  header = ["registered_address"]
+  for registered_address, contract, state in store.rows():
+    for column in flatten(contract_row(contract, state)):
+      if column not in header:
+        header.append(column)
+  csv_file = open(csv_name, 'w')
+  csv_writer = csv.writer(csv_file, delimiter='\t')
+  csv_writer.writerow(header)
+  for registered_address, contract, state in store.rows():
+    columns = flatten(contract_row(contract, state))
+    columns["registered_address"] = registered_address
+    csv_writer.writerow([columns.get(column) for column in header])
+  csv_file.close()
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-o', '--overwrite-cache', action='store_true', help='Overwrite cache file')
+parser.add_argument("-t", "--timestamp", type=str, help="fetch balances ending at this timestamp")
+parser.add_argument("--from", dest="from_timestamp", type=int, help="fetch balances series starting at this timestamp")
+parser.add_argument("--to", dest="to_timestamp", type=int, help="fetch balances series ending at this timestamp (default: now)")
+parser.add_argument("--step", type=int, default=1440, help="balances series step in minutes (default: 1 day)")
+parser.add_argument("--output", type=str, default="series.npz", help="balances series output file (.npz, .parquet, .csv or .tsv)")
+parser.add_argument("--watch", type=int, nargs="?", const=WATCH_INTERVAL, metavar="SECONDS", help="keep running and update contracts with activity in new blocks, polling every SECONDS (default: %d)" % (WATCH_INTERVAL))
+parser.add_argument("-l", "--logs", action="store_true", help="derive locked collateral, minted synths and EMP state from indexed event logs instead of reading contracts at each block (no archive node needed)")
+parser.add_argument("--check", type=int, default=1, help="with --logs, cross-check indexed balances against contract reads at this many blocks up to the head, earlier blocks need an archive node (default: 1, only the head)")
+parser.add_argument("-d", "--discover", action="store_true", help="discover contract creations by scanning event logs")
+parser.add_argument("-w", "--workers", type=int, default=1, help="number of concurrent workers")
+cli.add_arguments(parser, rpc_cache=True, rate_limits=True)
+args = parser.parse_args()
+
+if args.step <= 0:
+  sys.exit("Balances series step must be a positive number of minutes")
+if args.from_timestamp is not None and args.to_timestamp is not None and args.from_timestamp > args.to_timestamp:
+  sys.exit("Balances series --from timestamp is after --to timestamp")
+
+w3 = cli.setup(args)
+
+import numpy
+import abi_cache
+import multicall
+import logscan
+import block_index
+import cassette
+import tables
+import contract_store
+import contracts
+import receipts
+import balance_index
+
+# Resolved after cassette.install, which redirects them to a temporary directory while recording or replaying:
+store_file = os.environ.get("CONTRACT_STORE_FILE", DEFAULT_STORE_FILE)
+cache_file = os.environ.get("CONTRACT_CACHE_FILE", DEFAULT_CACHE_FILE)
+discovery_file = os.environ.get("DISCOVERY_FILE", DEFAULT_DISCOVERY_FILE)
+
+if args.workers > 1:
+  executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.workers)
+else:
+  executor = None
+
+blocks = block_index.BlockIndex(w3)
+
+if args.logs:
+  balances = balance_index.BalanceIndex(w3)
+
+if args.watch and (args.timestamp or args.from_timestamp is not None):
+  sys.exit("Watch mode follows the chain head, it cannot be combined with -t or --from options")
+
+if args.from_timestamp is not None:
+  # Registry is crawled up to the end of the series:
+  if args.to_timestamp is not None:
+    timestamp = args.to_timestamp
   else:
-    print('Unrecognized contract type: %s' % (registered_address))
+    timestamp = int(cassette.now())
+  if args.from_timestamp > timestamp:
+    sys.exit("Balances series --from timestamp is in the future")
+  block = blocks.get_block(timestamp)
+elif args.timestamp:
+  timestamp = int(args.timestamp)
+  block = blocks.get_block(timestamp)
+elif args.watch:
+  # Watch mode continues from a known block:
+  block, timestamp = blocks.get_head()
+else:
+  timestamp = int(cassette.now())
+  block = 'latest'
+
+create_emp_event_hash = w3.keccak(text=EMP_CREATE)
+create_perp_event_hash = w3.keccak(text=PERP_CREATE)
+create_jarvis_event_hash = w3.keccak(text=JARVIS_CREATE)
+create_jarvis_self_event_hash = w3.keccak(text=JARVIS_SELF_CREATE)
+registry_new_contract_event_hash = w3.keccak(text=REGISTRY_NEW_CONTRACT)
+transfer_event_hash = w3.keccak(text=balance_index.TRANSFER_EVENT)
+
+# Raw hex string topics for classifying raw receipt logs:
+creator_topics = {create_emp_event_hash.hex(): 'emp', create_perp_event_hash.hex(): 'perp'}
+jarvis_topic = create_jarvis_event_hash.hex()
+jarvis_self_topic = create_jarvis_self_event_hash.hex()
+
+token_abi = abi_cache.load_abi(contracts.weth_address)
+
+finder_contract = contracts.load_contract(w3, finder_address)
+
+registry_address = finder_contract.functions.getImplementationAddress('0x'+'Registry'.encode("utf-8").hex()).call()
+
+registry_contract = contracts.load_contract(w3, registry_address)
 
-with open(cache_file, 'w') as f:
-  json.dump(cache, f)
+store = contract_store.ContractStore(store_file)
+
+if args.overwrite_cache:
+  store.clear()
+elif store.get_meta('registry_index') is None:
+  # Import cache.json of earlier versions once:
+  try:
+    with open(cache_file, 'r') as f:
+      cache_data = json.load(f)
+  except FileNotFoundError:
+    cache_data = {}
+  if 'contracts' in cache_data:
+    store.set_meta('registry_index', cache_data['registry_index'])
+    cache_data = cache_data['contracts']
+  for position, registered_address in enumerate(cache_data):
+    store.put(registered_address, position, {field: value for field, value in cache_data[registered_address].items() if field not in DYNAMIC_FIELDS})
+
+# With --logs option only balances are historical (taken from the balance index), the registry and parameters that do not
+# change are read at the head, so that no archive node is needed. Contracts created after the timestamp are not crawled:
+crawl_registry('latest' if args.logs else block, timestamp)
+
+tracked_contracts = {registered_address: contract for registered_address, contract in store.contracts() if contract['deployed_at'] <= timestamp}
+
+if args.logs and tracked_contracts != {}:
+  head, head_timestamp = blocks.get_head()
+  index_balances(tracked_contracts, head)
+  if args.check > 0:
+    check_balances(tracked_contracts, head, args.check)
+  if block == 'latest':
+    block = head
+
+if args.from_timestamp is not None:
+  print('Fetching balances series of %d contracts every %dm from %s UTC to %s UTC' % (len(tracked_contracts), args.step, datetime.datetime.utcfromtimestamp(args.from_timestamp), datetime.datetime.utcfromtimestamp(timestamp)))
+  tables.write_table(args.output, dynamic_series(tracked_contracts, args.from_timestamp, timestamp, args.step * 60))
+  if executor:
+    executor.shutdown(wait=False, cancel_futures=True)
+  sys.exit()
+
+store.replace_state(read_dynamic(tracked_contracts, block))
+
+for registered_address, contract, state in store.rows():
+  print_cache(registered_address, contract_row(contract, state))
 
 write_csv()
+
+if args.watch:
+  print('Watching new blocks from block %d' % (block))
+  try:
+    watch(block, args.watch)
+  except KeyboardInterrupt:
+    pass
+
+if executor:
+  executor.shutdown(wait=False, cancel_futures=True)
@@ -1,114 +1,409 @@
 #!/usr/bin/env python3
 
-import time
 import datetime
 import argparse
-from web3 import Web3
-from dotenv import load_dotenv
-import requests
-import os
+import concurrent.futures
+import sys
+import cli
 
-load_dotenv()
+# default TWAP period in minutes:
+DEFAULT_PERIOD = 2
 
-# etherscan.io API:
-etherscan_api = "https://api.etherscan.io/api"
+# Pool addresses from a file, one per line, empty lines and lines starting with # are skipped:
+def read_pools(path):
+  with open(path, 'r') as f:
+    return [line.strip() for line in f if line.strip() != '' and not line.strip().startswith('#')]
 
-# Get API keys from .env file:
-etherscan_key = os.environ.get("ETHERSCAN_KEY")
-alchemy_key = os.environ.get("ALCHEMY_KEY")
+def token_calls(token_address):
+  functions = contracts.load_token(w3, token_address).functions
+  return {
+      'symbol': functions.symbol(),
+      'decimals': functions.decimals(),
+  }
 
-# default TWAP period in minutes:
-DEFAULT_PERIOD = 2
+# Tokens of all pools with their symbols and decimals, read in two multicall passes:
+def pool_tokens(pool_contracts):
+  pool_results = multicall.aggregate_named(w3, [{'token0': pool_contract.functions.token0(), 'token1': pool_contract.functions.token1()} for pool_contract in pool_contracts])
+  token_addresses = []
+  for pool_contract, results in zip(pool_contracts, pool_results):
+    if None in results.values():
+      sys.exit("Failed reading tokens of pool %s" % (pool_contract.address))
+    for token_address in (results['token0'], results['token1']):
+      if token_address not in token_addresses:
+        token_addresses.append(token_address)
+  token_results = dict(zip(token_addresses, multicall.aggregate_named(w3, [token_calls(token_address) for token_address in token_addresses])))
+  for token_address, results in token_results.items():
+    if None in results.values():
+      sys.exit("Failed reading token %s" % (token_address))
+  return [(dict(token_results[results['token0']], address=results['token0']), dict(token_results[results['token1']], address=results['token1'])) for results in pool_results]
+
+# Pools are read with the ABI of the first pool, hence, all of them must answer slot0() (Uniswap V3) or getReserves() (Uniswap V2) like it:
+def check_pool_versions(pool_contracts, v3):
+  version_calls = [contract.functions.slot0() if v3 else contract.functions.getReserves() for contract in pool_contracts]
+  other_pools = [contract.address for contract, result in zip(pool_contracts, multicall.aggregate(w3, version_calls)) if result is None]
+  if other_pools != []:
+    sys.exit("Pools of different Uniswap versions cannot be read together: %s is a Uniswap %s pool, these pools are not: %s" % (pool_contracts[0].address, 'V3' if v3 else 'V2', ', '.join(other_pools)))
 
-# Some tokens don't have ABI available, hence, use WETH for all ERC-20 tokens:
-weth_address = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
+def sample_calls(contract):
+  return {
+      'price_0_cumulative': contract.functions.price0CumulativeLast(),
+      'price_1_cumulative': contract.functions.price1CumulativeLast(),
+      'reserves': contract.functions.getReserves(),
+  }
+
+def fetch_sample(block):
+  return multicall.aggregate_named(w3, [sample_calls(pool_contract)], block)[0]
+
+# Cumulative prices and reserves of all pools at the block in one multicall:
+def fetch_pool_samples(block):
+  samples = multicall.aggregate_named(w3, [sample_calls(contract) for contract in pool_contracts], block)
+  for contract, sample in zip(pool_contracts, samples):
+    if None in sample.values():
+      sys.exit("Failed reading pool %s at block %d" % (contract.address, block))
+  return samples
+
+# TWAP of both prices between two samples, with cumulative prices moved to block timestamps as in UniswapV2OracleLibrary.currentCumulativePrices:
+def window_twap(sample_1, sample_2, timestamp_1, timestamp_2, decimals_0, decimals_1):
+  reserves_1 = sample_1['reserves']
+  reserves_2 = sample_2['reserves']
+  twap_0 = (sample_2['price_0_cumulative'] + int((reserves_2[1] / reserves_2[0] * (timestamp_2 - reserves_2[2])) * 2 ** 112) - (sample_1['price_0_cumulative'] + int((reserves_1[1] / reserves_1[0] * (timestamp_1 - reserves_1[2])) * 2 ** 112))) / (timestamp_2 - timestamp_1) / 2 ** 112 / 10 ** (decimals_1 - decimals_0)
+  twap_1 = (sample_2['price_1_cumulative'] + int((reserves_2[0] / reserves_2[1] * (timestamp_2 - reserves_2[2])) * 2 ** 112) - (sample_1['price_1_cumulative'] + int((reserves_1[0] / reserves_1[1] * (timestamp_1 - reserves_1[2])) * 2 ** 112))) / (timestamp_2 - timestamp_1) / 2 ** 112 / 10 ** (decimals_0 - decimals_1)
+  return twap_0, twap_1
+
+# Fetch cumulative prices and reserves once per block, with one multicall per block:
+def fetch_samples(sample_blocks):
+  if executor:
+    results = list(executor.map(fetch_sample, sample_blocks))
+  else:
+    results = [fetch_sample(block) for block in sample_blocks]
+  for block, sample in zip(sample_blocks, results):
+    if None in sample.values():
+      sys.exit("Failed reading pool at block %d" % (block))
+  return results
 
-def load_abi(abi_address):
-  API_ENDPOINT = etherscan_api+"?module=contract&action=getabi&address="+str(abi_address)+"&apikey="+etherscan_key
-  r = requests.get(url = API_ENDPOINT)
-  response = r.json()
-  return response["result"]
+# TWAP for windows of period minutes ending every step minutes from start to end timestamp.
+# Window endpoints falling into the same block share one sample:
+def twap_series(start, end, step, period):
+  end_timestamps = numpy.arange(start, end + 1, step * 60, dtype=numpy.int64)
+  start_timestamps = end_timestamps - period * 60
+  block_at = {sample_timestamp: blocks.get_block(sample_timestamp) for sample_timestamp in sorted(set(end_timestamps.tolist()) | set(start_timestamps.tolist()))}
+  sample_blocks = sorted(set(block_at.values()))
+  samples = fetch_samples(sample_blocks)
 
-def load_token(token_address):
-  ABI = load_abi(weth_address)
-  return w3.eth.contract(address=token_address, abi=ABI)
+  sample_timestamps = numpy.array([blocks.get_timestamp(block) for block in sample_blocks], dtype=numpy.float64)
+  # Cumulative prices are UQ112x112 sums exceeding float precision, hence, convert offsets from the first sample:
+  base_0 = samples[0]['price_0_cumulative']
+  base_1 = samples[0]['price_1_cumulative']
+  cumulative_0 = numpy.array([(sample['price_0_cumulative'] - base_0) / 2 ** 112 for sample in samples], dtype=numpy.float64)
+  cumulative_1 = numpy.array([(sample['price_1_cumulative'] - base_1) / 2 ** 112 for sample in samples], dtype=numpy.float64)
+  reserve_0 = numpy.array([sample['reserves'][0] for sample in samples], dtype=numpy.float64)
+  reserve_1 = numpy.array([sample['reserves'][1] for sample in samples], dtype=numpy.float64)
+  elapsed = sample_timestamps - numpy.array([sample['reserves'][2] for sample in samples], dtype=numpy.float64)
 
-def load_contract(contract_address):
-  ABI = load_abi(contract_address)
-  return w3.eth.contract(address=contract_address, abi=ABI)
+  sample_index = {block: i for i, block in enumerate(sample_blocks)}
+  index_1 = numpy.array([sample_index[block_at[sample_timestamp]] for sample_timestamp in start_timestamps.tolist()], dtype=numpy.int64)
+  index_2 = numpy.array([sample_index[block_at[sample_timestamp]] for sample_timestamp in end_timestamps.tolist()], dtype=numpy.int64)
 
-def get_block(timestamp):
-  API_ENDPOINT = etherscan_api+"?module=block&action=getblocknobytime&closest=before&timestamp="+str(timestamp)+"&apikey="+etherscan_key
-  r = requests.get(url = API_ENDPOINT)
-  response = r.json()
-  return int(response["result"])
+  with numpy.errstate(divide='ignore', invalid='ignore'):
+    # Counterfactual cumulative prices at block timestamps (as in UniswapV2OracleLibrary.currentCumulativePrices):
+    cumulative_0 = cumulative_0 + reserve_1 / reserve_0 * elapsed
+    cumulative_1 = cumulative_1 + reserve_0 / reserve_1 * elapsed
+    duration = sample_timestamps[index_2] - sample_timestamps[index_1]
+    twap_0 = (cumulative_0[index_2] - cumulative_0[index_1]) / duration / 10 ** (token1_decimals - token0_decimals)
+    twap_1 = (cumulative_1[index_2] - cumulative_1[index_1]) / duration / 10 ** (token0_decimals - token1_decimals)
+    price_0 = reserve_1[index_2] / reserve_0[index_2] / 10 ** (token1_decimals - token0_decimals)
+    price_1 = reserve_0[index_2] / reserve_1[index_2] / 10 ** (token0_decimals - token1_decimals)
+
+  return {
+      'timestamp': end_timestamps,
+      'block_1': numpy.array(sample_blocks, dtype=numpy.int64)[index_1],
+      'block_2': numpy.array(sample_blocks, dtype=numpy.int64)[index_2],
+      'timestamp_1': sample_timestamps[index_1].astype(numpy.int64),
+      'timestamp_2': sample_timestamps[index_2].astype(numpy.int64),
+      'price_0': price_0,
+      'twap_0': twap_0,
+      'price_1': price_1,
+      'twap_1': twap_1,
+  }
+
+# Table with one row per pool for the window between two blocks, sampled with one multicall per block:
+def pool_table(block_1, block_2, timestamp_1, timestamp_2):
+  table = {column: [] for column in ('pool', 'symbol_0', 'symbol_1', 'block_1', 'block_2', 'timestamp_1', 'timestamp_2', 'price_0', 'twap_0', 'price_1', 'twap_1')}
+  for address, (token_0, token_1), sample_1, sample_2 in zip(pool_addresses, tokens, fetch_pool_samples(block_1), fetch_pool_samples(block_2)):
+    twap_0, twap_1 = window_twap(sample_1, sample_2, timestamp_1, timestamp_2, token_0['decimals'], token_1['decimals'])
+    reserves = sample_2['reserves']
+    table['pool'].append(address)
+    table['symbol_0'].append(token_0['symbol'])
+    table['symbol_1'].append(token_1['symbol'])
+    table['block_1'].append(block_1)
+    table['block_2'].append(block_2)
+    table['timestamp_1'].append(timestamp_1)
+    table['timestamp_2'].append(timestamp_2)
+    table['price_0'].append(reserves[1] / reserves[0] / 10 ** (token_1['decimals'] - token_0['decimals']))
+    table['twap_0'].append(twap_0)
+    table['price_1'].append(reserves[0] / reserves[1] / 10 ** (token_0['decimals'] - token_1['decimals']))
+    table['twap_1'].append(twap_1)
+  return table
+
+# Same table from the local Sync event series of every pool, windows are exact timestamps instead of blocks:
+def sync_pool_table(timestamp_1, timestamp_2):
+  table = {column: [] for column in ('pool', 'symbol_0', 'symbol_1', 'timestamp_1', 'timestamp_2', 'price_0', 'twap_0', 'price_1', 'twap_1')}
+  for address, (token_0, token_1), pool_series in zip(pool_addresses, tokens, all_series):
+    try:
+      twap_0, twap_1 = pool_series.twap([timestamp_1], [timestamp_2])
+      reserve_0, reserve_1 = pool_series.reserves_at([timestamp_2])
+    except ValueError as error:
+      sys.exit(str(error))
+    table['pool'].append(address)
+    table['symbol_0'].append(token_0['symbol'])
+    table['symbol_1'].append(token_1['symbol'])
+    table['timestamp_1'].append(timestamp_1)
+    table['timestamp_2'].append(timestamp_2)
+    table['price_0'].append(reserve_1[0] / reserve_0[0] / 10 ** (token_1['decimals'] - token_0['decimals']))
+    table['twap_0'].append(twap_0[0] / 10 ** (token_1['decimals'] - token_0['decimals']))
+    table['price_1'].append(reserve_0[0] / reserve_1[0] / 10 ** (token_0['decimals'] - token_1['decimals']))
+    table['twap_1'].append(twap_1[0] / 10 ** (token_0['decimals'] - token_1['decimals']))
+  return table
+
+# TWAP series from the local Sync event series, windows are exact timestamps instead of blocks:
+def sync_twap_series(start, end, step, period):
+  end_timestamps = numpy.arange(start, end + 1, step * 60, dtype=numpy.int64)
+  start_timestamps = end_timestamps - period * 60
+  try:
+    twap_0, twap_1 = series.twap(start_timestamps, end_timestamps)
+    reserve_0, reserve_1 = series.reserves_at(end_timestamps)
+  except ValueError as error:
+    sys.exit(str(error))
+  with numpy.errstate(divide='ignore', invalid='ignore'):
+    return {
+        'timestamp': end_timestamps,
+        'timestamp_1': start_timestamps,
+        'price_0': reserve_1 / reserve_0 / 10 ** (token1_decimals - token0_decimals),
+        'twap_0': twap_0 / 10 ** (token1_decimals - token0_decimals),
+        'price_1': reserve_0 / reserve_1 / 10 ** (token0_decimals - token1_decimals),
+        'twap_1': twap_1 / 10 ** (token0_decimals - token1_decimals),
+    }
+
+# TWAP series from batched observe() calls of a Uniswap V3 pool, windows are exact timestamps instead of blocks:
+def observe_twap_series(start, end, step, period):
+  end_timestamps = numpy.arange(start, end + 1, step * 60, dtype=numpy.int64)
+  start_timestamps = end_timestamps - period * 60
+  try:
+    cumulatives = v3_oracle.tick_cumulatives(w3, blocks, pool_contract, set(start_timestamps.tolist()) | set(end_timestamps.tolist()) | set((end_timestamps - 1).tolist()))
+  except ValueError as error:
+    sys.exit(str(error))
+  twap_0 = v3_oracle.mean_prices(cumulatives, start_timestamps, end_timestamps) / 10 ** (token1_decimals - token0_decimals)
+  price_0 = v3_oracle.spot_prices(cumulatives, end_timestamps) / 10 ** (token1_decimals - token0_decimals)
+  return {
+      'timestamp': end_timestamps,
+      'timestamp_1': start_timestamps,
+      'price_0': price_0,
+      'twap_0': twap_0,
+      'price_1': 1 / price_0,
+      'twap_1': 1 / twap_0,
+  }
+
+# Tick cumulatives of all Uniswap V3 pools around the window endpoints (spot prices are from the second before them) in one multicall:
+def observe_window(timestamp_1, timestamp_2):
+  try:
+    return v3_oracle.pool_tick_cumulatives(w3, blocks, pool_contracts, [timestamp_1 - 1, timestamp_1, timestamp_2 - 1, timestamp_2])
+  except ValueError as error:
+    sys.exit(str(error))
+
+# Same table as sync_pool_table for Uniswap V3 pools:
+def observe_pool_table(timestamp_1, timestamp_2):
+  table = {column: [] for column in ('pool', 'symbol_0', 'symbol_1', 'timestamp_1', 'timestamp_2', 'price_0', 'twap_0', 'price_1', 'twap_1')}
+  for address, (token_0, token_1), cumulatives in zip(pool_addresses, tokens, observe_window(timestamp_1, timestamp_2)):
+    price_0 = v3_oracle.spot_prices(cumulatives, [timestamp_2])[0] / 10 ** (token_1['decimals'] - token_0['decimals'])
+    twap_0 = v3_oracle.mean_prices(cumulatives, [timestamp_1], [timestamp_2])[0] / 10 ** (token_1['decimals'] - token_0['decimals'])
+    table['pool'].append(address)
+    table['symbol_0'].append(token_0['symbol'])
+    table['symbol_1'].append(token_1['symbol'])
+    table['timestamp_1'].append(timestamp_1)
+    table['timestamp_2'].append(timestamp_2)
+    table['price_0'].append(price_0)
+    table['twap_0'].append(twap_0)
+    table['price_1'].append(1 / price_0)
+    table['twap_1'].append(1 / twap_0)
+  return table
 
 parser = argparse.ArgumentParser()
-parser.add_argument("contract", type=str, help="calculate TWAP for this pool address")
+parser.add_argument("contracts", type=str, nargs="*", metavar="contract", help="calculate TWAP for these pool addresses (a table with one row per pool is written for several pools)")
+parser.add_argument("--pools", type=str, metavar="FILE", help="also calculate TWAP for pool addresses in this file, one per line")
 parser.add_argument("-t", "--timestamp", type=str, help="calculate TWAP ending at this timestamp")
 parser.add_argument("-p", "--period", type=int, help="TWAP period in minutes")
 parser.add_argument("-b", "--block", type=int, help="calculate TWAP ending at this block")
 parser.add_argument("-f", "--first_block", type=int, help="calculate TWAP starting at this block")
+parser.add_argument("--series", type=int, nargs=2, metavar=("START", "END"), help="calculate TWAP series for windows ending between these timestamps")
+parser.add_argument("-s", "--step", type=int, help="TWAP series step in minutes (default: period)")
+parser.add_argument("-o", "--output", type=str, default="-", help="TWAP series or multiple pools output file (.csv, .tsv or .parquet, default stdout)")
+parser.add_argument("-w", "--workers", type=int, default=1, help="number of concurrent workers for TWAP series")
+parser.add_argument("-e", "--engine", choices=["call", "sync"], default="call", help="read cumulative prices of Uniswap V2 pools with archive eth_call or reconstruct them from Sync events (Uniswap V3 pools are always read with observe())")
+cli.add_arguments(parser, rpc_cache=True, rate_limits=True)
 args = parser.parse_args()
 
-# HTTPProvider:
-w3 = Web3(Web3.HTTPProvider('https://eth-mainnet.alchemyapi.io/v2/'+alchemy_key))
+pool_addresses = args.contracts
+if args.pools:
+  pool_addresses = pool_addresses + read_pools(args.pools)
+if pool_addresses == []:
+  sys.exit("Provide at least one pool address or --pools file")
+if args.series and len(pool_addresses) > 1:
+  sys.exit("TWAP series are calculated for a single pool")
+if args.series and args.series[0] > args.series[1]:
+  sys.exit("TWAP series START timestamp is after END timestamp")
+if args.step is not None and args.step <= 0:
+  sys.exit("TWAP series step must be a positive number of minutes")
+
+w3 = cli.setup(args)
+
+import numpy
+import abi_cache
+import block_index
+import cassette
+import multicall
+import tables
+import sync_series
+import v3_oracle
+import contracts
 
-pool_address = args.contract
+blocks = block_index.BlockIndex(w3)
+
+if args.workers > 1:
+  executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.workers)
+else:
+  executor = None
+
+# All pools are of the same Uniswap version (see check_pool_versions), hence, use the ABI of the first pool for all of them:
+pair_abi = abi_cache.load_abi(w3.toChecksumAddress(pool_addresses[0]))
+v3 = v3_oracle.is_v3(pair_abi)
+if v3 and args.engine == 'sync':
+  sys.exit("Sync engine reads Uniswap V2 pools only, Uniswap V3 pools are read with observe()")
+pool_contracts = [w3.eth.contract(address=w3.toChecksumAddress(address), abi=pair_abi) for address in pool_addresses]
+if len(pool_contracts) > 1:
+  check_pool_versions(pool_contracts, v3)
+tokens = pool_tokens(pool_contracts)
+
+pool_contract = pool_contracts[0]
+
+token0_address = tokens[0][0]['address']
+token1_address = tokens[0][1]['address']
+token0_decimals = tokens[0][0]['decimals']
+token1_decimals = tokens[0][1]['decimals']
+token0_symbol = tokens[0][0]['symbol']
+token1_symbol = tokens[0][1]['symbol']
 
 if args.timestamp:
   timestamp = int(args.timestamp)
 else:
-  timestamp = int(time.time())
+  timestamp = int(cassette.now())
 
 if args.period:
   period = args.period
 else:
   period = DEFAULT_PERIOD
 
+if args.engine == 'sync':
+  # Series of all pools are updated up to the same head:
+  head = w3.eth.blockNumber
+  all_series = [sync_series.SyncSeries(w3, address, blocks) for address in pool_addresses]
+  for pool_series in all_series:
+    pool_series.update(head)
+  series = all_series[0]
+
+if args.series:
+  if args.step:
+    step = args.step
+  else:
+    step = period
+  print('Calculating %dm TWAP series of %s/%s every %dm from %s UTC to %s UTC' % (period, token0_symbol, token1_symbol, step, datetime.datetime.utcfromtimestamp(args.series[0]), datetime.datetime.utcfromtimestamp(args.series[1])), file=sys.stderr)
+  if v3:
+    tables.write_table(args.output, observe_twap_series(args.series[0], args.series[1], step, period))
+  elif args.engine == 'sync':
+    tables.write_table(args.output, sync_twap_series(args.series[0], args.series[1], step, period))
+  else:
+    tables.write_table(args.output, twap_series(args.series[0], args.series[1], step, period))
+  sys.exit()
+
+if args.engine == 'sync' or v3:
+  if args.block:
+    timestamp = blocks.get_timestamp(args.block)
+    if args.first_block:
+      timestamp_1 = blocks.get_timestamp(args.first_block)
+      period = (timestamp - timestamp_1) / 60
+    else:
+      timestamp_1 = int(timestamp - period * 60)
+  else:
+    if v3 and not args.timestamp:
+      # observe() cannot look past the chain head:
+      timestamp = blocks.get_head()[1]
+    timestamp_1 = int(timestamp - period * 60)
+  if len(pool_addresses) > 1:
+    print('Calculating TWAP of %d pools ending at %s UTC for %.2fm period' % (len(pool_addresses), datetime.datetime.utcfromtimestamp(timestamp), period), file=sys.stderr)
+    if v3:
+      tables.write_table(args.output, observe_pool_table(timestamp_1, timestamp))
+    else:
+      tables.write_table(args.output, sync_pool_table(timestamp_1, timestamp))
+    sys.exit()
+  print('Calculating TWAP ending at %s UTC for %.2fm period' % (datetime.datetime.utcfromtimestamp(timestamp), period))
+  if v3:
+    cumulatives = observe_window(timestamp_1, timestamp)[0]
+    prices_0 = v3_oracle.spot_prices(cumulatives, [timestamp_1, timestamp]) / 10 ** (token1_decimals - token0_decimals)
+    prices_1 = 1 / prices_0
+    twap_0 = v3_oracle.mean_prices(cumulatives, [timestamp_1], [timestamp])[0] / 10 ** (token1_decimals - token0_decimals)
+    twap_1 = 1 / twap_0
+  else:
+    try:
+      twap_0, twap_1 = series.twap([timestamp_1], [timestamp])
+      reserve_0, reserve_1 = series.reserves_at([timestamp_1, timestamp])
+    except ValueError as error:
+      sys.exit(str(error))
+    prices_0 = reserve_1 / reserve_0 / 10 ** (token1_decimals - token0_decimals)
+    prices_1 = reserve_0 / reserve_1 / 10 ** (token0_decimals - token1_decimals)
+    twap_0 = twap_0[0] / 10 ** (token1_decimals - token0_decimals)
+    twap_1 = twap_1[0] / 10 ** (token0_decimals - token1_decimals)
+  print('Token 1: %s at %s, %d digits' % (token0_symbol, token0_address, token0_decimals))
+  print('Token 2: %s at %s, %d digits' % (token1_symbol, token1_address, token1_decimals))
+  print('%s/%s:' % (token0_symbol, token1_symbol))
+  print('At %s UTC: %f' % (datetime.datetime.utcfromtimestamp(timestamp_1), prices_0[0]))
+  print('At %s UTC: %f' % (datetime.datetime.utcfromtimestamp(timestamp), prices_0[1]))
+  print('TWAP: %f' % (twap_0))
+  print('%s/%s:' % (token1_symbol, token0_symbol))
+  print('At %s UTC: %f' % (datetime.datetime.utcfromtimestamp(timestamp_1), prices_1[0]))
+  print('At %s UTC: %f' % (datetime.datetime.utcfromtimestamp(timestamp), prices_1[1]))
+  print('TWAP: %f' % (twap_1))
+  sys.exit()
+
 if args.block:
   block_2 = args.block
-  timestamp = w3.eth.getBlock(block_2).timestamp
+  timestamp = blocks.get_timestamp(block_2)
   if args.first_block:
     block_1 = args.first_block
-    period = (timestamp - w3.eth.getBlock(block_1).timestamp) / 60
+    period = (timestamp - blocks.get_timestamp(block_1)) / 60
   else:
-    block_1 = get_block(str(int(w3.eth.getBlock(block_2).timestamp-period*60))) 
+    block_1 = blocks.get_block(int(blocks.get_timestamp(block_2) - period * 60))
 elif args.timestamp:
-  block_2 = get_block(timestamp)
-  block_1 = get_block(str(timestamp-period*60))
+  block_2 = blocks.get_block(timestamp)
+  block_1 = blocks.get_block(int(timestamp - period * 60))
 else:
   block_2 = w3.eth.blockNumber
-  block_1 = get_block(str(timestamp-period*60))
-
-print('Calculating TWAP ending at %s UTC for %.2fm period' % (datetime.datetime.utcfromtimestamp(timestamp), period))
+  block_1 = blocks.get_block(int(timestamp - period * 60))
 
-timestamp_1 = w3.eth.getBlock(block_1).timestamp
-timestamp_2 = w3.eth.getBlock(block_2).timestamp
+timestamp_1 = blocks.get_timestamp(block_1)
+timestamp_2 = blocks.get_timestamp(block_2)
 
-pool_contract = load_contract(w3.toChecksumAddress(pool_address))
+if len(pool_addresses) > 1:
+  print('Calculating TWAP of %d pools ending at %s UTC for %.2fm period' % (len(pool_addresses), datetime.datetime.utcfromtimestamp(timestamp), period), file=sys.stderr)
+  tables.write_table(args.output, pool_table(block_1, block_2, timestamp_1, timestamp_2))
+  sys.exit()
 
-price_0_cumulative_1 = pool_contract.functions.price0CumulativeLast().call(block_identifier=block_1)
-price_0_cumulative_2 = pool_contract.functions.price0CumulativeLast().call(block_identifier=block_2)
-price_1_cumulative_1 = pool_contract.functions.price1CumulativeLast().call(block_identifier=block_1)
-price_1_cumulative_2 = pool_contract.functions.price1CumulativeLast().call(block_identifier=block_2)
-
-reserves_1 = pool_contract.functions.getReserves().call(block_identifier=block_1)
-reserves_2 = pool_contract.functions.getReserves().call(block_identifier=block_2)
-
-token0_address = pool_contract.functions.token0().call()
-token1_address = pool_contract.functions.token1().call()
-token0_contract = load_token(token0_address)
-token1_contract = load_token(token1_address)
-
-token0_decimals = token0_contract.functions.decimals().call()
-token1_decimals = token1_contract.functions.decimals().call()
+print('Calculating TWAP ending at %s UTC for %.2fm period' % (datetime.datetime.utcfromtimestamp(timestamp), period))
 
-twap_0 = (price_0_cumulative_2 + int((reserves_2[1] / reserves_2[0] * (timestamp_2 - reserves_2[2])) * 2 ** 112) - (price_0_cumulative_1 + int((reserves_1[1] / reserves_2[0] * (timestamp_1 - reserves_1[2])) * 2 ** 112))) / (timestamp_2 - timestamp_1) / 2 ** 112 / 10 ** (token1_decimals - token0_decimals)
-twap_1 = (price_1_cumulative_2 + int((reserves_2[0] / reserves_2[1] * (timestamp_2 - reserves_2[2])) * 2 ** 112) - (price_1_cumulative_1 + int((reserves_1[0] / reserves_2[1] * (timestamp_1 - reserves_1[2])) * 2 ** 112))) / (timestamp_2 - timestamp_1) / 2 ** 112 / 10 ** (token0_decimals - token1_decimals)
+sample_1 = fetch_pool_samples(block_1)[0]
+sample_2 = fetch_pool_samples(block_2)[0]
+reserves_1 = sample_1['reserves']
+reserves_2 = sample_2['reserves']
 
-token0_symbol = token0_contract.functions.symbol().call()
-token1_symbol = token1_contract.functions.symbol().call()
+twap_0, twap_1 = window_twap(sample_1, sample_2, timestamp_1, timestamp_2, token0_decimals, token1_decimals)
 
 print('Token 1: %s at %s, %d digits' % (token0_symbol, token0_address, token0_decimals))
 print('Token 2: %s at %s, %d digits' % (token1_symbol, token1_address, token1_decimals))
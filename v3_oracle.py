@@ -0,0 +1,82 @@
+import bisect
+import json
+import numpy
+import multicall
+
+# Price of token0 in token1 (raw units) at a tick is TICK_BASE ** tick:
+TICK_BASE = 1.0001
+
+# Maximum number of secondsAgos in a single observe() call, each one is a binary search over the observations:
+OBSERVE_BATCH = 1000
+
+# Pools with observe() in their ABI (json string as returned by Etherscan) are Uniswap V3 pools:
+def is_v3(abi):
+  return any(entry.get('type') == 'function' and entry.get('name') == 'observe' for entry in json.loads(abi))
+
+# First block at or after timestamp, observe() at this block answers for all earlier timestamps within pool history:
+def observe_block(blocks, timestamp):
+  head, head_timestamp = blocks.get_head()
+  if timestamp > head_timestamp:
+    raise ValueError("Timestamp %d is after the chain head" % (timestamp))
+  block = blocks.get_block(timestamp)
+  if blocks.get_timestamp(block) < timestamp:
+    block += 1
+  return block, blocks.get_timestamp(block)
+
+# Seconds of history covered by the observation buffer of the pool at the block. The oldest observation is in the slot
+# after the latest one, or in slot 0 until the buffer of observationCardinality slots has wrapped:
+def observation_span(w3, contract, block, block_timestamp):
+  slot0 = multicall.aggregate(w3, [contract.functions.slot0()], block)[0]
+  if slot0 is None:
+    raise ValueError("Failed reading slot0 of pool %s at block %d" % (contract.address, block))
+  observation_index, cardinality = slot0[2], slot0[3]
+  oldest, first = multicall.aggregate(w3, [contract.functions.observations((observation_index + 1) % cardinality), contract.functions.observations(0)], block)
+  if oldest is None or first is None:
+    raise ValueError("Failed reading observations of pool %s at block %d" % (contract.address, block))
+  observation = oldest if oldest[3] else first
+  return (block_timestamp - observation[0]) % 2 ** 32
+
+# Tick cumulatives of the pool at timestamps (up to the head timestamp) with as few observe() calls as possible. Each call
+# is made at the first block after the latest pending timestamp and covers all earlier ones within the observation history
+# measured at the head, calls reverting with OLD (e.g. the pool had fewer observations back then) are retried with half of it:
+def tick_cumulatives(w3, blocks, contract, timestamps):
+  head, head_timestamp = blocks.get_head()
+  span = observation_span(w3, contract, head, head_timestamp)
+  pending = sorted(set(int(timestamp) for timestamp in timestamps))
+  results = {}
+  while pending != []:
+    block, block_timestamp = observe_block(blocks, pending[-1])
+    first = min(max(bisect.bisect_left(pending, block_timestamp - span), len(pending) - OBSERVE_BATCH), len(pending) - 1)
+    batch = pending[first:]
+    result = multicall.aggregate(w3, [contract.functions.observe([block_timestamp - timestamp for timestamp in batch])], block)[0]
+    if result is None:
+      if len(batch) == 1:
+        raise ValueError("Failed observing pool %s at block %d for timestamp %d, it has no older observations" % (contract.address, block, batch[0]))
+      span //= 2
+      continue
+    results.update(zip(batch, result[0]))
+    pending = pending[:first]
+  return results
+
+# Tick cumulatives of all pools at timestamps with one observe() call per pool, aggregated at a single block:
+def pool_tick_cumulatives(w3, blocks, contracts, timestamps):
+  timestamps = [int(timestamp) for timestamp in timestamps]
+  block, block_timestamp = observe_block(blocks, max(timestamps))
+  results = multicall.aggregate(w3, [contract.functions.observe([block_timestamp - timestamp for timestamp in timestamps]) for contract in contracts], block)
+  for contract, result in zip(contracts, results):
+    if result is None:
+      raise ValueError("Failed observing pool %s at block %d, the window is older than its observations" % (contract.address, block))
+  return [dict(zip(timestamps, result[0])) for result in results]
+
+# Geometric mean prices of token0 in token1 (raw units) between timestamps from tick cumulatives. Unlike OracleLibrary.consult
+# the mean tick is not rounded down to an integer tick:
+def mean_prices(cumulatives, timestamps_1, timestamps_2):
+  tick_cumulatives_1 = numpy.array([cumulatives[int(timestamp)] for timestamp in timestamps_1], dtype=numpy.int64)
+  tick_cumulatives_2 = numpy.array([cumulatives[int(timestamp)] for timestamp in timestamps_2], dtype=numpy.int64)
+  ticks = (tick_cumulatives_2 - tick_cumulatives_1) / (numpy.asarray(timestamps_2, dtype=numpy.float64) - numpy.asarray(timestamps_1, dtype=numpy.float64))
+  return numpy.power(TICK_BASE, ticks)
+
+# Prices of token0 in token1 (raw units) at timestamps, from the tick in force during the second before each of them:
+def spot_prices(cumulatives, timestamps):
+  timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+  return mean_prices(cumulatives, timestamps - 1, timestamps)